@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from tools.cache import hash_file
+
+# ==========================================
+# 🌟 Pipeline Checkpoints
+# ==========================================
+# Every run with a workspace keeps a manifest (checkpoint.json) of the tool stages it completed: the
+# tool, its arguments, the content hashes of its input files, its result and the files it produced.
+# When the run is retried in the same workspace (after a transient failure such as an LLM timeout at
+# turn 8, or after its worker died and the job's lease expired, see agent/jobs.py), stages whose inputs and outputs are unchanged return their recorded result instead of
+# running Demucs / Basic-Pitch / MusicGen again, and the LLM loop continues from its last saved turn.
+# Only stages of earlier attempts are reused, each at most once: within one attempt, a repeated call (e.g. an
+# unseeded generate_music asked for a second variation) always runs.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-Checkpoint")
+
+CHECKPOINT_FILE = "checkpoint.json"
+# Set to 0 to always rerun every stage
+CHECKPOINTS_ENABLED = os.getenv("MUSIC_AGENT_CHECKPOINTS", "1") != "0"
+
+
+def _fingerprint(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _input_files(value) -> list:
+    """The existing files referenced by a tool's arguments (plain paths or lists of paths)."""
+    if isinstance(value, str):
+        return [value] if os.path.isfile(value) else []
+    if isinstance(value, (list, tuple)):
+        return [path for item in value for path in _input_files(item)]
+    if isinstance(value, dict):
+        return [path for item in value.values() for path in _input_files(item)]
+    return []
+
+
+class Checkpoint:
+    """
+    The durable manifest of one run's completed stages (and of its LLM conversation), stored in its workspace.
+    Safe to use from the parallel tool threads of a run; every update is written atomically.
+    """
+
+    def __init__(self, workspace_dir: str):
+        self.path = Path(workspace_dir) / CHECKPOINT_FILE
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {"stages": {}, "conversation": None}
+        # Stages completed by earlier attempts that this attempt has not reused yet
+        self._resumable = set(self.manifest["stages"])
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _stage_key(tool_name: str, args: dict) -> tuple:
+        """Identifies a stage by its tool, its arguments and the content of every input file they point to."""
+        input_hashes = {path: hash_file(path) for path in sorted(set(_input_files(args)))}
+        payload = json.dumps({"tool": tool_name, "args": args, "inputs": input_hashes}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest(), input_hashes
+
+    # ------------------------------------------
+    # Stages
+    # ------------------------------------------
+
+    def completed_stage(self, tool_name: str, args: dict):
+        """Returns the recorded result of an identical stage of an earlier attempt whose outputs are still intact, or None."""
+        key, _ = self._stage_key(tool_name, args)
+        with self._lock:
+            if key not in self._resumable:
+                return None
+            self._resumable.discard(key)
+            stage = self.manifest["stages"].get(key)
+            if stage is None:
+                return None
+            if any(_fingerprint(path) != fingerprint for path, fingerprint in stage["artifacts"].items()):
+                logger.info(f"Outputs of checkpointed stage '{tool_name}' changed on disk, running it again")
+                del self.manifest["stages"][key]
+                self._save()
+                return None
+        return stage["result"]
+
+    def record_stage(self, tool_name: str, args: dict, result: dict, artifact_paths: list):
+        """Records a successfully completed stage together with the files it produced."""
+        key, input_hashes = self._stage_key(tool_name, args)
+        artifacts = {path: _fingerprint(path) for path in artifact_paths}
+        if any(fingerprint is None for fingerprint in artifacts.values()):
+            return
+        with self._lock:
+            self.manifest["stages"][key] = {
+                "tool": tool_name,
+                "args": args,
+                "input_hashes": input_hashes,
+                "result": result,
+                "artifacts": artifacts,
+                "finished": time.time(),
+            }
+            self._save()
+
+    # ------------------------------------------
+    # LLM conversation
+    # ------------------------------------------
+
+    def conversation_state(self, user_prompt: str):
+        """The saved conversation of an earlier attempt at the same request, or None."""
+        with self._lock:
+            saved = self.manifest.get("conversation")
+        if saved is None or saved["prompt"] != user_prompt:
+            return None
+        return saved["state"]
+
+    def save_conversation(self, user_prompt: str, state: dict):
+        with self._lock:
+            self.manifest["conversation"] = {"prompt": user_prompt, "state": state, "saved": time.time()}
+            self._save()
@@ -0,0 +1,186 @@
+import os
+import json
+
+# ==========================================
+# 🌟 LLM Conversation Context
+# ==========================================
+# The agent loop resends the whole history on every turn, so everything added to it is paid for
+# again on each later turn. Tool results go in as compact summaries, failed calls that were retried
+# are dropped, and once the history exceeds a budget the oldest turns are folded into short notes.
+# Messages already sent are never rewritten otherwise, so the provider's prefix cache
+# (system prompt + tool schemas + earlier turns) stays valid from one turn to the next.
+
+# Rough size budget for the turn history (characters of JSON), beyond which old turns are folded into notes
+MAX_CONTEXT_CHARS = int(os.getenv("MUSIC_AGENT_MAX_CONTEXT_CHARS", "12000"))
+# The most recent turns always stay verbatim
+KEEP_RECENT_TURNS = 2
+
+MAX_ERROR_CHARS = 400
+MAX_TEXT_CHARS = 200
+MAX_LIST_ITEMS = 16
+MAX_NOTE_CHARS = 600
+
+# Result fields the LLM does not need back (e.g. the generator's description echoes the prompt the LLM just wrote)
+DROPPED_RESULT_KEYS = {"description"}
+# Path-valued fields besides "*_path" / "*_paths": the LLM passes these to the next tool, so they are never cut
+PATH_RESULT_KEYS = {"tracks"}
+
+
+def _cap(text: str, limit: int) -> str:
+    """Shortens long text, keeping its start and its end (where tracebacks and stderr put the actual error)."""
+    if len(text) <= limit:
+        return text
+    head = limit // 4
+    return f"{text[:head]} …[{len(text) - limit} chars cut]… {text[-(limit - head):]}"
+
+
+def _is_path_key(key) -> bool:
+    return isinstance(key, str) and (key.endswith(("_path", "_paths")) or key in PATH_RESULT_KEYS)
+
+
+def _carries_paths(value) -> bool:
+    """Whether a value holds path-valued fields, e.g. the per-file entries of a batch result."""
+    if isinstance(value, dict):
+        return any(_is_path_key(key) or _carries_paths(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return any(_carries_paths(item) for item in value)
+    return False
+
+
+def _compact(value, is_path: bool = False):
+    """Caps free text and long lists; paths, and lists of entries that carry paths, are kept whole."""
+    if isinstance(value, str):
+        return value if is_path else _cap(value, MAX_TEXT_CHARS)
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, dict):
+        return {
+            key: _cap(str(item), MAX_ERROR_CHARS) if key == "error" else _compact(item, is_path or _is_path_key(key))
+            for key, item in value.items() if key not in DROPPED_RESULT_KEYS
+        }
+    if isinstance(value, (list, tuple)):
+        if is_path or _carries_paths(value):
+            return [_compact(item, is_path) for item in value]
+        items = [_compact(item) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"… {len(value) - MAX_LIST_ITEMS} more")
+        return items
+    return value
+
+
+def summarize_tool_result(tool_result) -> dict:
+    """
+    The compact form of a tool result that is sent to the LLM: status, output paths (always in full) and
+    scalar facts (durations, counts, key/tempo) are kept, free text is capped and error text is cut to
+    MAX_ERROR_CHARS.
+    """
+    if not isinstance(tool_result, dict):
+        return {"result": _cap(str(tool_result), MAX_TEXT_CHARS)}
+    return _compact(tool_result)
+
+
+def encode_tool_result(tool_result) -> str:
+    """Serializes a tool result summary for a tool message (compact separators, deterministic key order)."""
+    return json.dumps(summarize_tool_result(tool_result), ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def assistant_message(message) -> dict:
+    """Converts an SDK chat message into a plain dict, so the history serializes the same way on every turn."""
+    result = {"role": "assistant", "content": message.content or ""}
+    if message.tool_calls:
+        result["tool_calls"] = [
+            {
+                "id": call.id,
+                "type": "function",
+                "function": {"name": call.function.name, "arguments": call.function.arguments},
+            }
+            for call in message.tool_calls
+        ]
+    return result
+
+
+class Conversation:
+    """
+    The message history of one agent run: a fixed head (system prompt + user request), optional notes
+    about compacted turns, and the turns themselves (an assistant message plus its tool messages).
+    """
+
+    def __init__(self, system_prompt: str, user_prompt: str, max_chars: int = None):
+        self.head = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        self.max_chars = max_chars or MAX_CONTEXT_CHARS
+        self.notes = []
+        self.turns = []
+
+    @property
+    def messages(self) -> list:
+        messages = list(self.head)
+        if self.notes:
+            messages.append({
+                "role": "system",
+                "content": "Earlier steps of this task (compacted):\n" + "\n".join(self.notes),
+            })
+        for turn in self.turns:
+            messages.extend(turn)
+        return messages
+
+    def state(self) -> dict:
+        """The JSON-serializable part of the history that changes from turn to turn (see restore)."""
+        return {"notes": list(self.notes), "turns": [list(turn) for turn in self.turns]}
+
+    def restore(self, state: dict):
+        """Continues from a saved state, e.g. the checkpoint of an earlier attempt at the same request."""
+        self.notes = list(state["notes"])
+        self.turns = [list(turn) for turn in state["turns"]]
+
+    def add_turn(self, assistant: dict, tool_messages: list = ()):
+        self.turns.append([assistant, *tool_messages])
+        self._drop_superseded()
+        self._fold_old_turns()
+
+    # ------------------------------------------
+    # Compaction
+    # ------------------------------------------
+
+    @staticmethod
+    def _tool_calls(turn: list) -> list:
+        """(tool name, arguments, result summary) for every tool call of a turn."""
+        results = {message["tool_call_id"]: message["content"] for message in turn[1:]}
+        return [
+            (call["function"]["name"], call["function"]["arguments"], results.get(call["id"], ""))
+            for call in turn[0].get("tool_calls", [])
+        ]
+
+    @staticmethod
+    def _failed(turn: list) -> bool:
+        """Whether every tool call of a turn failed outright (a partially failed batch still produced outputs)."""
+        def failed(content: str) -> bool:
+            try:
+                result = json.loads(content)
+            except ValueError:
+                return False
+            return isinstance(result, dict) and ("error" in result or result.get("status") == "failed")
+
+        return len(turn) > 1 and all(failed(message["content"]) for message in turn[1:])
+
+    def _note(self, text: str):
+        self.notes.append(text)
+
+    def _drop_superseded(self):
+        """Removes turns whose tool calls all failed once a later turn has called the same tools again."""
+        latest_names = {name for name, _, _ in self._tool_calls(self.turns[-1])}
+        for turn in self.turns[:-1]:
+            calls = self._tool_calls(turn)
+            if self._failed(turn) and {name for name, _, _ in calls} <= latest_names:
+                self.turns.remove(turn)
+                for name, _, result in calls:
+                    self._note(f"- {name} failed and was retried: {result}")
+
+    def _fold_old_turns(self):
+        """Past the size budget, replaces the oldest turns with one-line notes of what each tool call returned."""
+        while len(self.turns) > KEEP_RECENT_TURNS and len(json.dumps(self.messages)) > self.max_chars:
+            for name, arguments, result in self._tool_calls(self.turns.pop(0)):
+                # The result summary keeps its output paths intact; only the (free-text) arguments are capped
+                self._note(f"- {name}({_cap(arguments, MAX_NOTE_CHARS)}) -> {result}")
@@ -1,14 +1,23 @@
 import os
 import json
 import logging
+import importlib
 import warnings
+import threading
+import contextlib
+import contextvars
+from pathlib import Path
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
 
-# 🌟 Import ALL our physical audio processing tools
-from tools.separator import separate_audio
-from tools.transcriber import audio_to_midi
-from tools.generator import generate_music  # 🌟 NEW: Generator tool
+from agent.planner import plan_pipeline, run_planned_pipeline
+from agent.conversation import Conversation, assistant_message, encode_tool_result
+from agent.workspace import reserve_output_path
+from agent.checkpoint import Checkpoint, CHECKPOINTS_ENABLED
+from agent.retry import call_with_retries
+from agent.llm import create_client, LLM_MODEL
+from tools.tracing import span, trace_run, record_llm_usage, KIND_LLM, KIND_TOOL
 
 # Suppress noisy httpx network logs from the OpenAI SDK
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -16,11 +25,14 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 # Securely load environment variables
 load_dotenv()
 
-# Initialize the LLM client (DeepSeek/Gemini compatible)
-client = OpenAI(
-    api_key=os.getenv("DEEPSEEK_API_KEY"),
-    base_url="https://api.deepseek.com"
-)
+# Initialize the LLM client: remote provider (DeepSeek by default), local OpenAI-compatible server,
+# or offline replay of a recorded session (see agent/llm.py and MUSIC_AGENT_LLM_BACKEND)
+client = create_client()
+
+# Recognized intents run their fixed pipeline directly; set MUSIC_AGENT_PLANNER=0 to always use the LLM loop
+USE_PLANNER = os.getenv("MUSIC_AGENT_PLANNER", "1") != "0"
+# Stream LLM responses token by token (forwarded as "llm_delta" events); set to 0 for providers without streaming
+STREAM_LLM = os.getenv("MUSIC_AGENT_LLM_STREAM", "1") != "0"
 
 # ==========================================
 # 🌟 The Tool Registry & Schemas
@@ -37,6 +49,11 @@ SEPARATE_TOOL_SCHEMA = {
                 "input_file_path": {
                     "type": "string",
                     "description": "The relative or absolute file path to the target audio file."
+                },
+                "stems": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": ["vocals", "drums", "bass", "other", "accompaniment"]},
+                    "description": "Optional: only the stems you need (e.g. ['vocals', 'accompaniment'] for karaoke). Omit to get vocals, drums, bass and other."
                 }
             },
             "required": ["input_file_path"]
@@ -62,6 +79,43 @@ TRANSCRIBE_TOOL_SCHEMA = {
     }
 }
 
+TRANSCRIBE_BATCH_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "audio_to_midi_batch",
+        "description": "Convert several audio tracks into MIDI files in one pass (e.g. all separated stems). Prefer this over repeated 'audio_to_midi' calls.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "input_file_paths": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The paths of the audio stems to transcribe (e.g., ['vocals.wav', 'bass.wav'])."
+                }
+            },
+            "required": ["input_file_paths"]
+        }
+    }
+}
+
+ANALYZE_MIDI_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "analyze_midi",
+        "description": "Analyze a transcribed MIDI file: estimated key, tempo (BPM), chord progression, note density and pitch range, plus a ready-made 'prompt_hint'. Use it after 'audio_to_midi' and base the generation prompt on its results.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "midi_path": {
+                    "type": "string",
+                    "description": "The path to a .mid file returned by 'audio_to_midi' or 'audio_to_midi_batch'."
+                }
+            },
+            "required": ["midi_path"]
+        }
+    }
+}
+
 # 🌟 NEW: Generation Tool Schema
 GENERATE_TOOL_SCHEMA = {
     "type": "function",
@@ -74,6 +128,14 @@ GENERATE_TOOL_SCHEMA = {
                 "prompt": {
                     "type": "string",
                     "description": "A detailed English description of the music to generate. Include style, mood, and any melodic cues inferred from previous analysis."
+                },
+                "duration_seconds": {
+                    "type": "number",
+                    "description": "Optional: length of the track in seconds (up to 300). Only set it when the user asks for a specific length; long tracks are generated window by window."
+                },
+                "seed": {
+                    "type": "integer",
+                    "description": "Optional: random seed. Only set it when the user wants a reproducible result; every call without a seed gives a new variation."
                 }
             },
             "required": ["prompt"]
@@ -81,81 +143,390 @@ GENERATE_TOOL_SCHEMA = {
     }
 }
 
-AVAILABLE_TOOLS = {
-    "separate_audio_stems": separate_audio,
-    "audio_to_midi": audio_to_midi,
-    "generate_music": generate_music
+GENERATE_BATCH_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "generate_music_batch",
+        "description": "Generate several tracks in one pass: multiple prompts and/or several variants of each prompt. Use this when the user wants options to choose from (e.g. A/B/C remix versions).",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "prompts": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Detailed English descriptions of the music to generate, one per style."
+                },
+                "num_variants": {
+                    "type": "integer",
+                    "description": "How many different versions to generate for each prompt (default 1)."
+                }
+            },
+            "required": ["prompts"]
+        }
+    }
+}
+
+GENERATE_MELODY_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "generate_music_from_melody",
+        "description": "Generate a new audio track that keeps the melody of the original: conditions MusicGen-Melody on a separated stem or a transcribed MIDI file plus a style prompt. Prefer this for remixes that must stay recognizable.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "prompt": {
+                    "type": "string",
+                    "description": "A detailed English description of the target style, mood and instrumentation."
+                },
+                "melody_path": {
+                    "type": "string",
+                    "description": "Path to the melody source: a stem from 'separate_audio_stems' (e.g. vocals.wav) or a .mid file from 'audio_to_midi'."
+                },
+                "duration_seconds": {
+                    "type": "number",
+                    "description": "Optional: length of the track in seconds. Melody conditioning covers about 5 seconds; for longer tracks use 'generate_music'."
+                }
+            },
+            "required": ["prompt", "melody_path"]
+        }
+    }
+}
+
+# 🌟 Our physical audio processing tools: tool name -> (module, function).
+# The modules pull in TensorFlow (Basic-Pitch) and torch/transformers (Demucs, MusicGen), so each one
+# is imported on the first call of one of its tools (or by agent/warmup.py at startup), not with agent.core.
+TOOL_IMPLEMENTATIONS = {
+    "separate_audio_stems": ("tools.separator", "separate_audio"),
+    "audio_to_midi": ("tools.transcriber", "audio_to_midi"),
+    "audio_to_midi_batch": ("tools.transcriber", "audio_to_midi_batch"),
+    "analyze_midi": ("tools.analyzer", "analyze_midi"),
+    "generate_music": ("tools.generator", "generate_music"),
+    "generate_music_batch": ("tools.generator", "generate_music_batch"),
+    "generate_music_from_melody": ("tools.generator", "generate_music_from_melody"),
+}
+
+TOOL_SCHEMAS = {
+    "separate_audio_stems": SEPARATE_TOOL_SCHEMA,
+    "audio_to_midi": TRANSCRIBE_TOOL_SCHEMA,
+    "audio_to_midi_batch": TRANSCRIBE_BATCH_TOOL_SCHEMA,
+    "analyze_midi": ANALYZE_MIDI_TOOL_SCHEMA,
+    "generate_music": GENERATE_TOOL_SCHEMA,
+    "generate_music_batch": GENERATE_BATCH_TOOL_SCHEMA,
+    "generate_music_from_melody": GENERATE_MELODY_TOOL_SCHEMA,
+}
+
+# Comma-separated subset of the tools to offer (default: all). Disabled tools are never imported.
+ENABLED_TOOLS = [
+    name.strip() for name in os.getenv("MUSIC_AGENT_TOOLS", ",".join(TOOL_IMPLEMENTATIONS)).split(",")
+    if name.strip() in TOOL_IMPLEMENTATIONS
+]
+
+
+def _lazy_tool(module_name: str, function_name: str):
+    """A stand-in for a tool function that imports its module on the first call."""
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+    call.__name__ = function_name
+    return call
+
+
+AVAILABLE_TOOLS = {name: _lazy_tool(*TOOL_IMPLEMENTATIONS[name]) for name in ENABLED_TOOLS}
+
+# Tools that accept a `progress_callback` keyword for incremental progress reporting
+PROGRESS_AWARE_TOOLS = {"separate_audio_stems", "generate_music"}
+
+# Where each tool writes inside an isolated run workspace (keyword argument, relative path)
+WORKSPACE_TOOL_ARGS = {
+    "separate_audio_stems": ("output_dir", "separated"),
+    "audio_to_midi": ("output_dir", "midi_outputs"),
+    "audio_to_midi_batch": ("output_dir", "midi_outputs"),
+    "generate_music": ("output_path", "outputs/generated_music.wav"),
+    "generate_music_batch": ("output_dir", "outputs"),
+    "generate_music_from_melody": ("output_path", "outputs/generated_music.wav"),
+}
+
+# ==========================================
+# 🌟 Parallel Tool Scheduler
+# ==========================================
+
+# Tool calls returned in the same LLM response are independent and run concurrently.
+# Per-model limits keep the memory-heavy models (Demucs, MusicGen) from running several copies at once;
+# tools sharing a model share its limit. Tools without a model (analyze_midi) are not limited.
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("MUSIC_AGENT_MAX_PARALLEL_TOOLS", "4"))
+MODEL_CONCURRENCY_LIMITS = {
+    "demucs": 1,
+    "basic_pitch": 2,
+    "musicgen": 1,
 }
+TOOL_MODELS = {
+    "separate_audio_stems": "demucs",
+    "audio_to_midi": "basic_pitch",
+    "audio_to_midi_batch": "basic_pitch",
+    "generate_music": "musicgen",
+    "generate_music_batch": "musicgen",
+    "generate_music_from_melody": "musicgen",
+}
+
+_model_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in MODEL_CONCURRENCY_LIMITS.items()}
+_tool_semaphores = {tool: _model_semaphores[model] for tool, model in TOOL_MODELS.items()}
+_tool_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOL_CALLS, thread_name_prefix="agent-tool")
+
+# The checkpoint of the current run (None without a workspace); tool threads inherit it through copy_context
+_current_checkpoint = contextvars.ContextVar("music_agent_checkpoint", default=None)
+
+
+def _run_tool(function_name: str, function_args: dict, progress_callback=None, workspace_dir: str = None) -> dict:
+    """
+    Runs one tool from AVAILABLE_TOOLS (respecting its concurrency limit) and returns its result dict.
+    With a workspace_dir, the tool's outputs are redirected into that directory (see WORKSPACE_TOOL_ARGS).
+    The progress_callback receives a {"event": "tool_start", ...} event, the tool's own progress events,
+    then {"event": "tool_result", ...} and one {"event": "artifact", ...} event per produced file.
+    """
+    print(f"🛠️  [Execution] Triggered: '{function_name}'")
+    if progress_callback:
+        progress_callback({"event": "tool_start", "tool": function_name, "args": function_args})
+
+    function_to_call = AVAILABLE_TOOLS.get(function_name)
+    if function_to_call is None:
+        print(f"❌ Error: Tool {function_name} not found.")
+        return {"error": f"Tool {function_name} not found."}
+
+    # A stage completed by an earlier attempt of this run (same arguments, same input files) is not run again
+    checkpoint = _current_checkpoint.get()
+    tool_result = checkpoint.completed_stage(function_name, function_args) if checkpoint else None
+    if tool_result is not None:
+        print(f"♻️  [Checkpoint] '{function_name}' already completed in an earlier attempt, reusing its result.")
+    else:
+        tool_result = _call_tool(function_name, function_to_call, function_args, progress_callback, workspace_dir)
+        if checkpoint and isinstance(tool_result, dict) and "error" not in tool_result:
+            checkpoint.record_stage(
+                function_name, function_args, tool_result, [artifact["path"] for artifact in tool_artifacts(tool_result)]
+            )
+
+    if progress_callback:
+        progress_callback({"event": "tool_result", "tool": function_name, "result": tool_result})
+        for artifact in tool_artifacts(tool_result):
+            progress_callback({"event": "artifact", "tool": function_name, **artifact})
+    return tool_result
+
+
+def _call_tool(function_name: str, function_to_call, function_args: dict, progress_callback, workspace_dir) -> dict:
+    """Executes a tool under its concurrency limit, with its outputs redirected into the workspace."""
+    try:
+        if progress_callback and function_name in PROGRESS_AWARE_TOOLS:
+            function_args = {**function_args, "progress_callback": progress_callback}
+        if workspace_dir and function_name in WORKSPACE_TOOL_ARGS:
+            arg_name, relative_path = WORKSPACE_TOOL_ARGS[function_name]
+            target = os.path.join(workspace_dir, relative_path)
+            if Path(relative_path).suffix:
+                # Single-file outputs get a name of their own, so parallel calls in one run never overwrite each other
+                target = reserve_output_path(target)
+            function_args = {**function_args, arg_name: target}
+
+        # Execute the physical code
+        with span(f"tool.{function_name}", KIND_TOOL) as tool_span:
+            with _tool_semaphores.get(function_name, contextlib.nullcontext()):
+                tool_result = function_to_call(**function_args)
+            if isinstance(tool_result, dict) and "error" in tool_result:
+                tool_span.set(error=str(tool_result["error"])[:200])
+        print(f"✅ [Execution] '{function_name}' returned a result.")
+    except Exception as e:
+        print(f"❌ Error: Tool {function_name} crashed: {e}")
+        tool_result = {"error": f"Tool {function_name} crashed: {str(e)}"}
+    return tool_result
+
+
+def tool_artifacts(tool_result: dict) -> list:
+    """The files a tool result points to, as [{"kind": "stem" | "midi" | "audio", "name", "path"}]."""
+    if not isinstance(tool_result, dict) or "error" in tool_result:
+        return []
+    artifacts = [{"kind": "stem", "name": stem, "path": path} for stem, path in tool_result.get("tracks", {}).items()]
+    midi_paths = [tool_result.get("midi_path")] + [item.get("midi_path") for item in tool_result.get("results", [])]
+    artifacts += [{"kind": "midi", "name": os.path.basename(path), "path": path} for path in midi_paths if path]
+    audio_paths = [tool_result.get("audio_path")] + [item["audio_path"] for item in tool_result.get("outputs", [])]
+    artifacts += [{"kind": "audio", "name": os.path.basename(path), "path": path} for path in audio_paths if path]
+    return artifacts
+
+
+def _execute_tool_call(tool_call, progress_callback=None, workspace_dir: str = None) -> dict:
+    """Runs a single LLM tool call and returns the matching tool message."""
+    try:
+        function_args = json.loads(tool_call.function.arguments)
+        tool_result = _run_tool(tool_call.function.name, function_args, progress_callback, workspace_dir)
+    except json.JSONDecodeError as e:
+        tool_result = {"error": f"Invalid tool arguments: {str(e)}"}
+
+    return {
+        "role": "tool",
+        "tool_call_id": tool_call.id,
+        "name": tool_call.function.name,
+        "content": encode_tool_result(tool_result)
+    }
+
+
+def _execute_tool_calls(tool_calls, progress_callback=None, workspace_dir: str = None) -> list:
+    """Dispatches independent tool calls concurrently and returns their tool messages in the original order."""
+    if len(tool_calls) == 1:
+        return [_execute_tool_call(tool_calls[0], progress_callback, workspace_dir)]
+
+    print(f"⚡ [Scheduler] Running {len(tool_calls)} tool calls in parallel...")
+    # Each call runs in a copy of the current context so its spans stay attached to this run
+    futures = [
+        _tool_pool.submit(contextvars.copy_context().run, _execute_tool_call, tool_call, progress_callback, workspace_dir)
+        for tool_call in tool_calls
+    ]
+    return [future.result() for future in futures]
 
 # ==========================================
 # 🌟 The Core Agentic Loop
 # ==========================================
 
-def run_agent_workflow(user_prompt: str) -> str:
+def _chat(llm_client, messages: list, turn: int, progress_callback=None):
+    """
+    One LLM planning call. With STREAM_LLM the response is streamed: text deltas are forwarded as
+    {"event": "llm_delta", "turn", "text"} events while the tool-call fragments are assembled.
+
+    Returns:
+        (message, response): the assistant message (content, tool_calls) and an object carrying `usage`.
+    """
+    request = dict(model=LLM_MODEL, messages=messages, tools=LLM_TOOL_SCHEMAS, tool_choice="auto")
+    if not STREAM_LLM:
+        response = llm_client.chat.completions.create(**request)
+        return response.choices[0].message, response
+
+    stream = llm_client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+    content_parts, tool_calls, usage = [], {}, None
+    for chunk in stream:
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+            if progress_callback:
+                progress_callback({"event": "llm_delta", "turn": turn, "text": delta.content})
+        # Tool calls arrive in fragments keyed by index: the id and name first, then pieces of the JSON arguments
+        for fragment in delta.tool_calls or []:
+            call = tool_calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": ""})
+            call["id"] = fragment.id or call["id"]
+            if fragment.function:
+                call["name"] += fragment.function.name or ""
+                call["arguments"] += fragment.function.arguments or ""
+
+    message = SimpleNamespace(
+        role="assistant",
+        content="".join(content_parts) or None,
+        tool_calls=[
+            SimpleNamespace(id=call["id"], type="function",
+                            function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+            for _, call in sorted(tool_calls.items())
+        ] or None,
+    )
+    return message, SimpleNamespace(usage=usage)
+
+
+# 🌟 CRITICAL: Instructing the LLM on 'Chain of Thought' for music creation.
+# Built once per process and sent first on every turn, together with LLM_TOOL_SCHEMAS: keeping both
+# byte-identical across turns and runs lets the provider serve them from its prefix cache.
+SYSTEM_PROMPT = (
+    "You are Music-Agent, a highly intelligent and flexible AI audio assistant. "
+    f"You have {len(AVAILABLE_TOOLS)} tools: {', '.join(AVAILABLE_TOOLS)}. "
+    "CRITICAL RULE: You MUST ONLY use the tools required to fulfill the user's EXPLICIT request. Do NOT perform unrequested actions.\n"
+    "- IF the user ONLY asks to separate audio, extract vocals, or get accompaniment: ONLY call 'separate_audio_stems' and then STOP. Do NOT generate music.\n"
+    "- IF the user asks to convert music to MIDI: Call 'separate_audio_stems' (to get the stem), then 'audio_to_midi', and STOP. To transcribe more than one stem, call 'audio_to_midi_batch' once instead.\n"
+    "- IF AND ONLY IF the user explicitly asks to 'remix', 'generate', or 'create new music': Use the full pipeline (separate -> transcribe -> analyze -> generate). Call 'analyze_midi' on the transcribed MIDI and build the generation prompt from its key, tempo and chords (its 'prompt_hint') instead of guessing melodic cues. If the user wants several versions or styles to choose from, use 'generate_music_batch' instead of 'generate_music'. If the remix must keep the original melody, finish with 'generate_music_from_melody' on the transcribed MIDI (or the stem) instead.\n"
+    "Independent tool calls returned together in one response are executed in parallel.\n"
+    "Always summarize your actions and provide the exact file paths when finished."
+)
+LLM_TOOL_SCHEMAS = [TOOL_SCHEMAS[name] for name in AVAILABLE_TOOLS]
+
+
+def run_agent_workflow(user_prompt: str, progress_callback=None, llm_client=None, use_planner: bool = None,
+                       workspace_dir: str = None, run_id: str = None) -> str:
     """
     Advanced Agentic Workflow: Supports Complex Orchestration (Separation -> Transcription -> Generation)
+
+    Args:
+        user_prompt (str): The user's natural language request.
+        progress_callback (callable): Optional function receiving the run as a stream of events: LLM token
+                                      deltas ("llm_delta"), tool start/finish ("tool_start", "tool_result"),
+                                      tool progress (e.g. streaming separation windows) and produced files ("artifact").
+        llm_client: OpenAI-compatible client to use instead of the module-level `client` (e.g. a stub in tests).
+        use_planner (bool): Run recognized intents through the deterministic planner. Defaults to USE_PLANNER.
+        workspace_dir (str): Optional isolated directory for every artifact of this run (e.g. a job workspace).
+        run_id (str): Trace ID grouping this run's spans (see tools/tracing.py). Generated when omitted.
+
+    With a workspace_dir, completed stages and LLM turns are checkpointed there (see agent/checkpoint.py),
+    so running the same request again in the same workspace resumes after the last completed stage.
+
+    Raises:
+        RuntimeError: If the agent loop produces no final answer within its turn budget.
     """
+    checkpoint = Checkpoint(workspace_dir) if workspace_dir and CHECKPOINTS_ENABLED else None
+    token = _current_checkpoint.set(checkpoint)
+    try:
+        with trace_run(run_id):
+            return _agent_workflow(user_prompt, progress_callback, llm_client, use_planner, workspace_dir)
+    finally:
+        _current_checkpoint.reset(token)
+
+
+def _agent_workflow(user_prompt: str, progress_callback, llm_client, use_planner, workspace_dir) -> str:
     print(f"\n[User] {user_prompt}\n")
     print("-" * 50)
+
+    llm_client = llm_client or client
+    use_planner = USE_PLANNER if use_planner is None else use_planner
+
+    # ⚡ Fast path: a recognized intent runs its fixed pipeline with at most one LLM call
+    plan = plan_pipeline(user_prompt) if use_planner else None
+    if plan:
+        print(f"🗺️  [Planner] Recognized intent '{plan['intent']}', skipping LLM planning turns.")
+        run_tool = lambda name, args: _run_tool(name, args, progress_callback, workspace_dir)
+        final_answer = run_planned_pipeline(plan, user_prompt, run_tool, llm_client, model=LLM_MODEL)
+        print("\n✨ [Final Answer]")
+        print(final_answer)
+        return final_answer
     
-    # 🌟 CRITICAL: Instructing the LLM on 'Chain of Thought' for music creation
-    system_prompt = (
-        "You are Music-Agent, a highly intelligent and flexible AI audio assistant. "
-        "You have 3 tools: separate_audio_stems, audio_to_midi, and generate_music. "
-        "CRITICAL RULE: You MUST ONLY use the tools required to fulfill the user's EXPLICIT request. Do NOT perform unrequested actions.\n"
-        "- IF the user ONLY asks to separate audio, extract vocals, or get accompaniment: ONLY call 'separate_audio_stems' and then STOP. Do NOT generate music.\n"
-        "- IF the user asks to convert music to MIDI: Call 'separate_audio_stems' (to get the stem), then 'audio_to_midi', and STOP.\n"
-        "- IF AND ONLY IF the user explicitly asks to 'remix', 'generate', or 'create new music': Use the full pipeline (separate -> transcribe -> generate).\n"
-        "Always summarize your actions and provide the exact file paths when finished."
-    )
     
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+    conversation = Conversation(SYSTEM_PROMPT, user_prompt)
+    # 🔁 Resume: continue the conversation of an earlier attempt (its completed tool calls are checkpointed too)
+    checkpoint = _current_checkpoint.get()
+    saved_state = checkpoint.conversation_state(user_prompt) if checkpoint else None
+    if saved_state:
+        conversation.restore(saved_state)
+        print(f"🔁 [Checkpoint] Resuming after {len(conversation.turns)} saved turn(s).")
 
     max_turns = 10 # Increased turns to accommodate 3-step workflows
     for turn in range(max_turns):
         print(f"🧠 [Agent Brain - Turn {turn + 1}] Planning next move...")
         
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            tools=[SEPARATE_TOOL_SCHEMA, TRANSCRIBE_TOOL_SCHEMA, GENERATE_TOOL_SCHEMA],
-            tool_choice="auto"
-        )
+        with span("llm.chat", KIND_LLM, model=LLM_MODEL, turn=turn + 1, stream=STREAM_LLM) as llm_span:
+            def on_retry(attempt, error, delay, turn=turn + 1):
+                llm_span.set(retries=attempt)
+                # The UI drops the text streamed by the failed attempt
+                if progress_callback:
+                    progress_callback({"event": "llm_retry", "turn": turn, "attempt": attempt,
+                                       "error": str(error)[:200], "delay_seconds": delay})
 
-        response_message = response.choices[0].message
-        messages.append(response_message)
+            response_message, response = call_with_retries(
+                lambda: _chat(llm_client, conversation.messages, turn + 1, progress_callback), on_retry=on_retry
+            )
+            record_llm_usage(llm_span, response)
 
         if response_message.tool_calls:
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
-                
-                print(f"🛠️  [Execution] Triggered: '{function_name}'")
-                
-                function_to_call = AVAILABLE_TOOLS.get(function_name)
-                if function_to_call:
-                    # Execute the physical code
-                    tool_result = function_to_call(**function_args)
-                    print(f"✅ [Execution] '{function_name}' returned a result.")
-                    
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": function_name,
-                        "content": json.dumps(tool_result)
-                    })
-                else:
-                    print(f"❌ Error: Tool {function_name} not found.")
+            tool_messages = _execute_tool_calls(response_message.tool_calls, progress_callback, workspace_dir)
+            conversation.add_turn(assistant_message(response_message), tool_messages)
+            if checkpoint:
+                checkpoint.save_conversation(user_prompt, conversation.state())
         else:
             final_answer = response_message.content
             print("\n✨ [Final Answer]")
             print(final_answer)
             return final_answer
             
-    return "❌ Error: Workflow timeout."
+    # Raised instead of returned, so a job can be retried and resume from the checkpoint
+    raise RuntimeError(f"Workflow timeout: no final answer after {max_turns} turns.")
 
 # ==========================================
 # Creative Testing Block
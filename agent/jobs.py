@@ -0,0 +1,434 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+from pathlib import Path
+
+from agent.core import run_agent_workflow
+from agent.retry import is_transient
+from agent.warmup import start_warmup, wait_until_ready
+from agent.workspace import (
+    DEFAULT_TENANT, allocate_workspace, write_file_atomic, record_artifact, release_workspace, reopen_workspace,
+    start_garbage_collector
+)
+from tools.tracing import get_run_spans, start_metrics_server
+
+# ==========================================
+# 🌟 Async Job Queue & Worker Service
+# ==========================================
+# Agent runs are submitted as jobs and executed by a pool of workers, each job in its own
+# tenant workspace directory (see agent.workspace). Job state and progress events live in a local SQLite store, so the
+# Streamlit UI only polls, and separate worker processes (`python -m agent.jobs`) can share the queue.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-Jobs")
+
+DB_PATH = Path(os.getenv("MUSIC_AGENT_JOBS_DB", "workspace/jobs.db"))
+NUM_WORKERS = int(os.getenv("MUSIC_AGENT_JOB_WORKERS", "2"))
+POLL_INTERVAL_SECONDS = 0.5
+# Pause after an unexpected error in a worker (e.g. "database is locked") before it polls again
+WORKER_ERROR_BACKOFF_SECONDS = 5.0
+# LLM token deltas are coalesced into one stored event at most this often
+DELTA_FLUSH_SECONDS = 0.2
+# A job that failed on a transient error (or whose worker died) is requeued until it has run this many times;
+# each retry resumes from the run's checkpoint
+MAX_ATTEMPTS = int(os.getenv("MUSIC_AGENT_JOB_ATTEMPTS", "2"))
+# A running job's worker renews its lease every HEARTBEAT_INTERVAL_SECONDS; a job whose lease has expired
+# belongs to a dead worker (crash, restart, lost machine) and is taken back by the next claim
+LEASE_SECONDS = float(os.getenv("MUSIC_AGENT_JOB_LEASE_SECONDS", "120"))
+HEARTBEAT_INTERVAL_SECONDS = LEASE_SECONDS / 4
+
+FINISHED_STATUSES = {"succeeded", "failed"}
+
+_workers = []
+_workers_lock = threading.Lock()
+_schema_ready = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    input_path TEXT,
+    workspace TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id);
+"""
+
+
+@contextlib.contextmanager
+def _connect():
+    """Opens a short-lived autocommit connection; every thread and process uses its own."""
+    global _schema_ready
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Job stores created before retries and leases existed
+            with contextlib.suppress(sqlite3.OperationalError):
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            with contextlib.suppress(sqlite3.OperationalError):
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            _schema_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def _add_event(job_id: str, event: dict):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO job_events (job_id, ts, event) VALUES (?, ?, ?)",
+            (job_id, time.time(), json.dumps(event))
+        )
+
+
+def _build_agent_prompt(prompt: str, input_path: str) -> str:
+    """Injects the location of the uploaded audio, exactly like the interactive app does."""
+    if not input_path:
+        return prompt
+    return prompt + f"\n\n[System Context: The user has uploaded an audio file located at '{input_path}'. Use this exact path.]"
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def submit_job(prompt: str, input_file_name: str = None, input_bytes: bytes = None, tenant: str = DEFAULT_TENANT) -> str:
+    """
+    Queues an agent run and returns its job ID immediately.
+
+    Args:
+        prompt (str): The user's natural language request.
+        input_file_name (str): Optional name of the uploaded audio file.
+        input_bytes (bytes): Contents of the uploaded audio, stored inside the job's own workspace.
+        tenant (str): Owner of the job, whose disk quota the job's files count against.
+
+    Returns:
+        str: The new job ID.
+
+    Raises:
+        QuotaExceededError: If the tenant has no room left for the job.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    workspace = allocate_workspace(tenant, job_id, reserve_bytes=len(input_bytes or b""))
+
+    input_path = None
+    if input_file_name and input_bytes is not None:
+        input_path = write_file_atomic(workspace / "inputs" / Path(input_file_name).name, input_bytes)
+        record_artifact(job_id, input_path, "input")
+
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, prompt, input_path, workspace, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job_id, prompt, input_path, str(workspace), time.time())
+        )
+    _add_event(job_id, {"event": "status", "status": "queued"})
+    logger.info(f"Job {job_id} queued")
+    return job_id
+
+
+def retry_job(job_id: str) -> str:
+    """
+    Queues a failed job again in its own workspace (including a job whose worker died, once its lease
+    expired and it ran out of attempts). Stages it already completed are not rerun (see agent/checkpoint.py),
+    so the retry resumes after the last good stage.
+
+    Returns:
+        str: The job ID.
+
+    Raises:
+        ValueError: If the job does not exist, has not failed, or its workspace was already garbage collected.
+    """
+    job = get_job(job_id)
+    if job is None or job["status"] != "failed":
+        raise ValueError(f"Job {job_id} is not a failed job")
+    if not reopen_workspace(job_id):
+        raise ValueError(f"The workspace of job {job_id} was already deleted")
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET status = 'queued', finished = NULL, attempts = 0 WHERE id = ?", (job_id,))
+    _add_event(job_id, {"event": "status", "status": "queued"})
+    logger.info(f"Job {job_id} queued for retry")
+    return job_id
+
+
+def get_job(job_id: str):
+    """Returns the job record as a dict (result decoded from JSON), or None if it does not exist."""
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def get_events(job_id: str, after_id: int = 0) -> list:
+    """Returns the job's progress events newer than `after_id`, oldest first, each with its `id`."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id, ts, event FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+            (job_id, after_id)
+        ).fetchall()
+    return [{"id": row["id"], "ts": row["ts"], **json.loads(row["event"])} for row in rows]
+
+
+# ==========================================
+# Workers
+# ==========================================
+
+def _recover_expired_jobs(conn, now: float) -> list:
+    """
+    Takes back the running jobs whose lease expired (inside the caller's transaction): each is requeued if it
+    has attempts left, and failed otherwise, so that retry_job can resume it. Returns the IDs of failed jobs.
+    """
+    failed = []
+    rows = conn.execute(
+        "SELECT id, worker, attempts FROM jobs WHERE status = 'running' AND COALESCE(heartbeat, started) < ?",
+        (now - LEASE_SECONDS,)
+    ).fetchall()
+    for row in rows:
+        error = f"Worker {row['worker']} stopped responding"
+        if row["attempts"] < MAX_ATTEMPTS:
+            conn.execute("UPDATE jobs SET status = 'queued', error = ? WHERE id = ?", (error, row["id"]))
+            event = {"event": "status", "status": "retrying", "attempt": row["attempts"], "error": error}
+        else:
+            conn.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?", (now, error, row["id"]))
+            event = {"event": "status", "status": "failed"}
+            failed.append(row["id"])
+        conn.execute("INSERT INTO job_events (job_id, ts, event) VALUES (?, ?, ?)", (row["id"], now, json.dumps(event)))
+        logger.warning(f"Job {row['id']}: {error}, {event['status']}")
+    return failed
+
+
+def _claim_next_job(worker_name: str):
+    """
+    Atomically moves the oldest queued job to 'running' for this worker; safe across processes.
+    Jobs left running by dead workers are recovered first.
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            failed = _recover_expired_jobs(conn, now)
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, heartbeat = ?, worker = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (now, now, worker_name, row["id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    # Failed jobs no longer write to their workspaces, which become collectable (and stop holding quota)
+    for job_id in failed:
+        release_workspace(job_id)
+    if row is None:
+        return None
+    return {**dict(row), "status": "running", "started": now, "worker": worker_name, "attempts": row["attempts"] + 1}
+
+
+def _keep_lease(job_id: str, worker_name: str, stop: threading.Event):
+    """Renews the job's lease until `stop` is set (runs in its own thread for the duration of the job)."""
+    while not stop.wait(HEARTBEAT_INTERVAL_SECONDS):
+        try:
+            with _connect() as conn:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                    (time.time(), job_id, worker_name)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+
+def empty_artifacts() -> dict:
+    return {"stems": {}, "midi": [], "generated": []}
+
+
+def collect_artifact(artifacts: dict, event: dict):
+    """Adds the file of an {"event": "artifact", ...} event to `artifacts`; the same file may be announced twice."""
+    if event["kind"] == "stem":
+        artifacts["stems"][event["name"]] = event["path"]
+    else:
+        paths = artifacts["midi" if event["kind"] == "midi" else "generated"]
+        if event["path"] not in paths:
+            paths.append(event["path"])
+
+
+def _run_job(job: dict):
+    job_id = job["id"]
+    logger.info(f"Job {job_id} started")
+    stop_lease = threading.Event()
+    threading.Thread(
+        target=_keep_lease, args=(job_id, job["worker"], stop_lease), name=f"job-lease-{job_id}", daemon=True
+    ).start()
+    try:
+        _execute_job(job)
+    finally:
+        stop_lease.set()
+
+
+def _execute_job(job: dict):
+    job_id = job["id"]
+    _add_event(job_id, {"event": "status", "status": "running"})
+    artifacts = empty_artifacts()
+    # Token deltas waiting to be stored as one event: {"turn", "text", "since"}
+    pending_delta = {}
+    events_lock = threading.Lock()
+
+    def flush_delta():
+        if pending_delta:
+            _add_event(job_id, {"event": "llm_delta", "turn": pending_delta["turn"], "text": pending_delta["text"]})
+            pending_delta.clear()
+
+    def on_event(event):
+        with events_lock:
+            if event["event"] == "llm_delta":
+                if pending_delta and pending_delta["turn"] != event["turn"]:
+                    flush_delta()
+                pending_delta.setdefault("turn", event["turn"])
+                pending_delta.setdefault("since", time.monotonic())
+                pending_delta["text"] = pending_delta.get("text", "") + event["text"]
+                if time.monotonic() - pending_delta["since"] >= DELTA_FLUSH_SECONDS:
+                    flush_delta()
+                return
+            flush_delta()
+            if event["event"] == "artifact":
+                collect_artifact(artifacts, event)
+                record_artifact(job_id, event["path"], event["kind"], event["name"])
+            _add_event(job_id, event)
+
+    try:
+        response_text = run_agent_workflow(
+            _build_agent_prompt(job["prompt"], job["input_path"]),
+            progress_callback=on_event,
+            workspace_dir=job["workspace"],
+            run_id=job_id,
+        )
+        status, error, retryable = "succeeded", None, False
+        result = {"response_text": response_text, "artifacts": artifacts, "spans": get_run_spans(job_id)}
+    except Exception as e:
+        logger.error(f"Job {job_id} failed (attempt {job['attempts']}/{MAX_ATTEMPTS}): {e}")
+        status, error, result = "failed", str(e), None
+        # Only failures that may go away on their own are worth another attempt (not e.g. auth errors or bad input)
+        retryable = is_transient(e)
+
+    with events_lock:
+        flush_delta()
+
+    if status == "failed" and retryable and job["attempts"] < MAX_ATTEMPTS:
+        # Back into the queue; the workspace (and its checkpoint) stays active for the next attempt
+        with _connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, job_id, job["worker"])
+            ).rowcount
+        if not updated:
+            _log_lost_lease(job)
+            return
+        _add_event(job_id, {"event": "status", "status": "retrying", "attempt": job["attempts"], "error": error})
+        logger.info(f"Job {job_id} requeued for another attempt")
+        return
+
+    # Only while this worker still holds the lease: if it expired, the job was requeued and another
+    # worker may be running (or may have finished) the next attempt, whose outcome must not be overwritten
+    with _connect() as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, time.time(), json.dumps(result) if result else None, error, job_id, job["worker"])
+        ).rowcount
+    if not updated:
+        _log_lost_lease(job)
+        return
+    _add_event(job_id, {"event": "status", "status": status})
+    release_workspace(job_id)
+    logger.info(f"Job {job_id} {status}")
+
+
+def _log_lost_lease(job: dict):
+    logger.warning(f"Job {job['id']}: attempt {job['attempts']} finished after its lease expired, discarding its outcome")
+
+
+def _worker_loop(worker_name: str):
+    while True:
+        try:
+            job = _claim_next_job(worker_name)
+            if job is None:
+                time.sleep(POLL_INTERVAL_SECONDS)
+                continue
+            _run_job(job)
+        except Exception as e:
+            # A worker thread must outlive any single failure: nothing restarts it
+            logger.error(f"Worker {worker_name} hit an unexpected error, polling again shortly: {e}")
+            time.sleep(WORKER_ERROR_BACKOFF_SECONDS)
+
+
+def start_workers(num_workers: int = None) -> int:
+    """
+    Starts the in-process worker pool and the workspace garbage collector (once per process)
+    and returns the number of running workers.
+
+    Args:
+        num_workers (int): Number of worker threads. Defaults to NUM_WORKERS.
+    """
+    start_garbage_collector()
+    with _workers_lock:
+        if not _workers:
+            for index in range(num_workers or NUM_WORKERS):
+                # Unique across machines sharing the job store, since leases are renewed by worker name
+                worker_name = f"{socket.gethostname()}-{os.getpid()}-{index}"
+                thread = threading.Thread(target=_worker_loop, args=(worker_name,), name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                _workers.append(thread)
+            logger.info(f"Started {len(_workers)} job worker(s)")
+        return len(_workers)
+
+
+# ==========================================
+# Standalone worker service
+# ==========================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Music-Agent job workers against the shared job store.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Number of worker threads")
+    parser.add_argument("--no-warmup", action="store_true", help="Skip preloading models; they load on first use")
+    args = parser.parse_args()
+
+    start_metrics_server()
+    if not args.no_warmup:
+        # Only claim jobs once the models are warm, so a freshly scaled-up worker never makes a user wait for them
+        start_warmup()
+        if not wait_until_ready():
+            logger.warning("Some models failed to warm up; they will be loaded again on first use")
+    start_workers(args.workers)
+    while True:
+        time.sleep(60)
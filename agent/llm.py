@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+# ==========================================
+# 🌟 Pluggable LLM Backends
+# ==========================================
+# Every backend is an OpenAI-compatible client (`client.chat.completions.create(...)`, streaming included):
+#   - "remote": a hosted provider (DeepSeek by default) over a bounded, keep-alive connection pool with timeouts
+#   - "local":  a locally served OpenAI-compatible model (Ollama, llama.cpp server, vLLM...), no network hop
+#   - "replay": answers from a cassette recorded earlier, deterministic and fully offline
+# With MUSIC_AGENT_LLM_RECORD=1, the remote/local backend also appends every exchange to the cassette,
+# so a real session can be replayed later (e.g. for offline load tests of the whole tool pipeline).
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-LLM")
+
+# Securely load environment variables (the API key of the remote provider)
+load_dotenv()
+
+LLM_BACKEND = os.getenv("MUSIC_AGENT_LLM_BACKEND", "remote")
+
+REMOTE_BASE_URL = os.getenv("MUSIC_AGENT_LLM_BASE_URL", "https://api.deepseek.com")
+REMOTE_MODEL = os.getenv("MUSIC_AGENT_LLM_MODEL", "deepseek-chat")
+LOCAL_BASE_URL = os.getenv("MUSIC_AGENT_LOCAL_LLM_URL", "http://localhost:11434/v1")
+LOCAL_MODEL = os.getenv("MUSIC_AGENT_LOCAL_LLM_MODEL", "qwen2.5:7b-instruct")
+LLM_MODEL = LOCAL_MODEL if LLM_BACKEND == "local" else REMOTE_MODEL
+
+# Seconds allowed to connect, and between two reads (also between two streamed chunks)
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MUSIC_AGENT_LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("MUSIC_AGENT_LLM_TIMEOUT", "60"))
+# Connection pool shared by all runs of the process; kept-alive connections skip the TLS handshake
+LLM_MAX_CONNECTIONS = int(os.getenv("MUSIC_AGENT_LLM_MAX_CONNECTIONS", "16"))
+LLM_KEEPALIVE_SECONDS = 60.0
+
+CASSETTE_PATH = Path(os.getenv("MUSIC_AGENT_LLM_CASSETTE", "workspace/llm_cassettes/session.jsonl"))
+RECORD = os.getenv("MUSIC_AGENT_LLM_RECORD", "0") == "1"
+# Replay with the recorded response times instead of instantly (for realistic load tests)
+REPLAY_REALTIME = os.getenv("MUSIC_AGENT_REPLAY_REALTIME", "0") == "1"
+
+# Absolute paths differ between runs (job workspaces), so requests are matched on file names only
+PATH_PATTERN = re.compile(r"(?:[A-Za-z]:)?[/\\](?:[^\s'\"/\\]+[/\\])+([^\s'\"/\\]+)")
+
+
+def _client_namespace(create):
+    """Wraps a `create` function into the `client.chat.completions.create` shape of the OpenAI SDK."""
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+# ==========================================
+# Remote & local OpenAI-compatible servers
+# ==========================================
+
+def _openai_client(base_url: str, api_key: str):
+    import httpx
+    from openai import OpenAI
+
+    timeout = httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        ),
+    )
+    # Retries are handled by agent/retry.py, including failures in the middle of a streamed response
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0, http_client=http_client)
+
+
+# ==========================================
+# Record & replay
+# ==========================================
+
+def request_key(request: dict) -> str:
+    """
+    Identifies a chat request independently of where the run's files live: the model, the tool names and
+    every message, with absolute paths reduced to their file names.
+    """
+    messages = []
+    for message in request.get("messages", []):
+        if not isinstance(message, dict):
+            message = {"role": message.role, "content": message.content}
+        messages.append({
+            "role": message["role"],
+            "content": PATH_PATTERN.sub(r"\1", message.get("content") or ""),
+            "tool_calls": [call["function"]["name"] for call in message.get("tool_calls", [])],
+        })
+    payload = {
+        "model": request.get("model"),
+        "tools": [tool["function"]["name"] for tool in request.get("tools") or []],
+        "messages": messages,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _remap_paths(arguments: str, messages: list) -> str:
+    """Points recorded file paths in tool arguments at the files of the same name in the current run."""
+    current = {}
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else message.content
+        for match in PATH_PATTERN.finditer(content or ""):
+            current[match.group(1)] = match.group(0)
+    return PATH_PATTERN.sub(lambda match: current.get(match.group(1), match.group(0)), arguments)
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached_tokens is None:
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "prompt_cache_hit_tokens": cached_tokens,
+    }
+
+
+class RecordingClient:
+    """Passes requests to another OpenAI-compatible client and appends each exchange to a JSONL cassette."""
+
+    def __init__(self, inner, cassette_path: Path = None):
+        self.inner = inner
+        self.cassette_path = Path(cassette_path or CASSETTE_PATH)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = _client_namespace(self._create).chat
+
+    def _append(self, request: dict, response: dict, seconds: float):
+        record = {"key": request_key(request), "model": request.get("model"), "response": response, "seconds": seconds}
+        with self._lock:
+            self.cassette_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _create(self, **request):
+        self.calls += 1
+        start = time.perf_counter()
+        result = self.inner.chat.completions.create(**request)
+        if request.get("stream"):
+            return self._record_stream(request, result, start)
+        message = result.choices[0].message
+        self._append(request, {
+            "content": message.content,
+            "tool_calls": [
+                {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+                for call in message.tool_calls or []
+            ],
+            "usage": _usage_dict(result.usage),
+        }, time.perf_counter() - start)
+        return result
+
+    def _record_stream(self, request: dict, stream, start: float):
+        """Yields the chunks unchanged while assembling the response; it is recorded once the stream is complete."""
+        content_parts, tool_calls, usage = [], {}, None
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                content_parts.append(delta.content or "")
+                for fragment in delta.tool_calls or []:
+                    call = tool_calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": ""})
+                    call["id"] = fragment.id or call["id"]
+                    if fragment.function:
+                        call["name"] += fragment.function.name or ""
+                        call["arguments"] += fragment.function.arguments or ""
+            yield chunk
+        self._append(request, {
+            "content": "".join(content_parts) or None,
+            "tool_calls": [call for _, call in sorted(tool_calls.items())],
+            "usage": _usage_dict(usage),
+        }, time.perf_counter() - start)
+
+
+class ReplayClient:
+    """
+    Answers chat requests from a recorded cassette, without any network access. A request matches a recording
+    with the same request_key; identical requests recorded several times are answered in recording order.
+    Recorded file paths in tool arguments are remapped onto the current run's files of the same name.
+    """
+
+    def __init__(self, cassette_path: Path = None, realtime: bool = None):
+        self.cassette_path = Path(cassette_path or CASSETTE_PATH)
+        self.realtime = REPLAY_REALTIME if realtime is None else realtime
+        self.calls = 0
+        self._recordings = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        with open(self.cassette_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._recordings.setdefault(record["key"], []).append(record)
+        self.chat = _client_namespace(self._create).chat
+        logger.info(f"Replaying {sum(map(len, self._recordings.values()))} recorded LLM responses from {self.cassette_path}")
+
+    def _next_recording(self, key: str) -> dict:
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                raise LookupError(f"No recorded LLM response matches this request (key {key[:12]}) in {self.cassette_path}")
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            # Past the recorded ones, identical requests (e.g. many concurrent load-test runs) reuse the last answer
+            return recordings[min(index, len(recordings) - 1)]
+
+    def _create(self, **request):
+        self.calls += 1
+        record = self._next_recording(request_key(request))
+        if self.realtime:
+            time.sleep(record["seconds"])
+        recorded = record["response"]
+        tool_calls = [
+            SimpleNamespace(id=call["id"], type="function", function=SimpleNamespace(
+                name=call["name"], arguments=_remap_paths(call["arguments"], request["messages"])
+            ))
+            for call in recorded["tool_calls"]
+        ]
+        usage = SimpleNamespace(**recorded["usage"]) if recorded["usage"] else None
+        if not request.get("stream"):
+            message = SimpleNamespace(role="assistant", content=recorded["content"], tool_calls=tool_calls or None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        return self._as_stream(recorded["content"], tool_calls, usage)
+
+    @staticmethod
+    def _as_stream(content, tool_calls: list, usage):
+        """The recorded response as chat-completion chunks: one delta with the message, then the usage."""
+        fragments = [
+            SimpleNamespace(index=index, id=call.id, type="function", function=call.function)
+            for index, call in enumerate(tool_calls)
+        ]
+        delta = SimpleNamespace(content=content, tool_calls=fragments or None)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def create_client(backend: str = None):
+    """
+    Builds the OpenAI-compatible client of an LLM backend.
+
+    Args:
+        backend (str): "remote", "local" or "replay". Defaults to MUSIC_AGENT_LLM_BACKEND.
+
+    Returns:
+        An object with `chat.completions.create(...)`, wrapped in a RecordingClient when MUSIC_AGENT_LLM_RECORD=1.
+    """
+    backend = backend or LLM_BACKEND
+    if backend == "replay":
+        return ReplayClient()
+    if backend == "local":
+        # Local servers ignore the key, but the SDK requires one
+        client = _openai_client(LOCAL_BASE_URL, os.getenv("MUSIC_AGENT_LOCAL_LLM_KEY", "local"))
+    elif backend == "remote":
+        client = _openai_client(REMOTE_BASE_URL, os.getenv("DEEPSEEK_API_KEY"))
+    else:
+        raise ValueError(f"Unknown LLM backend '{backend}' (expected remote, local or replay)")
+    if RECORD:
+        logger.info(f"Recording LLM responses to {CASSETTE_PATH}")
+        return RecordingClient(client)
+    return client
@@ -0,0 +1,329 @@
+import os
+import re
+import json
+
+from agent.retry import call_with_retries
+from tools.tracing import span, record_llm_usage, KIND_LLM
+
+# ==========================================
+# 🌟 Deterministic Pipeline Planner
+# ==========================================
+# The agent only ever runs three fixed pipelines. When the intent is obvious from the
+# request text we run the matching pipeline directly and skip the LLM planning turns.
+
+PIPELINES = {
+    "separate": ["separate_audio_stems"],
+    "transcribe": ["separate_audio_stems", "audio_to_midi"],
+    "remix": ["separate_audio_stems", "audio_to_midi", "analyze_midi", "generate_music"],
+}
+
+# Remixes condition MusicGen-Melody on the transcribed MIDI instead of the prompt alone
+MELODY_REMIX = os.getenv("MUSIC_AGENT_MELODY_REMIX", "0") == "1"
+
+# Checked in priority order: the most complete pipeline that matches wins
+INTENT_KEYWORDS = [
+    ("remix", ["remix", "generate", "create new", "compose", "re-arrange", "rearrange",
+               "生成", "创作", "改编", "重新编曲", "混音"]),
+    ("transcribe", ["midi", "transcribe", "transcription", "sheet music", "score",
+                    "扒谱", "乐谱", "转录", "转谱"]),
+    ("separate", ["separate", "extract", "isolate", "split", "stem", "vocal", "accompaniment",
+                  "karaoke", "instrumental", "分离", "提取", "伴奏", "人声", "音轨", "清唱"]),
+]
+
+# Negations and restrictions ("don't generate", "without drums", "only the vocals") change what a keyword
+# means, so such requests are left to the LLM loop rather than matched to a fixed pipeline
+NEGATION_PATTERN = re.compile(
+    r"(?<![a-z])(?:don['’]?t|do not|doesn['’]?t|does not|no|not|never|without|only|except|[a-z]+n['’]t)(?![a-z])"
+)
+NEGATION_KEYWORDS = ["不要", "别", "不用", "无需", "不需要", "只", "仅", "除了"]
+
+STEM_KEYWORDS = [
+    ("vocals", ["vocal", "voice", "singing", "melody", "人声", "清唱", "旋律"]),
+    ("bass", ["bass", "贝斯"]),
+    ("drums", ["drum", "beat", "鼓"]),
+]
+ALL_STEMS_KEYWORDS = ["all stems", "every stem", "whole band", "all instruments", "全部", "所有"]
+
+# Stems a separation request can ask for by name (see AVAILABLE_STEMS in tools/separator.py)
+SEPARATION_STEM_KEYWORDS = [
+    ("vocals", ["vocal", "voice", "singing", "acapella", "a cappella", "人声", "清唱"]),
+    ("accompaniment", ["accompaniment", "instrumental", "karaoke", "backing track", "伴奏"]),
+    ("drums", ["drum", "鼓"]),
+    ("bass", ["bass", "贝斯"]),
+]
+# Instruments Demucs has no stem for: the fixed separate pipeline cannot deliver them
+UNSUPPORTED_STEM_KEYWORDS = ["guitar", "piano", "keys", "violin", "strings", "horn", "sax", "synth",
+                             "吉他", "钢琴", "小提琴", "弦乐", "萨克斯"]
+
+# "3 variants", "three versions", "5个版本"; a bare "some versions" has no count and goes to the LLM loop
+NUMBER_WORDS = {"two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+                "两": 2, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8}
+VARIANT_WORDS_PATTERN = re.compile(r"(?<![a-z])(?:variants?|versions?|variations?|alternatives?|options|takes)(?![a-z])|版本|变体")
+VARIANT_COUNT_PATTERN = re.compile(
+    r"(\d+|two|three|four|five|six|seven|eight|[两二三四五六七八])\s*(?:个|种)?\s*(?:different\s+|distinct\s+|remix\s+)?"
+    r"(?:variants?|versions?|variations?|alternatives?|options|takes|版本|变体)"
+)
+# generate_music_batch writes this many files at most per planned request
+MAX_PLANNED_VARIANTS = 8
+
+# "60 sec", "10-second", "3 minutes", "90秒", "2分钟" (a bare "s" is skipped: "80s synthwave" is a decade)
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*-?\s*(seconds?|secs?|秒|minutes?|mins?|分钟)")
+AUDIO_PATH_PATTERN = re.compile(r"""['"]([^'"]+\.(?:mp3|wav|flac|ogg|m4a|aac))['"]""", re.IGNORECASE)
+SYSTEM_CONTEXT_PATTERN = re.compile(r"\[System Context:.*?\]", re.DOTALL)
+
+GENERATION_PROMPT_INSTRUCTIONS = (
+    "You write prompts for Meta's MusicGen text-to-music model. "
+    "Given the user's request and the analysis of the original track, reply with ONE detailed English prompt "
+    "describing style, mood, instrumentation, tempo and melodic cues. When the analysis has a key, tempo or chord "
+    "progression, state them exactly instead of inventing new ones. Reply with the prompt only."
+)
+
+
+def _contains_any(text: str, keywords: list) -> bool:
+    """Substring match for CJK keywords; English keywords must not follow a latin letter ("stem" != "system")."""
+    for keyword in keywords:
+        if keyword.isascii():
+            if re.search(r"(?<![a-z])" + re.escape(keyword), text):
+                return True
+        elif keyword in text:
+            return True
+    return False
+
+
+def _request_text(user_prompt: str) -> str:
+    """The user's own words, without the file-location context injected by app.py."""
+    return SYSTEM_CONTEXT_PATTERN.sub("", user_prompt).lower()
+
+
+def _has_negation(text: str) -> bool:
+    return bool(NEGATION_PATTERN.search(text)) or _contains_any(text, NEGATION_KEYWORDS)
+
+
+def classify_intent(user_prompt: str):
+    """
+    Classifies a request into one of the fixed pipelines using keyword rules.
+
+    Returns:
+        str | None: "separate", "transcribe", "remix", or None when the intent is unclear
+                    (including any request with a negation or restriction, see NEGATION_PATTERN).
+    """
+    text = _request_text(user_prompt)
+    if _has_negation(text):
+        return None
+    for intent, keywords in INTENT_KEYWORDS:
+        if _contains_any(text, keywords):
+            return intent
+    return None
+
+
+def extract_input_path(user_prompt: str):
+    """Finds the quoted audio file path in the request (including the app's injected system context)."""
+    matches = AUDIO_PATH_PATTERN.findall(user_prompt)
+    return matches[-1] if matches else None
+
+
+def _stems_to_transcribe(user_prompt: str) -> list:
+    text = _request_text(user_prompt)
+    if _contains_any(text, ALL_STEMS_KEYWORDS):
+        return ["vocals", "drums", "bass", "other"]
+    for stem, keywords in STEM_KEYWORDS:
+        if _contains_any(text, keywords):
+            return [stem]
+    # Same default as the LLM agent: the "other" stem carries the harmonic accompaniment
+    return ["other"]
+
+
+def _stems_to_separate(user_prompt: str):
+    """
+    The stems a separation request names, [] when it names none (all four Demucs sources are written),
+    or None when it asks for something the separator cannot produce (e.g. "the guitar").
+    """
+    text = _request_text(user_prompt)
+    if _contains_any(text, UNSUPPORTED_STEM_KEYWORDS):
+        return None
+    if _contains_any(text, ALL_STEMS_KEYWORDS):
+        return []
+    return [stem for stem, keywords in SEPARATION_STEM_KEYWORDS if _contains_any(text, keywords)]
+
+
+def _requested_variants(user_prompt: str):
+    """The number of remix variants asked for (1 by default), or None when it is mentioned but not understood."""
+    text = _request_text(user_prompt)
+    if not VARIANT_WORDS_PATTERN.search(text):
+        return 1
+    match = VARIANT_COUNT_PATTERN.search(text)
+    if match is None:
+        return None
+    count = int(match.group(1)) if match.group(1).isdigit() else NUMBER_WORDS[match.group(1)]
+    return count if 1 <= count <= MAX_PLANNED_VARIANTS else None
+
+
+def _requested_duration(user_prompt: str):
+    """The generation length asked for in the request, in seconds, or None."""
+    match = DURATION_PATTERN.search(_request_text(user_prompt))
+    if match is None:
+        return None
+    value, unit = float(match.group(1)), match.group(2)
+    return value * 60 if unit.startswith("min") or unit == "分钟" else value
+
+
+def plan_pipeline(user_prompt: str):
+    """
+    Builds an execution plan for a request, or returns None so the caller falls back to the LLM agent loop
+    (unclear intent, several input files, or details the fixed pipelines cannot express).
+
+    Returns:
+        dict | None: {"intent", "steps", "input_file_path", "separate_stems", "transcribe_stems",
+                      "duration_seconds", "num_variants"}. separate_stems is None for all four sources.
+    """
+    intent = classify_intent(user_prompt)
+    input_file_path = extract_input_path(user_prompt)
+    if intent is None or input_file_path is None or len(set(AUDIO_PATH_PATTERN.findall(user_prompt))) > 1:
+        return None
+
+    transcribe_stems = _stems_to_transcribe(user_prompt)
+    if intent == "separate":
+        separate_stems = _stems_to_separate(user_prompt)
+        if separate_stems is None:
+            return None
+    else:
+        # Only the stems that will be transcribed are written
+        separate_stems = transcribe_stems
+
+    num_variants, duration_seconds = 1, _requested_duration(user_prompt)
+    if intent == "remix":
+        num_variants = _requested_variants(user_prompt)
+        # Batched variants have no duration control, and melody conditioning has no batch mode
+        if num_variants is None or (num_variants > 1 and (duration_seconds or MELODY_REMIX)):
+            return None
+
+    return {
+        "intent": intent,
+        "steps": PIPELINES[intent],
+        "input_file_path": input_file_path,
+        "separate_stems": separate_stems or None,
+        "transcribe_stems": transcribe_stems,
+        "duration_seconds": duration_seconds,
+        "num_variants": num_variants,
+    }
+
+
+def _write_generation_prompt(llm_client, model: str, user_prompt: str, context: dict) -> str:
+    """The single LLM call of the planned remix pipeline: turns the request and analysis into a MusicGen prompt."""
+    with span("llm.generation_prompt", KIND_LLM, model=model) as llm_span:
+        response = call_with_retries(
+            lambda: llm_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": GENERATION_PROMPT_INSTRUCTIONS},
+                    {"role": "user", "content": f"User request:\n{user_prompt}\n\nAnalysis so far:\n{json.dumps(context)}"},
+                ],
+            ),
+            on_retry=lambda attempt, error, delay: llm_span.set(retries=attempt),
+        )
+        record_llm_usage(llm_span, response)
+    return response.choices[0].message.content.strip()
+
+
+def _summarize(plan: dict, context: dict) -> str:
+    """Builds the final answer locally instead of spending an LLM round trip on it."""
+    lines = [f"Completed the **{plan['intent']}** pipeline ({' -> '.join(plan['steps'])}) for `{plan['input_file_path']}`."]
+
+    tracks = context.get("tracks")
+    if tracks:
+        lines.append("\n**Separated stems:**")
+        lines.extend(f"- {stem}: `{path}`" for stem, path in tracks.items())
+
+    midi_paths = context.get("midi_paths")
+    if midi_paths:
+        lines.append("\n**MIDI transcriptions:**")
+        lines.extend(f"- {stem}: `{path}`" for stem, path in midi_paths.items())
+
+    analysis = context.get("analysis")
+    if analysis:
+        lines.append("\n**MIDI analysis:**")
+        lines.extend(f"- {stem}: {summary['prompt_hint']}" for stem, summary in analysis.items())
+
+    generated = context.get("generated_audio")
+    if generated:
+        if len(generated) == 1:
+            lines.append(f"\n**Generated Remix:** `{generated[0]}`")
+        else:
+            lines.append("\n**Generated Remixes:**")
+            lines.extend(f"- Variant {index}: `{path}`" for index, path in enumerate(generated, 1))
+        lines.append(f"\nMusicGen prompt: _{context['generation_prompt']}_")
+
+    return "\n".join(lines)
+
+
+def run_planned_pipeline(plan: dict, user_prompt: str, run_tool, llm_client, model: str = "deepseek-chat") -> str:
+    """
+    Executes a plan from plan_pipeline stage by stage, feeding each stage's outputs into the next.
+
+    Args:
+        plan (dict): The plan returned by plan_pipeline.
+        user_prompt (str): The original request, used for the generation prompt.
+        run_tool (callable): run_tool(name, args) -> dict, executing one tool from AVAILABLE_TOOLS.
+        llm_client: OpenAI-compatible client; only called once, for the remix generation prompt.
+        model (str): Chat model used for that call.
+
+    Returns:
+        str: The final answer shown to the user.
+    """
+    context = {}
+
+    for step in plan["steps"]:
+        print(f"🗺️  [Planner] Running stage '{step}'")
+
+        if step == "separate_audio_stems":
+            separate_args = {"input_file_path": plan["input_file_path"]}
+            if plan["separate_stems"]:
+                separate_args["stems"] = plan["separate_stems"]
+            result = run_tool(step, separate_args)
+            if "error" in result:
+                return f"❌ Error: Separation failed: {result['error']}"
+            context["tracks"] = result["tracks"]
+
+        elif step == "audio_to_midi":
+            stems = plan["transcribe_stems"]
+            if len(stems) == 1:
+                results = [run_tool(step, {"input_file_path": context["tracks"][stems[0]]})]
+            else:
+                batch = run_tool("audio_to_midi_batch", {"input_file_paths": [context["tracks"][s] for s in stems]})
+                results = batch.get("results", [batch])
+            errors = [r["error"] for r in results if "error" in r]
+            if errors:
+                return f"❌ Error: Transcription failed: {'; '.join(errors)}"
+            context["midi_paths"] = {stem: r["midi_path"] for stem, r in zip(stems, results)}
+
+        elif step == "analyze_midi":
+            # The analysis only enriches the generation prompt, so a failure here does not stop the pipeline
+            context["analysis"] = {}
+            for stem, midi_path in context["midi_paths"].items():
+                result = run_tool(step, {"midi_path": midi_path})
+                if "error" not in result:
+                    context["analysis"][stem] = {
+                        key: value for key, value in result.items() if key not in ("status", "midi_path")
+                    }
+
+        elif step == "generate_music":
+            context["generation_prompt"] = _write_generation_prompt(llm_client, model, user_prompt, context)
+            generate_args = {"prompt": context["generation_prompt"]}
+            if plan["duration_seconds"]:
+                generate_args["duration_seconds"] = plan["duration_seconds"]
+            if plan["num_variants"] > 1:
+                result = run_tool("generate_music_batch", {
+                    "prompts": [context["generation_prompt"]], "num_variants": plan["num_variants"]
+                })
+            elif MELODY_REMIX:
+                generate_args["melody_path"] = next(iter(context["midi_paths"].values()))
+                result = run_tool("generate_music_from_melody", generate_args)
+            else:
+                result = run_tool(step, generate_args)
+            if "error" in result:
+                return f"❌ Error: Generation failed: {result['error']}"
+            context["generated_audio"] = (
+                [output["audio_path"] for output in result["outputs"]] if "outputs" in result else [result["audio_path"]]
+            )
+
+    return _summarize(plan, context)
@@ -0,0 +1,68 @@
+import os
+import time
+import random
+import logging
+
+import openai
+
+# ==========================================
+# 🌟 LLM Retries with Backoff
+# ==========================================
+# Timeouts, dropped connections, rate limits and 5xx responses from the LLM provider are usually gone
+# a few seconds later, so they are retried a bounded number of times with exponential backoff and
+# jitter instead of failing a run that may already have minutes of separation and generation behind it.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-Retry")
+
+# Retries after the first attempt
+LLM_MAX_RETRIES = int(os.getenv("MUSIC_AGENT_LLM_RETRIES", "3"))
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 20.0
+
+TRANSIENT_STATUS_CODES = {408, 409, 429}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an error from an LLM call is worth retrying (timeouts, connection errors, 408/409/429/5xx)."""
+    if isinstance(error, (TimeoutError, ConnectionError, openai.APIConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and (status_code in TRANSIENT_STATUS_CODES or status_code >= 500)
+
+
+def _retry_after_seconds(error: Exception):
+    """The delay requested by the provider's Retry-After header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after")), RETRY_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(call, max_retries: int = None, on_retry=None):
+    """
+    Runs `call()` and retries it on transient errors with exponential backoff (full jitter, capped at
+    RETRY_MAX_SECONDS, or the provider's Retry-After). Other errors, and the last failure, are raised.
+
+    Args:
+        call (callable): The LLM request, including the consumption of a streamed response.
+        max_retries (int): Retries after the first attempt. Defaults to LLM_MAX_RETRIES.
+        on_retry (callable): Optional on_retry(attempt, error, delay_seconds), called before each retry.
+    """
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt >= max_retries or not is_transient(e):
+                raise
+            delay = _retry_after_seconds(e) or random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+            logger.warning(f"Transient LLM error ({type(e).__name__}: {e}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            if on_retry:
+                on_retry(attempt + 1, e, delay)
+            time.sleep(delay)
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import importlib
+import threading
+
+from agent.core import ENABLED_TOOLS, TOOL_MODELS
+from tools.tracing import set_gauge, set_readiness_probe
+
+# ==========================================
+# 🌟 Model Warm-up & Readiness
+# ==========================================
+# Tool modules and model weights load lazily, so without a warm-up the first request of a fresh
+# process pays for importing TensorFlow/torch, loading the weights and the first (slowest) inference.
+# At startup we do all of that in the background instead and report when the process is ready.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-Warmup")
+
+# Model -> (module, function) loading it and running a tiny dummy inference
+WARMUP_FUNCTIONS = {
+    "demucs": ("tools.separator", "warm_up"),
+    "basic_pitch": ("tools.transcriber", "warm_up"),
+    "musicgen": ("tools.generator", "warm_up"),
+    "musicgen_melody": ("tools.generator", "warm_up_melody"),
+}
+
+# Comma-separated models to preload; by default the models behind the enabled tools
+# (MusicGen-Melody is only preloaded when listed explicitly). Set to 0 to disable the warm-up.
+DEFAULT_PRELOAD_MODELS = sorted({TOOL_MODELS[tool] for tool in ENABLED_TOOLS if tool in TOOL_MODELS})
+PRELOAD_MODELS = os.getenv("MUSIC_AGENT_PRELOAD", ",".join(DEFAULT_PRELOAD_MODELS))
+
+# Statuses that end a model's warm-up; "skipped" models have nothing to preload (e.g. the Demucs CLI backend)
+FINISHED_STATUSES = {"ready", "skipped", "failed"}
+
+_status = {}
+_status_lock = threading.Lock()
+_threads = []
+
+
+def _preload_models() -> list:
+    if PRELOAD_MODELS.strip() in ("", "0"):
+        return []
+    return [name.strip() for name in PRELOAD_MODELS.split(",") if name.strip() in WARMUP_FUNCTIONS]
+
+
+def _set_status(model: str, status: str, seconds: float = None, error: str = None):
+    with _status_lock:
+        _status[model] = {"status": status, "seconds": seconds, "error": error}
+    set_gauge("music_agent_model_ready", 1 if status in ("ready", "skipped") else 0,
+              "1 once the model is loaded and warmed up.", model=model)
+    if seconds is not None:
+        set_gauge("music_agent_model_warmup_seconds", seconds,
+                  "Time spent importing, loading and warming up the model.", model=model)
+
+
+def _warm_up_model(model: str):
+    _set_status(model, "loading")
+    start = time.perf_counter()
+    try:
+        module_name, function_name = WARMUP_FUNCTIONS[model]
+        result = getattr(importlib.import_module(module_name), function_name)()
+        status = "skipped" if result.get("status") == "skipped" else "ready"
+        _set_status(model, status, seconds=time.perf_counter() - start)
+        logger.info(f"'{model}' {status} after {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        _set_status(model, "failed", seconds=time.perf_counter() - start, error=str(e))
+        logger.error(f"Warm-up of '{model}' failed: {e}")
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def start_warmup(models: list = None) -> list:
+    """
+    Starts warming up the models in the background (once per process) and registers the /ready probe.
+
+    Args:
+        models (list): Model names from WARMUP_FUNCTIONS. Defaults to MUSIC_AGENT_PRELOAD.
+
+    Returns:
+        list: The models being warmed up.
+    """
+    with _status_lock:
+        if _threads or _status:
+            return list(_status)
+        models = _preload_models() if models is None else models
+        for model in models:
+            _status[model] = {"status": "pending", "seconds": None, "error": None}
+
+    set_readiness_probe(readiness)
+    for model in models:
+        # One thread per model: the imports and weight loads of different models overlap
+        thread = threading.Thread(target=_warm_up_model, args=(model,), name=f"warmup-{model}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+    if models:
+        logger.info(f"Warming up {', '.join(models)} in the background...")
+    return models
+
+
+def readiness() -> dict:
+    """
+    Returns {"ready": bool, "models": {model: {"status", "seconds", "error"}}}.
+    The process is ready once every preloaded model warmed up without error.
+    """
+    with _status_lock:
+        models = {model: dict(status) for model, status in _status.items()}
+    ready = all(status["status"] in ("ready", "skipped") for status in models.values())
+    return {"ready": ready, "models": models}
+
+
+def wait_until_ready(timeout: float = None) -> bool:
+    """Blocks until every warm-up has finished (or the timeout expires) and returns whether the process is ready."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for thread in list(_threads):
+        thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+    return readiness()["ready"]
@@ -0,0 +1,379 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+import contextlib
+from pathlib import Path
+
+# ==========================================
+# 🌟 Multi-tenant Workspace Manager
+# ==========================================
+# Every job gets its own directory under its tenant (one Streamlit session, or an API caller):
+# workspace/tenants/<tenant>/<job_id>/. The workspaces and the artifacts written into them are
+# recorded in a SQLite index shared by the app and worker processes. A per-tenant disk quota and a
+# global cap over all tenants are checked when a job is admitted and whenever it records an artifact,
+# and a background collector deletes finished workspaces once they expire (TTL) or, least recently
+# used first, while a tenant (or the whole tree) is over its budget. Tenants are not authenticated:
+# the web UI uses one per browser session, so the global cap is what bounds the disk in the end.
+# Workspaces are deleted by renaming them out of the tree first, so nobody sees half-deleted files.
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Agent-Workspace")
+
+TENANTS_ROOT = Path(os.getenv("MUSIC_AGENT_TENANTS_ROOT", "workspace/tenants"))
+TRASH_DIR = TENANTS_ROOT / ".trash"
+DB_PATH = Path(os.getenv("MUSIC_AGENT_WORKSPACE_DB", "workspace/workspaces.db"))
+DEFAULT_TENANT = "default"
+
+# Disk budget per tenant; a job is rejected (or fails) if its tenant is still over it after garbage collection
+TENANT_QUOTA_BYTES = int(os.getenv("MUSIC_AGENT_TENANT_QUOTA_BYTES", str(2 * 1024 ** 3)))
+# Disk budget of all tenants together, enforced the same way
+TOTAL_QUOTA_BYTES = int(os.getenv("MUSIC_AGENT_WORKSPACE_MAX_BYTES", str(20 * 1024 ** 3)))
+# Finished workspaces not accessed for this long are deleted
+WORKSPACE_TTL_SECONDS = float(os.getenv("MUSIC_AGENT_WORKSPACE_TTL_HOURS", "24")) * 3600
+GC_INTERVAL_SECONDS = float(os.getenv("MUSIC_AGENT_GC_INTERVAL_SECONDS", "300"))
+
+_schema_ready = False
+_gc_thread = None
+_gc_lock = threading.Lock()
+# Output paths handed out by reserve_output_path and not yet released, per process
+_reserved_paths = set()
+_reserved_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workspaces (
+    id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    workspace_id TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_workspaces_tenant ON workspaces (tenant, status, last_access);
+CREATE INDEX IF NOT EXISTS idx_artifacts_workspace ON artifacts (workspace_id);
+"""
+
+
+class QuotaExceededError(RuntimeError):
+    """Raised when a tenant (or the workspace tree) has no room left, even after garbage collection."""
+
+
+@contextlib.contextmanager
+def _connect():
+    """Opens a short-lived autocommit connection; every thread and process uses its own."""
+    global _schema_ready
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _schema_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def _safe_tenant(tenant: str) -> str:
+    """Tenant IDs become directory names, so anything but letters, digits, '-' and '_' is replaced."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", tenant or DEFAULT_TENANT)[:64]
+
+
+def _directory_size(root) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _delete_workspace(workspace_id: str) -> int:
+    """
+    Deletes one finished workspace and its index rows, returning the bytes freed.
+    The row is claimed first, so concurrent collectors (other processes) never delete the same workspace twice,
+    and the directory is renamed into TRASH_DIR before it is removed.
+    """
+    with _connect() as conn:
+        claimed = conn.execute(
+            "UPDATE workspaces SET status = 'deleting' WHERE id = ? AND status = 'released'", (workspace_id,)
+        ).rowcount
+        row = conn.execute("SELECT path, size FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+    if not claimed or row is None:
+        return 0
+
+    path = Path(row["path"])
+    if path.exists():
+        TRASH_DIR.mkdir(parents=True, exist_ok=True)
+        trash_path = TRASH_DIR / f"{workspace_id}.{os.getpid()}"
+        os.replace(path, trash_path)
+        shutil.rmtree(trash_path, ignore_errors=True)
+
+    with _connect() as conn:
+        conn.execute("DELETE FROM artifacts WHERE workspace_id = ?", (workspace_id,))
+        conn.execute("DELETE FROM workspaces WHERE id = ?", (workspace_id,))
+    return row["size"]
+
+
+def _usage(tenant: str = None) -> int:
+    """Bytes used by a tenant's workspaces, or by all of them; active workspaces are measured on disk."""
+    query, params = "SELECT path, status, size FROM workspaces WHERE status != 'deleting'", ()
+    if tenant is not None:
+        query, params = query + " AND tenant = ?", (tenant,)
+    with _connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return sum(_directory_size(row["path"]) if row["status"] == "active" else row["size"] for row in rows)
+
+
+def _evict(tenant: str = None, needed_bytes: int = 0) -> tuple:
+    """
+    Deletes the least recently used finished workspaces of a tenant (or of any tenant, against the global cap)
+    until `needed_bytes` more fit in its budget.
+    """
+    quota = TENANT_QUOTA_BYTES if tenant is not None else TOTAL_QUOTA_BYTES
+    query, params = "SELECT id FROM workspaces WHERE status = 'released'", ()
+    if tenant is not None:
+        query, params = query + " AND tenant = ?", (tenant,)
+    evicted, freed = 0, 0
+    while _usage(tenant) + needed_bytes > quota:
+        with _connect() as conn:
+            row = conn.execute(query + " ORDER BY last_access LIMIT 1", params).fetchone()
+        if row is None:
+            break
+        freed += _delete_workspace(row["id"])
+        evicted += 1
+    return evicted, freed
+
+
+def _enforce_quota(tenant: str, needed_bytes: int = 0):
+    """Evicts old workspaces as needed, then raises QuotaExceededError if `needed_bytes` more still do not fit."""
+    budgets = ((tenant, TENANT_QUOTA_BYTES, f"tenant '{tenant}'"), (None, TOTAL_QUOTA_BYTES, "all tenants"))
+    for scope, quota, label in budgets:
+        _evict(scope, needed_bytes)
+        usage = _usage(scope)
+        if usage + needed_bytes > quota:
+            raise QuotaExceededError(f"Workspace quota of {label} exceeded: {usage + needed_bytes} of {quota} bytes")
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def allocate_workspace(tenant: str, workspace_id: str, reserve_bytes: int = 0) -> Path:
+    """
+    Creates the directory of a new job for a tenant and registers it in the index.
+
+    Args:
+        tenant (str): The owner of the job (e.g. a Streamlit session ID).
+        workspace_id (str): Unique ID of the workspace, usually the job ID.
+        reserve_bytes (int): Bytes about to be written right away (e.g. the uploaded audio).
+
+    Returns:
+        Path: The absolute path of the new workspace directory.
+
+    Raises:
+        QuotaExceededError: If the tenant's files (or all tenants' files) still exceed their quota after
+                            evicting old workspaces.
+    """
+    tenant = _safe_tenant(tenant)
+    _enforce_quota(tenant, reserve_bytes)
+
+    path = (TENANTS_ROOT / tenant / workspace_id).absolute()
+    path.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO workspaces (id, tenant, path, status, created, last_access, size) VALUES (?, ?, ?, 'active', ?, ?, 0)",
+            (workspace_id, tenant, str(path), now, now)
+        )
+    return path
+
+
+def write_file_atomic(path, data: bytes) -> str:
+    """Writes bytes to a temp file next to `path` and renames it into place; returns the absolute path."""
+    path = Path(path).absolute()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+def reserve_output_path(path) -> str:
+    """
+    Returns `path`, or `path` with a _2, _3, ... suffix if another call in this process reserved it or a file
+    with that name (any extension) already exists, so parallel tool calls of one run never share an output file.
+    """
+    path = Path(path)
+    with _reserved_lock:
+        candidate, index = path, 1
+        while str(candidate) in _reserved_paths or any(candidate.parent.glob(f"{candidate.stem}.*")):
+            index += 1
+            candidate = path.with_name(f"{path.stem}_{index}{path.suffix}")
+        _reserved_paths.add(str(candidate))
+    return str(candidate)
+
+
+def record_artifact(workspace_id: str, path: str, kind: str, name: str = None):
+    """
+    Adds a file written by a tool to the artifact index of its workspace (a rewrite updates the entry).
+    Files outside the workspace are not recorded, so one workspace never claims another one's files.
+
+    Raises:
+        QuotaExceededError: If the new file took its tenant (or all tenants) over quota and evicting old
+                            workspaces did not make room, so that the running job stops instead of writing more.
+    """
+    path = Path(path).absolute()
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return
+    with _connect() as conn:
+        row = conn.execute("SELECT tenant, path FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+        if row is None or Path(row["path"]) not in path.parents:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO artifacts (path, workspace_id, tenant, kind, name, size, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(path), workspace_id, row["tenant"], kind, name or path.name, size, time.time())
+        )
+    _enforce_quota(row["tenant"])
+
+
+def release_workspace(workspace_id: str):
+    """
+    Marks a workspace as finished (its job no longer writes to it): records its size on disk, makes it
+    eligible for garbage collection and evicts older workspaces if the tenant went over its quota.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT tenant, path FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+        if row is None:
+            return
+        conn.execute(
+            "UPDATE workspaces SET status = 'released', size = ?, last_access = ? WHERE id = ?",
+            (_directory_size(row["path"]), time.time(), workspace_id)
+        )
+    with _reserved_lock:
+        _reserved_paths.difference_update(
+            {path for path in _reserved_paths if Path(row["path"]) in Path(path).parents}
+        )
+    _evict(row["tenant"])
+    _evict()
+
+
+def reopen_workspace(workspace_id: str) -> bool:
+    """
+    Marks a released workspace as active again (e.g. to retry its job), protecting it from garbage collection.
+    Returns False if the workspace was already deleted.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT status FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+        if row is None or row["status"] == "deleting":
+            return False
+        conn.execute(
+            "UPDATE workspaces SET status = 'active', last_access = ? WHERE id = ?", (time.time(), workspace_id)
+        )
+    return True
+
+
+def touch_workspace(workspace_id: str):
+    """Marks a workspace as recently used (e.g. its results were viewed), delaying its expiry and LRU eviction."""
+    with _connect() as conn:
+        conn.execute("UPDATE workspaces SET last_access = ? WHERE id = ?", (time.time(), workspace_id))
+
+
+def tenant_usage(tenant: str) -> dict:
+    """Returns {"bytes", "workspaces", "quota_bytes"} for a tenant; active workspaces are measured on disk."""
+    tenant = _safe_tenant(tenant)
+    with _connect() as conn:
+        count = conn.execute(
+            "SELECT COUNT(*) FROM workspaces WHERE tenant = ? AND status != 'deleting'", (tenant,)
+        ).fetchone()[0]
+    return {"bytes": _usage(tenant), "workspaces": count, "quota_bytes": TENANT_QUOTA_BYTES}
+
+
+def list_artifacts(tenant: str = None, workspace_id: str = None) -> list:
+    """Returns the indexed artifacts of a tenant and/or a workspace, newest first."""
+    query, params = "SELECT * FROM artifacts WHERE 1 = 1", []
+    if tenant is not None:
+        query, params = query + " AND tenant = ?", params + [_safe_tenant(tenant)]
+    if workspace_id is not None:
+        query, params = query + " AND workspace_id = ?", params + [workspace_id]
+    with _connect() as conn:
+        rows = conn.execute(query + " ORDER BY created DESC", params).fetchall()
+    return [dict(row) for row in rows]
+
+
+def collect_garbage(now: float = None) -> dict:
+    """
+    Deletes finished workspaces that expired (not accessed within WORKSPACE_TTL_SECONDS), then the least
+    recently used ones of every tenant over its quota, then the least recently used ones of any tenant while
+    all of them together are over TOTAL_QUOTA_BYTES. Workspaces of running jobs are never touched.
+
+    Returns:
+        dict: {"expired": int, "evicted": int, "bytes_freed": int}
+    """
+    now = time.time() if now is None else now
+    with _connect() as conn:
+        expired_ids = [row["id"] for row in conn.execute(
+            "SELECT id FROM workspaces WHERE status = 'released' AND last_access < ?", (now - WORKSPACE_TTL_SECONDS,)
+        ).fetchall()]
+        tenants = [row["tenant"] for row in conn.execute("SELECT DISTINCT tenant FROM workspaces").fetchall()]
+
+    freed = sum(_delete_workspace(workspace_id) for workspace_id in expired_ids)
+    evicted = 0
+    for tenant in tenants + [None]:
+        scope_evicted, scope_freed = _evict(tenant)
+        evicted += scope_evicted
+        freed += scope_freed
+
+    # Leftovers of a collector that died between the rename and the removal
+    if TRASH_DIR.exists():
+        for leftover in TRASH_DIR.iterdir():
+            shutil.rmtree(leftover, ignore_errors=True)
+
+    if expired_ids or evicted:
+        logger.info(f"Garbage collection: {len(expired_ids)} expired, {evicted} evicted, {freed} bytes freed")
+    return {"expired": len(expired_ids), "evicted": evicted, "bytes_freed": freed}
+
+
+def _gc_loop(interval: float):
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e:
+            logger.error(f"Garbage collection failed: {e}")
+        time.sleep(interval)
+
+
+def start_garbage_collector(interval: float = None) -> bool:
+    """Starts the background TTL/LRU collector (once per process); returns True if it was started by this call."""
+    global _gc_thread
+    with _gc_lock:
+        if _gc_thread is not None:
+            return False
+        _gc_thread = threading.Thread(
+            target=_gc_loop, args=(interval or GC_INTERVAL_SECONDS,), name="workspace-gc", daemon=True
+        )
+        _gc_thread.start()
+    return True
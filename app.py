@@ -1,9 +1,17 @@
 import streamlit as st
 import os
+import time
+import uuid
 from pathlib import Path
 
-# 导入我们的终极大脑
-from agent.core import run_agent_workflow
+# 导入我们的终极大脑 (通过任务队列异步执行)
+from agent.jobs import (
+    submit_job, retry_job, get_job, get_events, start_workers, empty_artifacts, collect_artifact, FINISHED_STATUSES
+)
+from agent.warmup import start_warmup, readiness
+from agent.workspace import tenant_usage, touch_workspace, QuotaExceededError
+from tools.tracing import start_metrics_server
+from tools.audio_io import browser_copy
 
 # ==========================================
 # 1. 页面与环境配置
@@ -13,8 +21,36 @@ st.set_page_config(page_title="Agent 音乐工作站", page_icon="🎵", layout=
 st.title("🎵 AI Agent 音乐创意工作站")
 st.markdown("上传一首歌，让大模型帮你分析旋律、提取伴奏，并生成一首全新风格的 Remix！")
 
-INPUT_DIR = Path("workspace/inputs")
-INPUT_DIR.mkdir(parents=True, exist_ok=True)
+# 任务事件 (LLM 逐字输出、工具进度) 的轮询间隔
+POLL_INTERVAL_SECONDS = 0.3
+
+# 每个音轨在控制台中的展示方式: (标题, 提示框样式)
+STEM_LABELS = {
+    "vocals": ("🎤 人声 / 清唱 (Vocals)", "info"),
+    "accompaniment": ("🎼 完整伴奏 (Accompaniment)", "success"),
+    "other": ("🎹 其他乐器 (Other)", "success"),
+    "drums": ("🥁 鼓点 (Drums)", "warning"),
+    "bass": ("🎸 贝斯 (Bass)", "error"),
+}
+
+
+@st.cache_resource
+def _start_job_workers() -> int:
+    """每个进程只启动一次 Worker 池与 /metrics 端点；设置 MUSIC_AGENT_EXTERNAL_WORKERS=1 时由独立的 worker 进程处理任务"""
+    start_metrics_server()
+    if os.getenv("MUSIC_AGENT_EXTERNAL_WORKERS") == "1":
+        return 0
+    # 后台预热模型：页面照常打开，第一个请求不用再等模型加载
+    start_warmup()
+    return start_workers()
+
+
+_start_job_workers()
+
+# 每个浏览器会话是一个独立租户：任务文件放在 workspace/tenants/<tenant>/<job_id>/，磁盘配额按租户计算
+# (新会话即新配额，所以整个 workspace 另有全局上限 MUSIC_AGENT_WORKSPACE_MAX_BYTES)
+if "tenant_id" not in st.session_state:
+    st.session_state.tenant_id = uuid.uuid4().hex[:16]
 
 # ==========================================
 # 2. 侧边栏：文件上传
@@ -23,22 +59,192 @@ with st.sidebar:
     st.header("📁 上传原始音频")
     uploaded_file = st.file_uploader("支持 MP3/WAV 格式", type=["mp3", "wav"])
     
-    current_file_path = None
     if uploaded_file is not None:
-        file_path = INPUT_DIR / uploaded_file.name
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
         st.success(f"上传成功: {uploaded_file.name}")
-        current_file_path = str(file_path.absolute())
-        st.audio(current_file_path)
+        st.audio(uploaded_file)
+
+    usage = tenant_usage(st.session_state.tenant_id)
+    if usage["workspaces"]:
+        st.caption(f"💾 工作区占用: {usage['bytes'] / 1024 ** 2:.0f} MB / {usage['quota_bytes'] / 1024 ** 2:.0f} MB "
+                   f"({usage['workspaces']} 个任务，旧任务会被自动清理)")
+
+    # 本进程内的 Worker 才需要预热模型；独立 worker 进程的就绪状态见其 /ready 端点
+    warmup_state = readiness()
+    if warmup_state["models"]:
+        st.divider()
+        st.caption("🔥 模型预热" + (" (已就绪)" if warmup_state["ready"] else ""))
+        status_icons = {"pending": "⏳", "loading": "🔄", "ready": "✅", "skipped": "➖", "failed": "❌"}
+        for model_name, state in warmup_state["models"].items():
+            seconds = f" ({state['seconds']:.0f}s)" if state["seconds"] is not None else ""
+            st.caption(f"{status_icons[state['status']]} {model_name}{seconds}")
 
 # ==========================================
-# 3. 核心聊天与 Agent 执行区
+# 3. 任务轮询与音频控制台
+# ==========================================
+
+def _follow_job(job_id: str):
+    """
+    按任务的事件流增量渲染，直到任务结束：LLM 的回答逐字出现，工具的开始/进度/完成写入状态面板，
+    每个音轨 (artifact 事件) 一写完就出现在音频控制台里；长音频流式分离时第一个窗口完成后即可试听。
+    返回结束时的任务记录，以及用于定稿回答文本的占位符
+    """
+    status_box = st.status("🧠 Agent 正在排队...", expanded=True)
+    answer_placeholder = st.empty()
+    progress_placeholder = st.empty()
+    preview_placeholder = st.empty()
+    console_placeholder = st.empty()
+
+    artifacts = empty_artifacts()
+    streamed_text = ""
+    last_event_id = 0
+    while True:
+        artifacts_changed = False
+        for event in get_events(job_id, last_event_id):
+            last_event_id = event["id"]
+            if event["event"] == "status" and event["status"] == "running":
+                status_box.update(label="🧠 Agent 正在思考并执行链式任务... (本地推理可能需要几分钟，请耐心等待)")
+            elif event["event"] == "status" and event["status"] == "retrying":
+                # 自动重试：已完成的阶段 (分离、转录...) 从检查点恢复，不会重新计算
+                status_box.write(f"🔁 第 {event['attempt']} 次尝试失败，正在从上次完成的阶段继续: {event['error'][:200]}")
+                streamed_text = ""
+                answer_placeholder.empty()
+            elif event["event"] == "llm_retry":
+                status_box.write(f"⏳ LLM 请求暂时失败，{event['delay_seconds']:.0f} 秒后重试 (第 {event['attempt']} 次)")
+                streamed_text = ""
+                answer_placeholder.empty()
+            elif event["event"] == "llm_delta":
+                streamed_text += event["text"]
+                answer_placeholder.markdown(streamed_text + " ▌")
+            elif event["event"] == "tool_start":
+                # 调用工具之前输出的文字是 Agent 的思考过程，移到状态面板里
+                if streamed_text:
+                    status_box.markdown(f"💭 {streamed_text}")
+                    streamed_text = ""
+                    answer_placeholder.empty()
+                status_box.write(f"🛠️ 开始执行 `{event['tool']}`")
+            elif event["event"] == "tool_result":
+                progress_placeholder.empty()
+                if "error" in event["result"]:
+                    status_box.write(f"❌ `{event['tool']}` 失败: {event['result']['error'][:200]}")
+                else:
+                    status_box.write(f"✅ `{event['tool']}` 完成")
+            elif event["event"] == "artifact":
+                collect_artifact(artifacts, event)
+                artifacts_changed = True
+            elif event["event"] == "progress":
+                total = event.get("total_windows")
+                fraction = min(event["window"] / total, 1.0) if total else 0.0
+                progress_placeholder.progress(
+                    fraction, text=f"🎚️ 流式分离中... 已处理 {event['seconds_processed']:.0f} 秒"
+                )
+                if event["window"] == 1:
+                    with preview_placeholder.container():
+                        st.caption("⏳ 抢先试听 (音轨仍在持续写入)")
+                        for stem, path in event["tracks"].items():
+                            st.audio(path)
+            elif event["event"] == "generation_progress":
+                progress_placeholder.progress(
+                    min(event["window"] / event["total_windows"], 1.0),
+                    text=f"🎹 长音频生成中... 已生成 {event['seconds_generated']:.0f} 秒"
+                )
+
+        if artifacts_changed:
+            preview_placeholder.empty()
+            with console_placeholder.container():
+                _render_audio_console(artifacts)
+
+        job = get_job(job_id)
+        if job["status"] in FINISHED_STATUSES:
+            break
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+    succeeded = job["status"] == "succeeded"
+    status_box.update(label="✅ 任务完成" if succeeded else "❌ 任务失败", state="complete" if succeeded else "error",
+                      expanded=False)
+    progress_placeholder.empty()
+    preview_placeholder.empty()
+    return job, answer_placeholder
+
+
+def _play(path: str):
+    """播放产物的压缩副本 (默认 Opus，见 MUSIC_AGENT_BROWSER_FORMAT)，发送给浏览器的数据量远小于原始 WAV"""
+    served_path, mime_type = browser_copy(path)
+    st.audio(served_path, format=mime_type)
+
+
+def _render_audio_console(artifacts: dict):
+    """🌟 动态 音频控制台 (Audio Console)：只展示本次任务真正产出的文件"""
+    stems = {stem: path for stem, path in artifacts["stems"].items() if Path(path).exists()}
+    generated = [path for path in artifacts["generated"] if Path(path).exists()]
+    if not stems and not generated:
+        return
+
+    st.markdown("---")
+    st.subheader("🎛️ 智能音频控制台")
+
+    # 1. 动态展示所有分离出的独立音轨
+    if stems:
+        st.markdown("#### 🎧 提取的独立音轨 (Stems)")
+        columns = st.columns(2)
+        for index, (stem, path) in enumerate(stems.items()):
+            label, style = STEM_LABELS.get(stem, (stem, "info"))
+            with columns[index % 2]:
+                getattr(st, style)(label)
+                _play(path)
+
+    # 2. 只有 Agent 真正调用了生成工具，才展示播放器 (多个版本时按 A/B/C 排列供用户挑选)
+    if len(generated) == 1:
+        st.markdown("#### 🚀 AI 全新生成的 Remix")
+        _play(generated[0])
+    elif generated:
+        st.markdown("#### 🚀 AI 全新生成的 Remix (多个版本)")
+        columns = st.columns(min(len(generated), 3))
+        for index, path in enumerate(generated):
+            with columns[index % len(columns)]:
+                st.caption(f"版本 {chr(ord('A') + index) if index < 26 else index + 1}")
+                _play(path)
+
+def _render_timeline(spans: list):
+    """⏱️ 单次运行的时间线：每个 LLM 调用、工具、模型加载与文件写入的起止时间"""
+    if not spans:
+        return
+    run_start = spans[0]["start"]
+    rows = []
+    for record in spans:
+        attributes = record["attributes"]
+        tokens = (attributes.get("prompt_tokens") or 0) + (attributes.get("completion_tokens") or 0)
+        rows.append({
+            "阶段": record["name"],
+            "类型": record["kind"],
+            "开始 (s)": round(record["start"] - run_start, 2),
+            "耗时 (s)": round(record["duration"], 2),
+            "音频 (s)": round(attributes["audio_seconds"], 1) if attributes.get("audio_seconds") else None,
+            "实时率": round(attributes["rtf"], 2) if attributes.get("rtf") else None,
+            "Tokens": tokens or None,
+            "状态": record["status"],
+        })
+
+    with st.expander("⏱️ 运行时间线 (Trace)"):
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        stage_rows = [row for row in rows if row["类型"] != "run"]
+        if stage_rows:
+            st.bar_chart({row["阶段"]: row["耗时 (s)"] for row in stage_rows}, horizontal=True)
+
+def _retry(job_id: str):
+    try:
+        st.session_state.pending_job = retry_job(job_id)
+    except ValueError as e:
+        st.session_state.retry_error = str(e)
+
+# ==========================================
+# 4. 核心聊天与 Agent 执行区
 # ==========================================
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if retry_error := st.session_state.pop("retry_error", None):
+    st.error(f"❌ 无法重试: {retry_error}")
+
 # 渲染历史消息
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
@@ -52,68 +258,32 @@ if prompt := st.chat_input("例如：帮我把这首歌的伴奏提取出来，
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # 触发 Agent 大脑
+    # 提交任务：上传的音频保存在该任务独立的工作区中，不同用户互不覆盖
+    try:
+        if uploaded_file is not None:
+            st.session_state.pending_job = submit_job(
+                prompt, uploaded_file.name, uploaded_file.getvalue(), tenant=st.session_state.tenant_id
+            )
+        else:
+            st.session_state.pending_job = submit_job(prompt, tenant=st.session_state.tenant_id)
+    except QuotaExceededError as e:
+        st.error(f"💾 工作区空间不足，请等待正在运行的任务结束后再试: {e}")
+
+# 触发 Agent 大脑 (页面刷新后仍会继续跟踪未完成的任务)
+if job_id := st.session_state.get("pending_job"):
     with st.chat_message("assistant"):
-        status_placeholder = st.empty()
-        status_placeholder.info("🧠 Agent 正在思考并执行链式任务... (本地推理可能需要几分钟，请耐心等待)")
-        
-        # 🌟 核心黑魔法：上下文注入
-        agent_prompt = prompt
-        if current_file_path:
-            agent_prompt += f"\n\n[System Context: The user has uploaded an audio file located at '{current_file_path}'. Use this exact path.]"
-        
-        try:
-            # 运行我们写好的极其稳定的 core.py
-            response_text = run_agent_workflow(agent_prompt)
-            
-            # 清理状态提示，显示最终结果
-            status_placeholder.empty()
-            st.markdown(response_text)
+        job, answer_placeholder = _follow_job(job_id)
+        st.session_state.pending_job = None
+        # 刚看过的结果最后才会被 LRU 清理
+        touch_workspace(job_id)
+
+        if job["status"] == "succeeded":
+            # 音频控制台已在执行过程中根据 artifact 事件渲染，这里只需定稿回答文本
+            response_text = job["result"]["response_text"]
+            answer_placeholder.markdown(response_text)
             st.session_state.messages.append({"role": "assistant", "content": response_text})
-            
-            # 🌟 动态 音频控制台 (Audio Console) 🌟
-            st.markdown("---")
-            st.subheader("🎛️ 智能音频控制台")
-            
-            # 1. 动态展示所有分离出的独立音轨
-            if uploaded_file:
-                stem_name = Path(uploaded_file.name).stem
-                sep_dir = Path(f"workspace/separated/htdemucs/{stem_name}")
-                
-                if sep_dir.exists():
-                    st.markdown("#### 🎧 提取的独立音轨 (Stems)")
-                    col1, col2 = st.columns(2)
-                    
-                    vocals_path = sep_dir / "vocals.wav"
-                    if vocals_path.exists():
-                        with col1:
-                            st.info("🎤 人声 / 清唱 (Vocals)")
-                            st.audio(str(vocals_path))
-                            
-                    other_path = sep_dir / "other.wav"
-                    if other_path.exists():
-                        with col2:
-                            st.success("🎹 纯伴奏 (Accompaniment)")
-                            st.audio(str(other_path))
-                            
-                    drums_path = sep_dir / "drums.wav"
-                    if drums_path.exists():
-                        with col1:
-                            st.warning("🥁 鼓点 (Drums)")
-                            st.audio(str(drums_path))
-                            
-                    bass_path = sep_dir / "bass.wav"
-                    if bass_path.exists():
-                        with col2:
-                            st.error("🎸 贝斯 (Bass)")
-                            st.audio(str(bass_path))
-            
-            # 2. 意图识别防呆设计：只有大模型明确生成了东西，才展示播放器
-            if "generated_music.wav" in response_text or "generate_music" in response_text or "Remix" in response_text:
-                gen_path = Path("workspace/outputs/generated_music.wav")
-                if gen_path.exists():
-                    st.markdown("#### 🚀 AI 全新生成的 Remix")
-                    st.audio(str(gen_path))
-
-        except Exception as e:
-            status_placeholder.error(f"❌ Agent 运行崩溃: {str(e)}")
\ No newline at end of file
+            _render_timeline(job["result"].get("spans", []))
+        else:
+            st.error(f"❌ Agent 运行崩溃: {job['error']}")
+            # 手动重试同样从检查点恢复：只重新执行失败的阶段及其之后的步骤
+            st.button("🔁 从上次完成的阶段继续", on_click=_retry, args=(job_id,))
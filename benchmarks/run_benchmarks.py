@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import contextlib
+import queue as queue_module
+import argparse
+import platform
+import resource
+import multiprocessing
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow `python benchmarks/run_benchmarks.py` from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# ==========================================
+# Pipeline Benchmark Suite
+# ==========================================
+# Every case runs in a fresh (spawned) process so that model loading and peak RSS are measured
+# in isolation. The DeepSeek client is replaced by a scripted local stub, the input audio is
+# synthesized on the fly, and the result cache is disabled, so the suite runs fully offline
+# (model weights must already be in the local Hugging Face / torch hub caches).
+
+BENCH_ROOT = Path("workspace/benchmarks")
+
+TOOL_CASES = ["separate_audio", "audio_to_midi", "generate_music"]
+# MusicGen CPU precision modes (see tools/generator.py); "generate_music" is the fp32 reference they are scored against
+PRECISION_CASES = {
+    "generate_music_int8": "int8",
+    "generate_music_bf16": "bf16",
+}
+CHAIN_CASES = {
+    "chain_separate": ["separate_audio_stems"],
+    "chain_transcribe": ["separate_audio_stems", "audio_to_midi"],
+    "chain_remix": ["separate_audio_stems", "audio_to_midi", "analyze_midi", "generate_music"],
+}
+# Requests sent to the chain cases when a real or replayed LLM (--llm-backend) plans the tool calls
+CHAIN_PROMPTS = {
+    "chain_separate": "Separate the vocals and the accompaniment of '{path}'.",
+    "chain_transcribe": "Convert the melody of '{path}' to MIDI.",
+    "chain_remix": "Remix '{path}' into a Cyberpunk-style track.",
+}
+PLANNER_CASES = {
+    "planner_remix": "Extract the accompaniment from '{path}', transcribe it and generate a Cyberpunk-style remix.",
+}
+ALL_CASES = TOOL_CASES + list(PRECISION_CASES) + list(CHAIN_CASES) + list(PLANNER_CASES)
+
+
+# ==========================================
+# Synthetic audio fixtures
+# ==========================================
+
+def make_synthetic_song(path: Path, duration_seconds: float, sampling_rate: int = 44100) -> str:
+    """
+    Writes a stereo test "song": a sine-wave chord progression (harmony), a lead melody
+    panned left and a noise-burst kick/hat pattern, so every Demucs stem has some content.
+    """
+    import numpy as np
+    import scipy.io.wavfile
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(duration_seconds * sampling_rate)) / sampling_rate
+    beat = 60.0 / 120.0
+
+    chords = [(261.63, 329.63, 392.00), (220.00, 261.63, 329.63), (174.61, 220.00, 261.63), (196.00, 246.94, 293.66)]
+    chord_index = (t // (4 * beat)).astype(int) % len(chords)
+    harmony = sum(np.sin(2 * np.pi * np.array([c[i] for c in chords])[chord_index] * t) for i in range(3)) / 3
+
+    melody_notes = np.array([523.25, 587.33, 659.25, 783.99, 659.25, 587.33, 523.25, 493.88])
+    melody = 0.6 * np.sin(2 * np.pi * melody_notes[(t // beat).astype(int) % len(melody_notes)] * t)
+
+    phase = t % beat
+    kick = np.sin(2 * np.pi * 55 * t) * np.exp(-phase * 30)
+    hat = rng.standard_normal(len(t)) * np.exp(-((t + beat / 2) % beat) * 80) * 0.2
+
+    left = 0.3 * harmony + 0.4 * melody + 0.4 * kick + hat
+    right = 0.3 * harmony + 0.1 * melody + 0.4 * kick + hat
+    stereo = np.stack([left, right], axis=1)
+    stereo /= np.abs(stereo).max()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    scipy.io.wavfile.write(path, sampling_rate, (stereo * 0.8).astype(np.float32))
+    return str(path.absolute())
+
+
+# ==========================================
+# Scripted LLM stub
+# ==========================================
+
+class ScriptedLLMClient:
+    """
+    Drop-in replacement for the OpenAI client (`client.chat.completions.create`).
+    It walks a fixed tool chain, deriving each call's arguments from the previous tool result,
+    then returns a final answer. Calls without tools (the planner's prompt call) get a fixed prompt.
+    """
+
+    GENERATION_PROMPT = "Cyberpunk electronic remix, heavy bass, futuristic synth arpeggios, 120bpm"
+
+    def __init__(self, chain: list, input_path: str, latency_seconds: float = 0.0):
+        self.chain = chain
+        self.input_path = input_path
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @staticmethod
+    def _reply(content=None, tool_calls=None):
+        message = SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    @staticmethod
+    def _as_stream(reply):
+        """Replays a reply as a single chat-completion chunk, as returned by `create(..., stream=True)`."""
+        message = reply.choices[0].message
+        fragments = [
+            SimpleNamespace(index=index, id=call.id, type="function", function=call.function)
+            for index, call in enumerate(message.tool_calls or [])
+        ]
+        delta = SimpleNamespace(content=message.content, tool_calls=fragments or None)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+    def _next_args(self, tool_name: str, last_result: dict) -> dict:
+        if tool_name == "separate_audio_stems":
+            return {"input_file_path": self.input_path}
+        if tool_name == "audio_to_midi":
+            return {"input_file_path": last_result["tracks"]["other"]}
+        if tool_name == "analyze_midi":
+            return {"midi_path": last_result["midi_path"]}
+        return {"prompt": self.GENERATION_PROMPT}
+
+    def _create(self, messages, tools=None, stream=False, **kwargs):
+        reply = self._reply_to(messages, tools)
+        return self._as_stream(reply) if stream else reply
+
+    def _reply_to(self, messages, tools):
+        self.calls += 1
+        time.sleep(self.latency_seconds)
+        if not tools:
+            return self._reply(content=self.GENERATION_PROMPT)
+
+        tool_messages = [m for m in messages if isinstance(m, dict) and m.get("role") == "tool"]
+        step = len(tool_messages)
+        if step >= len(self.chain):
+            return self._reply(content="Benchmark chain finished.")
+
+        last_result = json.loads(tool_messages[-1]["content"]) if tool_messages else {}
+        if "error" in last_result:
+            return self._reply(content=f"Benchmark chain failed: {last_result['error']}")
+
+        tool_name = self.chain[step]
+        call = SimpleNamespace(
+            id=f"call_{step}",
+            type="function",
+            function=SimpleNamespace(name=tool_name, arguments=json.dumps(self._next_args(tool_name, last_result))),
+        )
+        return self._reply(tool_calls=[call])
+
+
+# ==========================================
+# Case runners (executed in the child process)
+# ==========================================
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _timed_tools(core, stages: dict):
+    """Wraps every registered tool so each call's wall time is added to `stages`."""
+    for name, function in list(core.AVAILABLE_TOOLS.items()):
+        def wrapper(*args, _name=name, _function=function, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _function(*args, **kwargs)
+            finally:
+                stages[_name] = stages.get(_name, 0.0) + time.perf_counter() - start
+        core.AVAILABLE_TOOLS[name] = wrapper
+
+
+def _span_stages(run_id: str) -> dict:
+    """Seconds per span kind (model_load / inference / file_write) of one traced run."""
+    from tools.tracing import get_run_spans, KIND_MODEL_LOAD, KIND_INFERENCE, KIND_FILE_WRITE
+
+    stages = {}
+    for record in get_run_spans(run_id):
+        if record["kind"] in (KIND_MODEL_LOAD, KIND_INFERENCE, KIND_FILE_WRITE):
+            stages[record["kind"]] = stages.get(record["kind"], 0.0) + record["duration"]
+    return stages
+
+
+def _run_tool_case(case: str, song_path: str, work_dir: Path):
+    if case == "separate_audio":
+        from tools.separator import separate_audio
+        return lambda: separate_audio(song_path, output_dir=str(work_dir / "separated"))
+    if case == "audio_to_midi":
+        from tools.transcriber import audio_to_midi
+        return lambda: audio_to_midi(song_path, output_dir=str(work_dir / "midi_outputs"))
+    from tools.generator import generate_music
+
+    # Same seed in every precision case, so their outputs differ only by numerics
+    return lambda: generate_music(
+        ScriptedLLMClient.GENERATION_PROMPT, output_path=str(work_dir / "generated_music.wav"), seed=0
+    )
+
+
+def _child_main(case: str, song_path: str, repeats: int, llm_latency: float, queue, llm_backend: str = "scripted"):
+    os.environ["MUSIC_AGENT_CACHE"] = "0"
+    # Repeated runs share a workspace; checkpoints would let every run after the first skip all stages
+    os.environ["MUSIC_AGENT_CHECKPOINTS"] = "0"
+    # agent.core builds its OpenAI client at import time; the stub is used instead, so any key will do
+    os.environ.setdefault("DEEPSEEK_API_KEY", "offline-benchmark")
+    work_dir = BENCH_ROOT / "runs" / case
+    record = {"case": case, "runs": []}
+    if case == "generate_music" or case in PRECISION_CASES:
+        record["requested_precision"] = PRECISION_CASES.get(case, "fp32")
+        os.environ["MUSIC_AGENT_MUSICGEN_PRECISION"] = record["requested_precision"]
+
+    try:
+        import_start = time.perf_counter()
+        from tools.tracing import trace_run
+
+        tool_case = case in TOOL_CASES or case in PRECISION_CASES
+        if "requested_precision" in record:
+            from tools.generator import active_precision
+
+            # What the generator will actually run (bf16 falls back to int8 on CPUs without it, MPS is always fp32)
+            record["precision"] = active_precision()
+            if case in PRECISION_CASES and record["precision"] != record["requested_precision"]:
+                # Timing it would only repeat another case under this case's label
+                record["skipped"] = f"{record['requested_precision']} is not available here (runs as {record['precision']})"
+                record["peak_rss_mb"] = _peak_rss_mb()
+                queue.put(record)
+                return
+        stages = {}
+        llm_client = None
+        if tool_case:
+            run = _run_tool_case(case, song_path, work_dir)
+        else:
+            from agent import core
+            _timed_tools(core, stages)
+            if llm_backend != "scripted":
+                from agent.llm import create_client
+                llm_client = create_client(llm_backend)
+            if case in CHAIN_CASES:
+                if llm_backend == "scripted":
+                    llm_client = ScriptedLLMClient(CHAIN_CASES[case], song_path, llm_latency)
+                    prompt = f"Benchmark request for '{song_path}'"
+                else:
+                    prompt = CHAIN_PROMPTS[case].format(path=song_path)
+                run = lambda: core.run_agent_workflow(
+                    prompt, llm_client=llm_client, use_planner=False, workspace_dir=str(work_dir)
+                )
+            else:
+                if llm_backend == "scripted":
+                    llm_client = ScriptedLLMClient([], song_path, llm_latency)
+                prompt = PLANNER_CASES[case].format(path=song_path)
+                run = lambda: core.run_agent_workflow(
+                    prompt, llm_client=llm_client, use_planner=True, workspace_dir=str(work_dir)
+                )
+        record["import_seconds"] = time.perf_counter() - import_start
+
+        # The first run includes model loading (cold); later runs measure the warm path
+        for index in range(1 + repeats):
+            stages.clear()
+            llm_calls_before = getattr(llm_client, "calls", 0)
+            run_id = f"bench-{case}-{index}"
+            start = time.perf_counter()
+            with trace_run(run_id, case=case) if tool_case else contextlib.nullcontext():
+                output = run()
+            wall = time.perf_counter() - start
+            if tool_case:
+                # A tool called directly has no per-tool stages: split it by the spans it records instead
+                stages.update(_span_stages(run_id))
+            run_record = {"cold": index == 0, "wall_seconds": wall, "stages": dict(stages)}
+            if hasattr(llm_client, "calls"):
+                run_record["llm_calls"] = llm_client.calls - llm_calls_before
+            if isinstance(output, dict) and "error" in output:
+                run_record["error"] = output["error"]
+            if isinstance(output, dict) and output.get("audio_path"):
+                record["audio_path"] = output["audio_path"]
+            record["runs"].append(run_record)
+
+        warm = [r["wall_seconds"] for r in record["runs"] if not r["cold"]]
+        record["cold_seconds"] = record["runs"][0]["wall_seconds"]
+        record["warm_seconds"] = sum(warm) / len(warm) if warm else None
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    record["peak_rss_mb"] = _peak_rss_mb()
+    queue.put(record)
+
+
+# ==========================================
+# Driver
+# ==========================================
+
+def spectral_profile_db(audio_path: str, bands: int = 64):
+    """Average power per log-spaced frequency band in dB: a timbre fingerprint of a generated clip."""
+    import numpy as np
+    import scipy.signal
+    from tools.audio_io import read_audio
+
+    audio, sampling_rate = read_audio(audio_path, mono=True)
+    freqs, _, spectrum = scipy.signal.stft(audio, fs=sampling_rate, nperseg=2048)
+    power = (np.abs(spectrum) ** 2).mean(axis=1)
+    edges = np.unique(np.searchsorted(freqs, np.geomspace(40, sampling_rate / 2, bands + 1)))
+    band_power = np.add.reduceat(power[:edges[-1]], edges[:-1]) / np.diff(edges)
+    return 10 * np.log10(band_power + 1e-12)
+
+
+def _add_precision_quality(results: list):
+    """Scores each precision case by its mean spectral-profile distance (dB) from the fp32 reference clip."""
+    by_case = {record["case"]: record for record in results}
+    reference = by_case.get("generate_music")
+    if reference is None or "audio_path" not in reference:
+        return
+    reference_profile = spectral_profile_db(reference["audio_path"])
+    for case in PRECISION_CASES:
+        record = by_case.get(case)
+        if record is None or "audio_path" not in record:
+            continue
+        profile = spectral_profile_db(record["audio_path"])
+        record["spectral_distance_db"] = float(abs(profile - reference_profile).mean())
+        if reference.get("warm_seconds") and record.get("warm_seconds"):
+            record["speedup_vs_fp32"] = reference["warm_seconds"] / record["warm_seconds"]
+        print(f"🎚️  [Benchmark] '{case}': {record['spectral_distance_db']:.2f} dB from the fp32 reference, "
+              f"speed-up x{record.get('speedup_vs_fp32', float('nan')):.2f}")
+
+
+def _wait_for_record(process, queue, case: str) -> dict:
+    """Waits for the child's report, without hanging if the child dies (e.g. killed by the OOM killer)."""
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except queue_module.Empty:
+            if not process.is_alive():
+                return {"case": case, "error": f"Benchmark process exited with code {process.exitcode}"}
+
+
+def run_benchmarks(cases: list, duration_seconds: float, repeats: int, llm_latency: float,
+                   llm_backend: str = "scripted") -> dict:
+    """Runs each case in its own spawned process and returns the full JSON-serializable report."""
+    song_path = make_synthetic_song(BENCH_ROOT / "fixtures" / f"synthetic_{int(duration_seconds)}s.wav", duration_seconds)
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for case in cases:
+        print(f"⏱️  [Benchmark] Running '{case}'...")
+        queue = context.Queue()
+        process = context.Process(target=_child_main, args=(case, song_path, repeats, llm_latency, queue, llm_backend))
+        process.start()
+        record = _wait_for_record(process, queue, case)
+        process.join()
+        results.append(record)
+
+        if "error" in record:
+            print(f"❌ [Benchmark] '{case}' failed: {record['error']}")
+        elif "skipped" in record:
+            print(f"⏭️  [Benchmark] '{case}' skipped: {record['skipped']}")
+        else:
+            warm = f"{record['warm_seconds']:.2f}s" if record["warm_seconds"] is not None else "-"
+            print(f"✅ [Benchmark] '{case}': cold {record['cold_seconds']:.2f}s, warm {warm}, "
+                  f"peak RSS {record['peak_rss_mb']:.0f} MB")
+
+    _add_precision_quality(results)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "audio_seconds": duration_seconds,
+            "repeats": repeats,
+            "llm_latency_seconds": llm_latency,
+            "llm_backend": llm_backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare_reports(baseline_path: str, candidate_path: str):
+    """Prints the per-case change in cold/warm wall time and peak RSS between two JSON reports."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["case"]: r for r in json.load(f)["results"]}
+    with open(candidate_path, encoding="utf-8") as f:
+        candidate = {r["case"]: r for r in json.load(f)["results"]}
+
+    print(f"{'case':<20}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for case in sorted(set(baseline) & set(candidate)):
+        for metric in ("cold_seconds", "warm_seconds", "peak_rss_mb", "spectral_distance_db"):
+            old, new = baseline[case].get(metric), candidate[case].get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+            print(f"{case:<20}{metric:<16}{old:>12.2f}{new:>12.2f}{change:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Music-Agent tools and pipelines offline.")
+    parser.add_argument("--cases", nargs="+", default=ALL_CASES, choices=ALL_CASES, help="Cases to run")
+    parser.add_argument("--duration", type=float, default=30.0, help="Length of the synthetic input audio in seconds")
+    parser.add_argument("--repeats", type=int, default=1, help="Warm repetitions after the cold run")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated latency per stub LLM call (seconds)")
+    parser.add_argument("--llm-backend", default="scripted", choices=["scripted", "remote", "local", "replay"],
+                        help="LLM of the chain/planner cases: the scripted stub, or an agent/llm.py backend "
+                             "(record a session with MUSIC_AGENT_LLM_RECORD=1, then replay it offline)")
+    parser.add_argument("--output", default=None, help="Path of the JSON report")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two JSON reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        sys.exit(0)
+
+    report = run_benchmarks(args.cases, args.duration, args.repeats, args.llm_latency, args.llm_backend)
+    output_path = Path(args.output or BENCH_ROOT / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 [Benchmark] Report written to {output_path}")
@@ -0,0 +1,226 @@
+import os
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from tools.tracing import span, KIND_INFERENCE
+
+# Configure the standard logger for the Analyzer Tool
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Tool-Analyzer")
+
+# ==========================================
+# MIDI analysis configuration
+# ==========================================
+# Everything below works on whole note arrays (start, end, pitch, velocity) at once, so analysing
+# a transcription takes milliseconds and gives the LLM facts (key, tempo, chords) to write the
+# MusicGen prompt from, instead of guessing "melodic cues" from a file path.
+
+NOTE_NAMES = np.array(["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"])
+
+# Krumhansl-Kessler key profiles (major, minor), tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+# (24, 12): rows 0-11 are C..B major, rows 12-23 are C..B minor
+KEY_PROFILES = np.stack([np.roll(MAJOR_PROFILE, k) for k in range(12)] + [np.roll(MINOR_PROFILE, k) for k in range(12)])
+
+# (24, 12) triad templates in the same order: root + major/minor third + fifth
+_MAJOR_TRIAD = np.zeros(12)
+_MAJOR_TRIAD[[0, 4, 7]] = 1.0
+_MINOR_TRIAD = np.zeros(12)
+_MINOR_TRIAD[[0, 3, 7]] = 1.0
+CHORD_TEMPLATES = np.stack([np.roll(_MAJOR_TRIAD, k) for k in range(12)] + [np.roll(_MINOR_TRIAD, k) for k in range(12)])
+CHORD_NAMES = np.array(list(NOTE_NAMES) + [f"{name}m" for name in NOTE_NAMES])
+
+# Tempo search range and resolution of the onset envelope
+MIN_BPM, MAX_BPM = 60, 180
+ONSET_FRAME_RATE = 100
+MIN_NOTES_FOR_TEMPO = 8
+# Chords are detected once per bar (4 beats); very long files get longer windows to stay within MAX_CHORD_WINDOWS
+BEATS_PER_BAR = 4
+MAX_CHORD_WINDOWS = 256
+MAX_CHORDS = 16
+# A window whose best triad explains less than this share of its pitch-class energy has no clear chord
+MIN_CHORD_FIT = 0.5
+
+
+def _load_notes(midi_path: str) -> np.ndarray:
+    """Parses the pitched (non-drum) notes of a MIDI file into an (N, 4) array of start, end, pitch, velocity."""
+    import pretty_midi
+
+    midi = pretty_midi.PrettyMIDI(midi_path)
+    arrays = [
+        np.array([(note.start, note.end, note.pitch, note.velocity) for note in instrument.notes], dtype=np.float64)
+        for instrument in midi.instruments if not instrument.is_drum and instrument.notes
+    ]
+    if not arrays:
+        return np.zeros((0, 4))
+    notes = np.concatenate(arrays)
+    return notes[np.argsort(notes[:, 0], kind="stable")]
+
+
+def _pitch_name(pitch: int) -> str:
+    return f"{NOTE_NAMES[pitch % 12]}{pitch // 12 - 1}"
+
+
+def _estimate_key(pitch_classes: np.ndarray, weights: np.ndarray) -> tuple:
+    """Correlates the duration-weighted pitch-class histogram with all 24 key profiles at once."""
+    histogram = np.bincount(pitch_classes, weights=weights, minlength=12)
+    if not histogram.any():
+        return None, 0.0
+    profiles = KEY_PROFILES - KEY_PROFILES.mean(axis=1, keepdims=True)
+    centered = histogram - histogram.mean()
+    scores = profiles @ centered / (np.linalg.norm(profiles, axis=1) * (np.linalg.norm(centered) or 1.0))
+    best = int(scores.argmax())
+    return f"{NOTE_NAMES[best % 12]} {'major' if best < 12 else 'minor'}", float(scores[best])
+
+
+def _estimate_tempo(starts: np.ndarray, velocities: np.ndarray):
+    """
+    Tempo from the autocorrelation of a velocity-weighted onset envelope, scored for every BPM in range at once.
+    Basic-Pitch always writes 120 BPM into its MIDI files, so the file's own tempo map carries no information.
+    """
+    if len(starts) < MIN_NOTES_FOR_TEMPO:
+        return None
+    frames = np.round((starts - starts[0]) * ONSET_FRAME_RATE).astype(np.int64)
+    envelope = np.bincount(frames, weights=velocities / 127.0)
+    # Smooth over ±20 ms so slightly early or late onsets still line up
+    envelope = np.convolve(envelope, np.hanning(5), mode="same")
+    envelope = envelope - envelope.mean()
+    if len(envelope) < 2 * ONSET_FRAME_RATE * 60 / MAX_BPM:
+        return None
+
+    spectrum = np.fft.rfft(envelope, 2 * len(envelope))
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[:len(envelope)]
+    bpms = np.arange(MIN_BPM, MAX_BPM + 1, dtype=np.float64)
+    lags = 60.0 * ONSET_FRAME_RATE / bpms
+    # A beat period should also line up at twice its lag; a log-normal prior centred on 120 BPM breaks octave ties
+    scores = np.interp(lags, np.arange(len(autocorrelation)), autocorrelation)
+    scores += 0.5 * np.interp(2 * lags, np.arange(len(autocorrelation)), autocorrelation)
+    scores *= np.exp(-0.5 * np.log2(bpms / 120.0) ** 2)
+    return float(bpms[scores.argmax()]) if scores.max() > 0 else None
+
+
+def _estimate_chords(notes: np.ndarray, window_seconds: float) -> list:
+    """
+    Labels each window with the best-matching major/minor triad. The overlap of every note with every window
+    is computed as one (notes, windows) matrix, folded into a (12, windows) chroma and matched against all
+    24 templates in a single product. Repeated chords are collapsed.
+    """
+    starts, ends, pitches, velocities = notes.T
+    total = ends.max()
+    window_seconds = max(window_seconds, total / MAX_CHORD_WINDOWS)
+    edges = np.arange(0.0, total + window_seconds, window_seconds)
+    window_starts, window_ends = edges[:-1], edges[1:]
+
+    overlap = np.clip(
+        np.minimum(ends[:, None], window_ends[None, :]) - np.maximum(starts[:, None], window_starts[None, :]), 0.0, None
+    ) * velocities[:, None]
+    chroma = np.zeros((12, len(window_starts)))
+    np.add.at(chroma, pitches.astype(np.int64) % 12, overlap)
+
+    energy = chroma.sum(axis=0)
+    fit = CHORD_TEMPLATES @ chroma / np.where(energy > 0, energy, 1.0)
+    best = fit.argmax(axis=0)
+    clear = (energy > 0) & (fit.max(axis=0) >= MIN_CHORD_FIT)
+    labels = best[clear]
+    if labels.size == 0:
+        return []
+    keep = np.concatenate([[True], labels[1:] != labels[:-1]])
+    return CHORD_NAMES[labels[keep]].tolist()
+
+
+def analyze_notes(notes: np.ndarray) -> dict:
+    """
+    Computes the musical summary of a note array.
+
+    Args:
+        notes (np.ndarray): (N, 4) array of start (s), end (s), MIDI pitch and velocity per note.
+
+    Returns:
+        dict: key, tempo, chord progression, note density and pitch range (see analyze_midi).
+    """
+    starts, ends, pitches, velocities = notes.T
+    durations = np.maximum(ends - starts, 0.0)
+    pitch_ints = pitches.astype(np.int64)
+    span_seconds = max(float(ends.max() - starts.min()), 1e-6)
+
+    key, key_confidence = _estimate_key(pitch_ints % 12, durations * velocities)
+    tempo_bpm = _estimate_tempo(starts, velocities)
+    chords = _estimate_chords(notes, BEATS_PER_BAR * 60.0 / (tempo_bpm or 120.0))
+    low, high, median = int(pitch_ints.min()), int(pitch_ints.max()), float(np.median(pitch_ints))
+    register = "low" if median < 48 else ("high" if median >= 72 else "mid")
+
+    summary = {
+        "key": key,
+        "key_confidence": key_confidence,
+        "tempo_bpm": tempo_bpm,
+        "chords": chords[:MAX_CHORDS],
+        "notes": int(len(notes)),
+        "duration_seconds": span_seconds,
+        "note_density": len(notes) / span_seconds,
+        "polyphony": float(durations.sum()) / span_seconds,
+        "pitch_range": f"{_pitch_name(low)}-{_pitch_name(high)}",
+        "register": register,
+    }
+
+    hint = [f"in {key}" if key else None,
+            f"around {tempo_bpm:.0f} BPM" if tempo_bpm else None,
+            f"chord progression {'-'.join(chords[:8])}" if chords else None,
+            f"{register} register",
+            "dense, busy phrasing" if summary["note_density"] > 6 else
+            ("sparse, sustained phrasing" if summary["note_density"] < 1.5 else "moderate note density")]
+    summary["prompt_hint"] = ", ".join(part for part in hint if part)
+    return summary
+
+
+def analyze_midi(midi_path: str) -> dict:
+    """
+    Analyses a MIDI file (e.g. from audio_to_midi): estimated key, tempo, chord progression,
+    note density, polyphony and pitch range, plus a one-line hint for the generation prompt.
+
+    Args:
+        midi_path (str): Path to the .mid file.
+
+    Returns:
+        dict: {"status": "success", "midi_path", "key", "tempo_bpm", "chords", ...} or {"error": ...}.
+    """
+    logger.info(f"Analysing MIDI: {midi_path}")
+
+    if not os.path.exists(midi_path):
+        error_msg = f"MIDI file not found: {midi_path}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    try:
+        with span("inference.midi_analysis", KIND_INFERENCE) as analysis_span:
+            notes = _load_notes(midi_path)
+            if len(notes) == 0:
+                return {"error": f"No pitched notes found in {Path(midi_path).name}"}
+            summary = analyze_notes(notes)
+            analysis_span.set(notes=summary["notes"])
+        logger.info(f"Analysis finished: {summary['prompt_hint']}")
+        return {"status": "success", "midi_path": str(Path(midi_path).absolute()), **summary}
+
+    except Exception as e:
+        error_msg = f"An unexpected error occurred during MIDI analysis: {str(e)}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+# ==========================================
+# Local testing block
+# ==========================================
+if __name__ == "__main__":
+    test_midi = next(Path("workspace/midi_outputs").glob("other_*_basic_pitch.mid"), None)
+
+    if test_midi is not None:
+        logger.info("Initiating local test run for Analyzer...")
+        results = analyze_midi(str(test_midi))
+        logger.info(f"Final JSON payload to return to LLM Agent: {results}")
+    else:
+        logger.warning("No test file matching 'workspace/midi_outputs/other_*_basic_pitch.mid' found.")
@@ -0,0 +1,215 @@
+# tools/audio_io.py
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from collections import OrderedDict
+
+# Configure the standard logger for the Audio I/O layer
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Tool-AudioIO")
+
+# ==========================================
+# Audio I/O configuration
+# ==========================================
+
+# Container of the stems and generated tracks written by the tools: "wav" (16-bit PCM) or "flac" (lossless, ~half the size)
+OUTPUT_FORMAT = os.getenv("MUSIC_AGENT_AUDIO_FORMAT", "wav").strip().lower()
+# Format of the copies sent to the browser (st.audio): "opus", "flac" or "wav" (the artifact itself)
+BROWSER_FORMAT = os.getenv("MUSIC_AGENT_BROWSER_FORMAT", "opus").strip().lower()
+BROWSER_OPUS_BITRATE = os.getenv("MUSIC_AGENT_OPUS_BITRATE", "96k")
+# Budget of decoded audio kept in memory for the next tool in the same process
+MEMORY_CACHE_BYTES = int(os.getenv("MUSIC_AGENT_AUDIO_MEMORY_BYTES", str(512 * 1024 ** 2)))
+
+# Output format -> (soundfile format, subtype, extension)
+OUTPUT_FORMATS = {
+    "wav": ("WAV", "PCM_16", ".wav"),
+    "flac": ("FLAC", "PCM_16", ".flac"),
+}
+MIME_TYPES = {".wav": "audio/wav", ".flac": "audio/flac", ".opus": "audio/ogg", ".ogg": "audio/ogg", ".mp3": "audio/mpeg"}
+BROWSER_COPY_DIR = ".browser"
+
+if OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    # Otherwise every tool would fail with a KeyError when it names its first output file
+    logger.warning(f"Unknown MUSIC_AGENT_AUDIO_FORMAT '{OUTPUT_FORMAT}' (expected one of {', '.join(OUTPUT_FORMATS)}), using wav.")
+    OUTPUT_FORMAT = "wav"
+
+# path -> (audio, samplerate, (size, mtime_ns) of the file when it was written)
+_memory = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+
+
+def _fingerprint(path: str):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _remember(path: str, audio, samplerate: int):
+    """Keeps a just-written array in memory (LRU within MEMORY_CACHE_BYTES) so a later read skips the decode."""
+    global _memory_bytes
+    if audio.nbytes > MEMORY_CACHE_BYTES:
+        return
+    with _memory_lock:
+        if path in _memory:
+            _memory_bytes -= _memory.pop(path)[0].nbytes
+        _memory[path] = (audio, samplerate, _fingerprint(path))
+        _memory_bytes += audio.nbytes
+        while _memory_bytes > MEMORY_CACHE_BYTES:
+            _, (evicted, _, _) = _memory.popitem(last=False)
+            _memory_bytes -= evicted.nbytes
+
+
+def _temp_path(path) -> str:
+    """A unique temp name next to `path` that keeps its extension (open_writer picks the format from it)."""
+    path = Path(path)
+    return str(path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}"))
+
+
+def _recall(path: str):
+    with _memory_lock:
+        entry = _memory.get(path)
+        if entry is None:
+            return None
+        audio, samplerate, fingerprint = entry
+        try:
+            if _fingerprint(path) != fingerprint:
+                return None
+        except OSError:
+            return None
+        _memory.move_to_end(path)
+        return audio, samplerate
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def output_path(path, output_format: str = None) -> str:
+    """`path` with the extension of the configured output format (e.g. generated_music.wav -> generated_music.flac)."""
+    _, _, extension = OUTPUT_FORMATS[output_format or OUTPUT_FORMAT]
+    return str(Path(path).with_suffix(extension))
+
+
+def open_writer(path, samplerate: int, channels: int):
+    """Opens a soundfile writer for incremental writes, in the format given by the path's extension."""
+    import soundfile as sf
+
+    output_format = "flac" if str(path).endswith(".flac") else "wav"
+    file_format, subtype, _ = OUTPUT_FORMATS[output_format]
+    return sf.SoundFile(str(path), "w", samplerate=samplerate, channels=channels, format=file_format, subtype=subtype)
+
+
+def write_audio(path, audio, samplerate: int, remember: bool = True, clip: bool = False) -> str:
+    """
+    Writes float audio ((frames,) or (frames, channels)) as 16-bit PCM WAV/FLAC, chosen by the path's extension.
+    Tracks peaking above full scale are scaled down, or with `clip` clipped to full scale (for files that must
+    keep their level relative to others, e.g. the stems of one separation). The file is written under a temp
+    name and renamed into place, so readers and concurrent writers never see a partial file. With `remember`,
+    the array also stays in memory for read_audio in this process.
+
+    Returns:
+        str: The absolute path of the written file.
+    """
+    import numpy as np
+
+    audio = np.asarray(audio, dtype=np.float32)
+    if clip:
+        audio = np.clip(audio, -1.0, 1.0)
+    else:
+        peak = float(np.abs(audio).max()) if audio.size else 0.0
+        if peak > 1.0:
+            audio = audio / (1.01 * peak)
+
+    path = str(Path(path).absolute())
+    temp_path = _temp_path(path)
+    with open_writer(temp_path, samplerate, 1 if audio.ndim == 1 else audio.shape[1]) as out:
+        out.write(audio)
+    os.replace(temp_path, path)
+    if remember:
+        _remember(path, audio, samplerate)
+    return path
+
+
+def read_audio(path, seconds: float = None, mono: bool = False):
+    """
+    Reads float32 audio, optionally only its first `seconds` and/or downmixed to mono.
+    Arrays written by write_audio in this process come from memory. WAV files are memory-mapped, so
+    only the requested frames are read from disk. Other formats are decoded by soundfile.
+
+    Returns:
+        tuple: (audio as (frames,) or (frames, channels) float32, samplerate)
+    """
+    import numpy as np
+
+    path = str(Path(path).absolute())
+    cached = _recall(path)
+    if cached is not None:
+        audio, samplerate = cached
+        audio = audio[:None if seconds is None else int(seconds * samplerate)]
+    elif path.endswith(".wav"):
+        import scipy.io.wavfile
+
+        samplerate, mapped = scipy.io.wavfile.read(path, mmap=True)
+        audio = np.asarray(mapped[:None if seconds is None else int(seconds * samplerate)])
+        if audio.dtype == np.int16:
+            audio = audio.astype(np.float32) / 32768.0
+        elif audio.dtype == np.int32:
+            audio = audio.astype(np.float32) / 2147483648.0
+        elif audio.dtype == np.uint8:
+            audio = (audio.astype(np.float32) - 128.0) / 128.0
+        else:
+            audio = audio.astype(np.float32)
+    else:
+        import soundfile as sf
+
+        with sf.SoundFile(path) as source:
+            samplerate = source.samplerate
+            audio = source.read(-1 if seconds is None else int(seconds * samplerate), dtype="float32")
+
+    if mono and audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    return audio, samplerate
+
+
+def browser_copy(path, browser_format: str = None):
+    """
+    A compressed copy of an artifact for the browser, created next to it (in BROWSER_COPY_DIR) on first use
+    and re-encoded whenever the artifact changes. Falls back to the artifact itself if encoding fails.
+
+    Returns:
+        tuple: (path to serve, MIME type)
+    """
+    browser_format = browser_format or BROWSER_FORMAT
+    source = Path(path)
+    extension = {"opus": ".opus", "flac": ".flac"}.get(browser_format)
+    if extension is None or source.suffix == extension:
+        return str(source), MIME_TYPES.get(source.suffix, "audio/wav")
+
+    target = source.parent / BROWSER_COPY_DIR / (source.stem + extension)
+    try:
+        if not target.exists() or target.stat().st_mtime_ns < source.stat().st_mtime_ns:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = _temp_path(target)
+            if browser_format == "opus":
+                if shutil.which("ffmpeg") is None:
+                    raise RuntimeError("ffmpeg is required for Opus encoding")
+                subprocess.run(
+                    ["ffmpeg", "-y", "-loglevel", "error", "-i", str(source),
+                     "-c:a", "libopus", "-b:a", BROWSER_OPUS_BITRATE, "-f", "ogg", str(temp_path)],
+                    capture_output=True, check=True,
+                )
+            else:
+                audio, samplerate = read_audio(source)
+                write_audio(temp_path, audio, samplerate, remember=False)
+            os.replace(temp_path, target)
+        return str(target), MIME_TYPES[extension]
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not encode a {browser_format} copy of {source.name}, serving the original: {e}")
+        return str(source), MIME_TYPES.get(source.suffix, "audio/wav")
@@ -0,0 +1,388 @@
+# tools/cache.py
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+import contextlib
+from pathlib import Path
+
+# Configure the standard logger for the Cache layer
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Tool-Cache")
+
+# ==========================================
+# Cache configuration
+# ==========================================
+
+WORKSPACE_ROOT = Path("workspace")
+CACHE_DIR = WORKSPACE_ROOT / ".cache"
+# SQLite index shared by every process (app, job workers, benchmark subprocesses); rows are updated one by one
+INDEX_DB_PATH = CACHE_DIR / "index.db"
+# The cache keeps its own copy of every artifact, so it never depends on (or deletes) files in job workspaces
+ARTIFACTS_DIR = CACHE_DIR / "artifacts"
+# Cached files that no index row points to (a store that crashed or was replaced) are deleted once they
+# are this old; younger ones may belong to a store that is still copying
+ORPHAN_GRACE_SECONDS = 3600
+
+# Upper bound for the cached artifacts (by the sizes recorded in the index); they are evicted (LRU) beyond it.
+# Job workspaces are bounded separately, by the tenant quotas of agent/workspace.py
+MAX_CACHE_BYTES = int(os.getenv("MUSIC_AGENT_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+CACHE_ENABLED = os.getenv("MUSIC_AGENT_CACHE", "1") != "0"
+
+_lock = threading.RLock()
+_schema_ready = False
+# Counters of this process (hits and misses are not written to the index)
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# (absolute path, size, mtime_ns) -> sha256, so unchanged files are only hashed once per process
+_hash_memo = {}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    tool TEXT NOT NULL,
+    result TEXT NOT NULL,
+    artifacts TEXT NOT NULL,
+    dir TEXT,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries (last_access);
+"""
+
+
+@contextlib.contextmanager
+def _connect():
+    """Opens a short-lived autocommit connection; every thread and process uses its own."""
+    global _schema_ready
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(INDEX_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            _schema_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def _delete_owned_files(artifacts, directory):
+    """Removes the cache's own copies of an entry's artifacts (files outside workspace/.cache are left alone)."""
+    for path in artifacts:
+        if _is_cache_owned(path):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _is_cache_owned(path) -> bool:
+    return CACHE_DIR.absolute() in Path(path).absolute().parents
+
+
+def _fingerprint(path: str):
+    """Cheap identity of an artifact on disk, used to detect overwritten or deleted files."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 content hash of a file, streaming it in chunks.
+
+    Args:
+        file_path (str): Path to the file to hash.
+        chunk_size (int): Number of bytes read per iteration.
+
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    path = os.path.abspath(file_path)
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime_ns)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def hash_text(text: str) -> str:
+    """Computes the SHA-256 hash of a text input (e.g. a generation prompt)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(tool_name: str, content_hash: str, **params) -> str:
+    """
+    Builds a cache key from the tool name, the content hash of its input and its parameters.
+
+    Args:
+        tool_name (str): Name of the tool producing the artifacts.
+        content_hash (str): Hash of the input audio file or prompt.
+        **params: Model name and any parameter that changes the output.
+
+    Returns:
+        str: A stable hex key.
+    """
+    payload = json.dumps({"tool": tool_name, "input": content_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _lookup_entry(key: str):
+    if not CACHE_ENABLED:
+        return None
+
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            with _lock:
+                _stats["misses"] += 1
+            return None
+
+        artifacts = json.loads(row["artifacts"])
+        for path, fingerprint in artifacts.items():
+            if _fingerprint(path) != fingerprint:
+                logger.info(f"Cached artifact changed on disk, invalidating entry: {path}")
+                # Only this exact row: another process may have stored a fresh one meanwhile
+                deleted = conn.execute(
+                    "DELETE FROM entries WHERE key = ? AND created = ?", (key, row["created"])
+                ).rowcount
+                if deleted:
+                    _delete_owned_files(artifacts, row["dir"])
+                with _lock:
+                    _stats["misses"] += 1
+                return None
+
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+    with _lock:
+        _stats["hits"] += 1
+    logger.info(f"Cache hit for '{row['tool']}' ({key[:12]})")
+    return {"result": json.loads(row["result"]), "artifacts": list(artifacts)}
+
+
+def _replace_paths(value, paths: dict):
+    """Deep-copies a result, substituting every string that is (relative or absolute) one of the paths in `paths`."""
+    if isinstance(value, str):
+        return paths.get(os.path.abspath(value), value) if value else value
+    if isinstance(value, dict):
+        return {key: _replace_paths(item, paths) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_paths(item, paths) for item in value]
+    return value
+
+
+def cache_lookup(key: str):
+    """
+    Returns the stored result for a key, or None on a miss.
+    Entries whose artifacts were deleted or overwritten since they were stored count as misses and are dropped.
+    """
+    entry = _lookup_entry(key)
+    return entry["result"] if entry else None
+
+
+def materialize(cached_path: str, requested_path) -> str:
+    """
+    Copies a cached artifact to the path a caller asked for, through a temp file so that readers never see
+    a partial copy. Nothing is copied when both paths are the same file.
+
+    Returns:
+        str: The absolute requested path.
+    """
+    requested_path = str(Path(requested_path).absolute())
+    if os.path.abspath(cached_path) != requested_path:
+        Path(requested_path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{requested_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(cached_path, temp_path)
+        os.replace(temp_path, requested_path)
+    return requested_path
+
+
+def cache_restore(key: str, destination):
+    """
+    cache_lookup for tools that write into a caller-chosen location: every artifact of the entry is copied to
+    destination(artifact_path), and the returned result points at the copies instead of the cached files.
+
+    Args:
+        key (str): Key returned by make_cache_key.
+        destination (callable): Maps a cached artifact path to the path the caller expects it at.
+
+    Returns:
+        dict: The result with relocated paths, or None on a miss (or if an artifact vanished while copying).
+    """
+    entry = _lookup_entry(key)
+    if entry is None:
+        return None
+    try:
+        placed = {path: materialize(path, destination(path)) for path in entry["artifacts"]}
+    except OSError as e:
+        logger.warning(f"Could not copy a cached artifact ({e}), recomputing instead")
+        return None
+    return _replace_paths(entry["result"], placed)
+
+
+def cache_store(key: str, tool_name: str, result: dict, artifact_paths: list) -> None:
+    """
+    Records a successful tool result together with the artifacts it produced, then enforces the size budget.
+    Artifacts are copied into a directory of their own under workspace/.cache/artifacts/ (files already under
+    workspace/.cache are kept in place), and the stored result points at those copies.
+
+    Args:
+        key (str): Key returned by make_cache_key.
+        tool_name (str): Name of the tool producing the artifacts.
+        result (dict): The JSON-serializable payload returned by the tool.
+        artifact_paths (list): Files that must still exist (unchanged) for the entry to be valid.
+    """
+    if not CACHE_ENABLED:
+        return
+
+    # A directory per store, so concurrent stores of the same key never write into each other's files
+    directory = (ARTIFACTS_DIR / f"{key}-{uuid.uuid4().hex[:8]}").absolute()
+    artifacts, owned_paths = {}, {}
+    try:
+        for index, path in enumerate(artifact_paths):
+            path = str(Path(path).absolute())
+            if not _is_cache_owned(path):
+                owned_paths[path] = materialize(path, directory / str(index) / Path(path).name)
+    except OSError as e:
+        logger.warning(f"Not caching '{tool_name}': could not copy its artifacts ({e})")
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+    for path in artifact_paths:
+        path = owned_paths.get(str(Path(path).absolute()), str(Path(path).absolute()))
+        fingerprint = _fingerprint(path)
+        if fingerprint is None:
+            logger.warning(f"Not caching '{tool_name}': artifact missing at {path}")
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        artifacts[path] = fingerprint
+    result = _replace_paths(result, owned_paths)
+
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = conn.execute("SELECT artifacts, dir FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, tool, result, artifacts, dir, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, tool_name, json.dumps(result), json.dumps(artifacts), str(directory) if owned_paths else None,
+                 sum(fp[0] for fp in artifacts.values()), now, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    if previous is not None:
+        # Replaced by this store; files this store kept in place (e.g. chroma .npy) are not the previous entry's
+        old_artifacts = [path for path in json.loads(previous["artifacts"]) if path not in artifacts]
+        _delete_owned_files(old_artifacts, previous["dir"] if previous["dir"] != str(directory) else None)
+
+    if not owned_paths:
+        shutil.rmtree(directory, ignore_errors=True)
+    evict_to_budget()
+
+
+def _collect_orphans(conn) -> int:
+    """
+    Deletes cached files and artifact directories that no index row points to (left behind by a store that
+    crashed or lost a race), once they are older than ORPHAN_GRACE_SECONDS.
+    """
+    live = set()
+    for row in conn.execute("SELECT artifacts, dir FROM entries"):
+        live.update(json.loads(row["artifacts"]))
+        if row["dir"]:
+            live.add(row["dir"])
+
+    removed = 0
+    # One level below each cache subdirectory: artifacts/<key>-<id>/ directories, chroma/<key>.npy files, ...
+    for subdir in (CACHE_DIR.iterdir() if CACHE_DIR.exists() else []):
+        if not subdir.is_dir():
+            continue
+        for path in subdir.iterdir():
+            try:
+                age = time.time() - path.stat().st_mtime
+            except OSError:
+                continue
+            if str(path.absolute()) in live or age <= ORPHAN_GRACE_SECONDS:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    path.unlink()
+            removed += 1
+    return removed
+
+
+def evict_to_budget(max_bytes: int = None) -> int:
+    """
+    Deletes the least recently used cache entries until the artifact sizes recorded in the index fit in the
+    budget, and removes orphaned artifact directories. Only the cache's own copies are deleted, never files
+    in job workspaces.
+
+    Args:
+        max_bytes (int): Size budget for the cached artifacts. Defaults to MAX_CACHE_BYTES.
+
+    Returns:
+        int: Number of evicted cache entries.
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+
+    victims = []
+    with _connect() as conn:
+        orphans = _collect_orphans(conn)
+        if orphans:
+            logger.info(f"Removed {orphans} orphaned cache artifacts")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > max_bytes:
+                for row in conn.execute("SELECT key, artifacts, dir, size FROM entries ORDER BY last_access").fetchall():
+                    if total <= max_bytes:
+                        break
+                    conn.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+                    victims.append(row)
+                    total -= row["size"]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    if not victims:
+        return 0
+    for row in victims:
+        _delete_owned_files(json.loads(row["artifacts"]), row["dir"])
+    with _lock:
+        _stats["evictions"] += len(victims)
+    logger.info(f"Evicted {len(victims)} cache entries to keep the cache under {max_bytes} bytes")
+    return len(victims)
+
+
+def cache_stats() -> dict:
+    """Returns this process's hit/miss/eviction counters together with the current number and size of entries."""
+    with _connect() as conn:
+        entries, cached_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    with _lock:
+        return {**_stats, "entries": entries, "cached_bytes": cached_bytes}
@@ -1,10 +1,18 @@
 import os
+import math
+import uuid
 import logging
+import threading
 from pathlib import Path
-import scipy.io.wavfile
 import torch
 from transformers import AutoProcessor, MusicgenForConditionalGeneration
 
+from tools.cache import (
+    CACHE_DIR, CACHE_ENABLED, hash_file, hash_text, make_cache_key, cache_lookup, cache_restore, cache_store
+)
+from tools.tracing import span, KIND_MODEL_LOAD, KIND_INFERENCE, KIND_FILE_WRITE
+from tools.audio_io import OUTPUT_FORMAT, output_path as format_output_path, open_writer, write_audio, read_audio
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s')
 logger = logging.getLogger("Tool-Generator-Local")
@@ -12,35 +20,253 @@ logger = logging.getLogger("Tool-Generator-Local")
 # 全局变量：用于缓存模型，避免每次调用都重新加载
 _processor = None
 _model = None
+_model_lock = threading.Lock()
+
+MODEL_NAME = "facebook/musicgen-small"
+MAX_NEW_TOKENS = 256
+
+# 长音频模式：按固定窗口生成，每个窗口以上一段的结尾作为音频条件，窗口之间交叉淡化拼接
+CONTEXT_SECONDS = 2.0
+CROSSFADE_SECONDS = 0.25
+MAX_DURATION_SECONDS = 300.0
+
+# CPU 推理模式 (没有 MPS 时生效，例如 Linux 服务器)：
+#   fp32 (默认) / int8 (解码器 Linear 层动态量化) / bf16 (解码器与文本编码器转 bfloat16，需要 CPU 支持) / auto (能用 bf16 就用，否则 int8)
+CPU_PRECISIONS = ("fp32", "int8", "bf16", "auto")
+CPU_PRECISION = os.getenv("MUSIC_AGENT_MUSICGEN_PRECISION", "fp32").strip().lower()
+if CPU_PRECISION not in CPU_PRECISIONS:
+    # 未知取值 (如 fp16) 若原样保留，会进入缓存 key，而模型实际以 fp32 运行
+    logger.warning(f"Unknown MUSIC_AGENT_MUSICGEN_PRECISION '{CPU_PRECISION}' (expected one of {', '.join(CPU_PRECISIONS)}), using fp32.")
+    CPU_PRECISION = "fp32"
+# PyTorch intra-op 线程数 (0 = PyTorch 默认值)；同机多个 worker 时按核数切分可以避免线程争抢
+CPU_THREADS = int(os.getenv("MUSIC_AGENT_TORCH_THREADS", "0"))
+# 用 torch.compile 编译解码器的前向计算 (第一次生成会额外花时间编译)
+CPU_COMPILE = os.getenv("MUSIC_AGENT_MUSICGEN_COMPILE", "0") == "1"
+
+
+def _default_device() -> str:
+    # 自动检测是否可以使用 Mac M2 的 Metal 硬件加速 (MPS)
+    return "mps" if torch.backends.mps.is_available() else "cpu"
+
+
+def _cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _resolve_precision(device: str) -> str:
+    """实际使用的精度：MPS 上始终 fp32；bf16 在不支持的 CPU 上退回 int8"""
+    if device != "cpu":
+        return "fp32"
+    if CPU_PRECISION in ("auto", "bf16"):
+        return "bf16" if _cpu_supports_bf16() else "int8"
+    return CPU_PRECISION
+
+
+def _optimize_for_cpu(model, precision: str):
+    """按 CPU_PRECISION / CPU_THREADS / CPU_COMPILE 调整 CPU 上的模型 (EnCodec 音频解码器始终保持 fp32)"""
+    if CPU_THREADS:
+        torch.set_num_threads(CPU_THREADS)
+
+    if precision == "int8":
+        # 自回归解码器占了生成的绝大部分时间，只量化它的 Linear 层 (权重 int8，激活在运行时动态量化)
+        torch.ao.quantization.quantize_dynamic(model.decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif precision == "bf16":
+        # 文本编码器输出要喂给解码器的 cross-attention，两者 (以及中间的投影层) 需要同一精度
+        for module in (model.text_encoder, model.decoder, getattr(model, "enc_to_dec_proj", None)):
+            if module is not None:
+                module.to(torch.bfloat16)
+
+    if CPU_COMPILE:
+        try:
+            model.decoder.forward = torch.compile(model.decoder.forward, dynamic=True)
+        except Exception as e:
+            logger.warning(f"torch.compile is unavailable, running the decoder eagerly: {e}")
+
+    logger.info(f"CPU mode: precision={precision}, threads={torch.get_num_threads()}, compiled={CPU_COMPILE}")
+    return model
+
 
 def _load_model():
     """懒加载模型，只在第一次生成音乐时加载权重到内存"""
     global _processor, _model
-    if _model is None:
-        logger.info("Downloading/Loading MusicGen-Small model... (This takes a moment on first run)")
-        
-        # 自动检测是否可以使用 Mac M2 的 Metal 硬件加速 (MPS)
-        device = "mps" if torch.backends.mps.is_available() else "cpu"
-        logger.info(f"Hardware Acceleration: Using {device.upper()}")
-        
-        _processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-        _model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small").to(device)
-        logger.info("Model loaded successfully into memory!")
-        
+    # 加锁：启动预热线程与第一个请求可能同时触发加载
+    with _model_lock:
+        if _model is None:
+            logger.info("Downloading/Loading MusicGen-Small model... (This takes a moment on first run)")
+
+            device = _default_device()
+            precision = _resolve_precision(device)
+            logger.info(f"Hardware Acceleration: Using {device.upper()}")
+
+            with span("model_load.musicgen", KIND_MODEL_LOAD, model=MODEL_NAME, device=device, precision=precision):
+                _processor = AutoProcessor.from_pretrained(MODEL_NAME)
+                model = MusicgenForConditionalGeneration.from_pretrained(MODEL_NAME).to(device)
+                if device == "cpu":
+                    if CPU_PRECISION == "bf16" and precision != "bf16":
+                        logger.warning("This CPU has no native bf16 support, falling back to int8.")
+                    model = _optimize_for_cpu(model, precision)
+                _model = model
+            logger.info("Model loaded successfully into memory!")
+
     return _processor, _model
 
-def generate_music(prompt: str, output_path: str = "workspace/outputs/generated_music.wav") -> dict:
+def _single_window_seconds(model) -> float:
+    """一次 generate 调用 (MAX_NEW_TOKENS 个 token) 能生成的音频时长"""
+    return _tokens_to_seconds(model, MAX_NEW_TOKENS)
+
+
+def _tokens_to_seconds(model, num_tokens: int) -> float:
+    return num_tokens / model.config.audio_encoder.frame_rate
+
+
+def _write_audio(output_path, sampling_rate: int, audio_data):
+    """以 16-bit PCM (WAV/FLAC，见 MUSIC_AGENT_AUDIO_FORMAT) 写出，体积只有 float32 WAV 的一半或更小"""
+    with span("file_write.audio", KIND_FILE_WRITE) as write_span:
+        write_audio(output_path, audio_data, sampling_rate)
+        write_span.set(bytes=os.path.getsize(output_path))
+
+
+def _generate_long_form(processor, model, prompt: str, duration_seconds: float, output_path: str,
+                        progress_callback=None):
+    """
+    长音频生成：每个窗口最多 MAX_NEW_TOKENS 个 token，后续窗口以前一段结尾 CONTEXT_SECONDS 秒的音频作为条件继续生成，
+    重叠处交叉淡化后立即追加写入磁盘。峰值内存只取决于窗口大小，与总时长无关。
+    """
+    import numpy as np
+
+    device = model.device
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    frame_rate = model.config.audio_encoder.frame_rate
+    hop_length = sampling_rate // frame_rate
+
+    # 条件音频长度取 hop 的整数倍，这样解码结果中的 prompt 部分与原音频逐样本对齐
+    context_samples = int(CONTEXT_SECONDS * frame_rate) * hop_length
+    continuation_tokens = MAX_NEW_TOKENS - int(CONTEXT_SECONDS * frame_rate)
+    crossfade = int(CROSSFADE_SECONDS * sampling_rate)
+    target_samples = int(duration_seconds * sampling_rate)
+    total_windows = 1 + math.ceil(
+        max(0, target_samples - MAX_NEW_TOKENS * hop_length) / (continuation_tokens * hop_length)
+    )
+
+    fade_in = np.linspace(0.0, 1.0, crossfade, dtype=np.float32)
+    fade_out = 1.0 - fade_in
+    written = 0
+    pending = None   # 最后 crossfade 个样本暂不写出，留给下一个窗口做交叉淡化
+    context = None
+
+    with open_writer(output_path, sampling_rate, channels=1) as out:
+
+        def emit(samples):
+            nonlocal written
+            samples = samples[:max(target_samples - written, 0)]
+            out.write(np.clip(samples, -1.0, 1.0))
+            out.flush()
+            written += len(samples)
+
+        for window in range(total_windows):
+            if context is None:
+                inputs = processor(text=[prompt], padding=True, return_tensors="pt").to(device)
+                with span("inference.musicgen_window", KIND_INFERENCE,
+                          audio_seconds=_tokens_to_seconds(model, MAX_NEW_TOKENS)):
+                    audio = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)[0, 0].cpu().numpy()
+            else:
+                inputs = processor(
+                    audio=context, sampling_rate=sampling_rate, text=[prompt], padding=True, return_tensors="pt"
+                ).to(device)
+                with span("inference.musicgen_window", KIND_INFERENCE,
+                          audio_seconds=_tokens_to_seconds(model, continuation_tokens)):
+                    audio = model.generate(**inputs, max_new_tokens=continuation_tokens)[0, 0].cpu().numpy()
+                # 输出包含重新解码的条件音频：从与 pending 对齐的位置开始截取，再交叉淡化
+                audio = audio[len(context) - crossfade:]
+                audio[:crossfade] = audio[:crossfade] * fade_in + pending * fade_out
+
+            emit(audio[:-crossfade])
+            pending = audio[-crossfade:]
+            context = audio[-context_samples:]
+
+            logger.info(f"Long-form window {window + 1}/{total_windows} written ({written / sampling_rate:.1f}s)")
+            if progress_callback:
+                progress_callback({
+                    "event": "generation_progress",
+                    "window": window + 1,
+                    "total_windows": total_windows,
+                    "seconds_generated": written / sampling_rate,
+                    "audio_path": str(Path(output_path).absolute()),
+                })
+
+        emit(pending)
+
+
+def _finish(cache_key: str, prompt: str, output_path: str) -> dict:
+    """记录缓存 (只有固定了 seed 的生成才有 cache_key) 并返回给 Agent 的结果"""
+    logger.info(f"✅ Local music generated successfully! Saved at: {output_path}")
+    result = {
+        "status": "success",
+        "audio_path": str(Path(output_path).absolute()),
+        "description": f"New music locally generated based on: {prompt}"
+    }
+    if cache_key:
+        cache_store(cache_key, "generate_music", result, [result["audio_path"]])
+    return result
+
+
+def generate_music(prompt: str, output_path: str = "workspace/outputs/generated_music.wav",
+                   duration_seconds: float = None, seed: int = None, progress_callback=None) -> dict:
     """
     Runs Meta's MusicGen locally on your Mac to generate audio from a text prompt.
+    When duration_seconds exceeds a single window (~5s), the track is generated window by window
+    with constant memory (long-form mode) and streamed to disk as each window finishes; shorter
+    durations generate only the tokens needed and are cut to the exact length. Durations above
+    MAX_DURATION_SECONDS are clamped, which the result reports in a "note".
+    MusicGen samples, so every call gives a new clip; with a seed the output is reproducible and
+    therefore cached (a repeated prompt + seed is copied from the cache to output_path).
     """
     logger.info(f"Starting local music generation for prompt: '{prompt}'")
     
-    Path("workspace/outputs").mkdir(parents=True, exist_ok=True)
+    output_path = format_output_path(output_path)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+    # 超过上限的时长被截断：记录日志，并在返回结果中告知 Agent
+    clamp_note = None
+    if duration_seconds is not None:
+        requested_seconds = float(duration_seconds)
+        if requested_seconds <= 0:
+            return {"error": f"duration_seconds must be positive, got {duration_seconds}."}
+        duration_seconds = min(requested_seconds, MAX_DURATION_SECONDS)
+        if duration_seconds < requested_seconds:
+            clamp_note = (f"Requested {requested_seconds:.0f}s exceeds the {MAX_DURATION_SECONDS:.0f}s maximum; "
+                          f"the track is {MAX_DURATION_SECONDS:.0f}s long.")
+            logger.warning(clamp_note)
+
+    def with_note(result: dict) -> dict:
+        return {**result, "note": clamp_note} if clamp_note and "error" not in result else result
+
+    # 同一个 prompt + seed 已经生成过：直接复用缓存的音频 (复制到请求的输出路径)
+    cache_key = None
+    if seed is not None:
+        seed = int(seed)
+        cache_key = make_cache_key(
+            "generate_music", hash_text(prompt), model=MODEL_NAME, max_new_tokens=MAX_NEW_TOKENS, seed=seed,
+            duration_seconds=duration_seconds, precision=_resolve_precision(_default_device()), audio_format=OUTPUT_FORMAT
+        )
+        cached = cache_restore(cache_key, lambda path: output_path)
+        if cached is not None:
+            return with_note(cached)
 
     try:
         # 1. 加载模型
         processor, model = _load_model()
         device = model.device
+        if seed is not None:
+            torch.manual_seed(seed)
+
+        if duration_seconds and duration_seconds > _single_window_seconds(model):
+            logger.info(f"Long-form mode: generating {duration_seconds:.0f}s in windows of {MAX_NEW_TOKENS} tokens...")
+            _generate_long_form(processor, model, prompt, duration_seconds, output_path, progress_callback)
+            return with_note(_finish(cache_key, prompt, output_path))
         
         # 2. 将文本提示词转换为模型能看懂的张量 (Tensors)
         logger.info("Synthesizing audio... (Please wait, your M2 chip is working hard!)")
@@ -50,27 +276,316 @@ def generate_music(prompt: str, output_path: str = "workspace/outputs/generated_
             return_tensors="pt",
         ).to(device)
         
-        # 3. 生成音频波形 (设置生成大约 10 秒的音频，256 个 token 约等于 10 秒)
-        audio_values = model.generate(**inputs, max_new_tokens=256)
+        # 3. 生成音频波形 (一个窗口最多 256 个 token，约 5 秒；更短的请求只生成需要的 token 数)
+        num_tokens = MAX_NEW_TOKENS
+        if duration_seconds:
+            num_tokens = min(MAX_NEW_TOKENS, math.ceil(duration_seconds * model.config.audio_encoder.frame_rate))
+        with span("inference.musicgen", KIND_INFERENCE, audio_seconds=_tokens_to_seconds(model, num_tokens)):
+            audio_values = model.generate(**inputs, max_new_tokens=num_tokens)
         
-        # 4. 将张量转换回 CPU 并保存为 .wav 文件
+        # 4. 将张量转换回 CPU，按请求时长截断后保存为音频文件
         audio_data = audio_values[0, 0].cpu().numpy()
         sampling_rate = model.config.audio_encoder.sampling_rate
+        if duration_seconds:
+            audio_data = audio_data[:int(duration_seconds * sampling_rate)]
         
-        scipy.io.wavfile.write(output_path, rate=sampling_rate, data=audio_data)
+        _write_audio(output_path, sampling_rate, audio_data)
         
-        logger.info(f"✅ Local music generated successfully! Saved at: {output_path}")
-        return {
+        return with_note(_finish(cache_key, prompt, output_path))
+
+    except Exception as e:
+        logger.error(f"Local generation failed: {e}")
+        return {"error": str(e)}
+
+# ==========================================
+# 批量生成：多个 prompt / 多个变体一次性送入模型
+# ==========================================
+
+# 单个 batch 元素 (256 token) 的显存/内存估算值，用于自动决定 batch 大小
+BYTES_PER_BATCH_ITEM = 512 * 1024 ** 2
+MAX_BATCH_SIZE = 8
+
+
+def _available_memory_bytes(device) -> int:
+    """当前设备上可用于推理的内存估算"""
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    if device.type == "mps":
+        return torch.mps.recommended_max_memory() - torch.mps.current_allocated_memory()
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return BYTES_PER_BATCH_ITEM
+
+
+def _auto_batch_size(device) -> int:
+    return max(1, min(MAX_BATCH_SIZE, _available_memory_bytes(device) // BYTES_PER_BATCH_ITEM))
+
+
+def _is_out_of_memory(error: BaseException) -> bool:
+    """CUDA/MPS 显存不足与 CPU 内存不足 (DefaultCPUAllocator: can't allocate memory) 都算 OOM"""
+    if isinstance(error, MemoryError) or isinstance(error, getattr(torch, "OutOfMemoryError", ())):
+        return True
+    message = str(error).lower()
+    return "out of memory" in message or "can't allocate memory" in message
+
+
+def generate_music_batch(prompts: list = None, num_variants: int = 1, output_dir: str = "workspace/outputs",
+                         batch_size: int = None) -> dict:
+    """
+    Generates several tracks in padded batches: every prompt in `prompts`, `num_variants` times each
+    (e.g. one prompt with num_variants=3 gives A/B/C remix choices). Each output goes to its own WAV,
+    named with an id of this call so that later batches into the same directory never overwrite it.
+    Results are not cached, since repeated variants are expected to differ.
+
+    Args:
+        prompts (list): Text prompts to generate from.
+        num_variants (int): Number of variants per prompt.
+        output_dir (str): Directory for the generated WAV files.
+        batch_size (int): Items per model.generate call. Defaults to what fits in available memory;
+                          halved automatically on out-of-memory errors.
+
+    Returns:
+        dict: {"status": "success", "outputs": [{"prompt", "variant", "audio_path"}, ...]} or {"error": ...}.
+    """
+    prompts = list(prompts or [])
+    jobs = [(prompt, variant) for prompt in prompts for variant in range(max(1, int(num_variants)))]
+    if not jobs:
+        return {"error": "No prompts given."}
+
+    logger.info(f"Starting batched generation: {len(prompts)} prompt(s) x {num_variants} variant(s)")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    try:
+        processor, model = _load_model()
+        device = model.device
+        sampling_rate = model.config.audio_encoder.sampling_rate
+        batch_size = batch_size or _auto_batch_size(device)
+
+        batch_id = uuid.uuid4().hex[:8]
+        outputs = []
+        start = 0
+        while start < len(jobs):
+            chunk = jobs[start:start + batch_size]
+            try:
+                inputs = processor(text=[prompt for prompt, _ in chunk], padding=True, return_tensors="pt").to(device)
+                with span("inference.musicgen_batch", KIND_INFERENCE, batch_size=len(chunk),
+                          audio_seconds=len(chunk) * _single_window_seconds(model)):
+                    audio_values = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
+            except (RuntimeError, MemoryError) as e:
+                if not _is_out_of_memory(e) or batch_size == 1:
+                    raise
+                if device.type == "cuda":
+                    torch.cuda.empty_cache()
+                batch_size = max(1, batch_size // 2)
+                logger.warning(f"Out of memory, retrying with batch size {batch_size}")
+                continue
+
+            audio_values = audio_values.cpu().numpy()
+            for offset, (prompt, variant) in enumerate(chunk):
+                output_path = Path(format_output_path(Path(output_dir) / f"generated_music_{batch_id}_{start + offset + 1:02d}"))
+                _write_audio(output_path, sampling_rate, audio_values[offset, 0])
+                outputs.append({"prompt": prompt, "variant": variant + 1, "audio_path": str(output_path.absolute())})
+            logger.info(f"Batch of {len(chunk)} generated ({len(outputs)}/{len(jobs)})")
+            start += len(chunk)
+
+        logger.info(f"✅ Batched generation finished! {len(outputs)} file(s) saved in: {output_dir}")
+        return {"status": "success", "outputs": outputs}
+
+    except Exception as e:
+        logger.error(f"Batched generation failed: {e}")
+        return {"error": str(e)}
+
+# ==========================================
+# 旋律条件生成：直接用分离出的音轨 / 转录的 MIDI 作为条件输入
+# ==========================================
+
+MELODY_MODEL_NAME = "facebook/musicgen-melody"
+CHROMA_CACHE_DIR = CACHE_DIR / "chroma"
+
+_melody_processor = None
+_melody_model = None
+_melody_model_lock = threading.Lock()
+
+
+def _load_melody_model():
+    """懒加载 MusicGen-Melody (需要 transformers>=4.40)，与文本模型一样常驻内存"""
+    global _melody_processor, _melody_model
+    with _melody_model_lock:
+        if _melody_model is None:
+            from transformers import MusicgenMelodyForConditionalGeneration, MusicgenMelodyProcessor
+
+            logger.info("Downloading/Loading MusicGen-Melody model... (This takes a moment on first run)")
+            device = _default_device()
+            with span("model_load.musicgen_melody", KIND_MODEL_LOAD, model=MELODY_MODEL_NAME, device=device):
+                _melody_processor = MusicgenMelodyProcessor.from_pretrained(MELODY_MODEL_NAME)
+                _melody_model = MusicgenMelodyForConditionalGeneration.from_pretrained(MELODY_MODEL_NAME).to(device)
+            logger.info("Melody model loaded successfully into memory!")
+    return _melody_processor, _melody_model
+
+
+def _chroma_from_audio(feature_extractor, melody_path: str):
+    """用模型自带的特征提取器从音频计算 chroma (只取模型能使用的前 chunk_length 秒)"""
+    import numpy as np
+    import torchaudio.functional as AF
+
+    # 刚在本进程分离出的音轨直接取内存中的数组，大 WAV 走内存映射，只读需要的部分
+    audio, file_rate = read_audio(melody_path, seconds=feature_extractor.chunk_length, mono=True)
+    target_rate = feature_extractor.sampling_rate
+    if file_rate != target_rate:
+        audio = AF.resample(torch.from_numpy(audio), file_rate, target_rate).numpy()
+
+    features = feature_extractor(audio=np.ascontiguousarray(audio), sampling_rate=target_rate, return_tensors="np")
+    return features["input_features"][0]
+
+
+def _chroma_from_midi(feature_extractor, melody_path: str):
+    """把 MIDI 直接渲染成与特征提取器相同帧率、相同形式 (每帧主导音级的 one-hot) 的 chroma"""
+    import numpy as np
+    import pretty_midi
+
+    frame_rate = feature_extractor.sampling_rate / feature_extractor.hop_length
+    chroma = pretty_midi.PrettyMIDI(melody_path).get_chroma(fs=frame_rate)        # (12, frames)
+    max_frames = int(feature_extractor.chunk_length * frame_rate)
+    chroma = chroma[:, :max_frames].T                                               # (frames, 12)
+
+    one_hot = np.zeros_like(chroma, dtype=np.float32)
+    one_hot[np.arange(len(chroma)), chroma.argmax(axis=1)] = 1.0
+    return one_hot
+
+
+def melody_features(melody_path: str):
+    """
+    Returns the chroma conditioning features for a stem (.wav/.mp3/...) or MIDI file.
+    Features are computed once per file content and cached as .npy under workspace/.cache/chroma,
+    registered in the result cache so that they fall under its LRU size budget.
+    """
+    import numpy as np
+
+    processor, _ = _load_melody_model()
+    cache_key = make_cache_key("chroma", hash_file(melody_path), model=MELODY_MODEL_NAME)
+    cached = cache_lookup(cache_key)
+    if cached is not None:
+        try:
+            chroma = np.load(cached["chroma_path"])
+            logger.info(f"Reusing cached chroma features for: {melody_path}")
+            return chroma
+        except OSError:
+            pass   # 刚好被 LRU 淘汰，重新计算
+
+    if Path(melody_path).suffix.lower() in (".mid", ".midi"):
+        chroma = _chroma_from_midi(processor.feature_extractor, melody_path)
+    else:
+        chroma = _chroma_from_audio(processor.feature_extractor, melody_path)
+
+    if CACHE_ENABLED:
+        cache_path = CHROMA_CACHE_DIR / f"{cache_key}.npy"
+        CHROMA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp.npy")
+        np.save(tmp_path, chroma)
+        os.replace(tmp_path, cache_path)
+        cache_store(cache_key, "chroma", {"chroma_path": str(cache_path.absolute())}, [str(cache_path)])
+    return chroma
+
+
+def generate_music_from_melody(prompt: str, melody_path: str,
+                               output_path: str = "workspace/outputs/generated_music.wav",
+                               duration_seconds: float = None) -> dict:
+    """
+    Generates audio that follows the melody of a separated stem or a transcribed MIDI file,
+    using MusicGen-Melody conditioned on the text prompt plus the melody's chroma features.
+
+    Args:
+        prompt (str): Style description for the new track.
+        melody_path (str): A stem from separate_audio or a MIDI file from audio_to_midi.
+        output_path (str): Where to write the generated audio (the extension follows MUSIC_AGENT_AUDIO_FORMAT).
+        duration_seconds (float): Optional length. Melody conditioning covers a single window (~5s):
+                                  shorter durations are cut to length, longer ones are capped (see "note").
+
+    Returns:
+        dict: {"status": "success", "audio_path", "description"[, "note"]} or {"error": ...}.
+    """
+    logger.info(f"Starting melody-conditioned generation from '{melody_path}' for prompt: '{prompt}'")
+
+    if not os.path.exists(melody_path):
+        error_msg = f"Melody file not found: {melody_path}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+    output_path = format_output_path(output_path)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        processor, model = _load_melody_model()
+        device = model.device
+
+        chroma = melody_features(melody_path)
+        inputs = processor(text=[prompt], padding=True, return_tensors="pt").to(device)
+        inputs["input_features"] = torch.from_numpy(chroma)[None].to(device)
+
+        # 旋律条件只覆盖一个窗口：更短的请求只生成需要的 token 数并截断，更长的请求封顶并在结果中说明
+        num_tokens, note = MAX_NEW_TOKENS, None
+        if duration_seconds:
+            num_tokens = min(MAX_NEW_TOKENS, math.ceil(float(duration_seconds) * model.config.audio_encoder.frame_rate))
+            if float(duration_seconds) > _single_window_seconds(model):
+                note = (f"Melody-conditioned generation is limited to {_single_window_seconds(model):.1f}s; "
+                        f"use generate_music for a {float(duration_seconds):.0f}s track.")
+                logger.warning(note)
+        with span("inference.musicgen_melody", KIND_INFERENCE, audio_seconds=_tokens_to_seconds(model, num_tokens)):
+            audio_values = model.generate(**inputs, max_new_tokens=num_tokens)
+        sampling_rate = model.config.audio_encoder.sampling_rate
+        audio_data = audio_values[0, 0].cpu().numpy()
+        if duration_seconds:
+            audio_data = audio_data[:int(float(duration_seconds) * sampling_rate)]
+        _write_audio(output_path, sampling_rate, audio_data)
+
+        logger.info(f"✅ Melody-conditioned music generated successfully! Saved at: {output_path}")
+        result = {
             "status": "success",
             "audio_path": str(Path(output_path).absolute()),
-            "description": f"New music locally generated based on: {prompt}"
+            "description": f"New music following the melody of {Path(melody_path).name}, based on: {prompt}"
         }
+        if note:
+            result["note"] = note
+        return result
 
     except Exception as e:
-        logger.error(f"Local generation failed: {e}")
+        logger.error(f"Melody-conditioned generation failed: {e}")
         return {"error": str(e)}
 
+# ==========================================
+# 预热：服务启动时加载权重并跑一次极短的生成
+# ==========================================
+
+# 预热只生成几个 token，目的是触发权重加载、MPS/CUDA 内核编译与内存分配，而不是产出音频
+WARMUP_TOKENS = 8
+
+
+def _warm_up_generation(processor, model):
+    inputs = processor(text=["warm-up"], padding=True, return_tensors="pt").to(model.device)
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=WARMUP_TOKENS)
+
+
+def active_precision() -> str:
+    """本进程的 MusicGen 实际运行精度 (已考虑 MPS 与 bf16 回退)，不加载模型"""
+    return _resolve_precision(_default_device())
+
+
+def warm_up() -> dict:
+    """加载 MusicGen 并做一次 dummy 推理，让第一个真实请求不再承担冷启动开销"""
+    processor, model = _load_model()
+    _warm_up_generation(processor, model)
+    return {"status": "success", "model": MODEL_NAME, "device": str(model.device), "precision": active_precision()}
+
+
+def warm_up_melody() -> dict:
+    """同 warm_up，针对 MusicGen-Melody (纯文本条件即可完成预热)"""
+    processor, model = _load_melody_model()
+    _warm_up_generation(processor, model)
+    return {"status": "success", "model": MELODY_MODEL_NAME, "device": str(model.device)}
+
 if __name__ == "__main__":
     # 本地直接测试生成！
     test_prompt = "Cyberpunk electronic style, heavy bass, futuristic synth, 120bpm"
-    generate_music(test_prompt)
\ No newline at end of file
+    generate_music(test_prompt)
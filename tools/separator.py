@@ -1,9 +1,15 @@
 # tools/separator.py
 import os
+import math
 import subprocess
 import logging
+import threading
 from pathlib import Path
 
+from tools.cache import hash_file, make_cache_key, cache_restore, cache_store
+from tools.tracing import span, KIND_MODEL_LOAD, KIND_INFERENCE, KIND_FILE_WRITE
+from tools.audio_io import OUTPUT_FORMAT, output_path, open_writer, write_audio
+
 # Configure the standard logger for this module
 # Defines the format: [Time] - [Level] - [Message]
 logging.basicConfig(
@@ -13,58 +19,384 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Tool-Separator")
 
-def separate_audio(input_file_path: str, output_dir: str = "workspace/separated") -> dict:
+MODEL_NAME = "htdemucs"
+SOURCE_STEMS = ["vocals", "drums", "bass", "other"]
+# "accompaniment" is the mix of every non-vocal source (Demucs' "no_vocals")
+AVAILABLE_STEMS = SOURCE_STEMS + ["accompaniment"]
+
+# "inprocess" keeps the model resident; "cli" always shells out to the demucs executable
+SEPARATOR_BACKEND = os.getenv("MUSIC_AGENT_DEMUCS_BACKEND", "inprocess")
+
+# Long recordings are separated window by window so memory stays bounded by the window size
+STREAMING_THRESHOLD_SECONDS = float(os.getenv("MUSIC_AGENT_STREAMING_THRESHOLD", "600"))
+WINDOW_SECONDS = 30.0
+OVERLAP_SECONDS = 2.0
+
+# Samples beyond full scale are clipped in every stem, by every backend ("clamp" in demucs CLI terms): streamed
+# windows are written before the stem's peak is known, and per-stem rescaling would change the stems' relative levels
+CLIP_MODE = "clamp"
+
+# Global variables: the Demucs model is loaded once and kept warm between calls
+_model = None
+_device = None
+_model_lock = threading.Lock()
+
+
+def _load_model():
+    """Lazily loads the htdemucs weights on first use and keeps them resident in memory."""
+    global _model, _device
+    with _model_lock:
+        if _model is None:
+            import torch
+            from demucs.pretrained import get_model
+
+            logger.info(f"Loading Demucs '{MODEL_NAME}' model into memory... (first call only)")
+            _device = "cuda" if torch.cuda.is_available() else "cpu"
+            with span("model_load.demucs", KIND_MODEL_LOAD, model=MODEL_NAME, device=_device):
+                model = get_model(MODEL_NAME)
+                model.to(_device)
+                model.eval()
+            _model = model
+            logger.info(f"Demucs model loaded on {_device.upper()}")
+    return _model, _device
+
+
+def warm_up() -> dict:
+    """
+    Loads htdemucs and separates one second of silence, so the first real request
+    pays neither the weight load nor the device/kernel initialization.
+    """
+    if SEPARATOR_BACKEND == "cli":
+        return {"status": "skipped", "reason": "The demucs CLI loads the model on every call."}
+    import numpy as np
+
+    model, device = _load_model()
+    silence = np.zeros((int(model.samplerate), model.audio_channels), dtype="float32")
+    _separate_chunk(model, device, silence, ["vocals"])
+    return {"status": "success", "model": MODEL_NAME, "device": device}
+
+
+def _separate_in_process(input_file_path: str, target_folder: Path, stems: list, on_stem=None) -> dict:
+    """Runs the resident Demucs model and writes only the requested stems, calling on_stem(stem, path) after each one."""
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import AudioFile
+
+    model, device = _load_model()
+
+    wav = AudioFile(input_file_path).read(streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+    # Same normalization as the demucs CLI
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+
+    with span("inference.demucs", KIND_INFERENCE, audio_seconds=wav.shape[-1] / model.samplerate), torch.no_grad():
+        sources = apply_model(model, wav[None], device=device, split=True, overlap=0.25, progress=False)[0]
+    sources = sources * ref.std() + ref.mean()
+    by_name = dict(zip(model.sources, sources))
+
+    target_folder.mkdir(parents=True, exist_ok=True)
+    output_paths = {}
+    for stem in stems:
+        if stem == "accompaniment":
+            audio = sum(source for name, source in by_name.items() if name != "vocals")
+        else:
+            audio = by_name[stem]
+        with span("file_write.stem", KIND_FILE_WRITE, stem=stem) as write_span:
+            # The array stays in memory too, so a later tool in this process can skip decoding the file
+            output_paths[stem] = write_audio(
+                output_path(target_folder / stem), audio.cpu().numpy().T, model.samplerate, clip=True
+            )
+            write_span.set(bytes=os.path.getsize(output_paths[stem]))
+        if on_stem:
+            on_stem(stem, output_paths[stem])
+    return output_paths
+
+
+def _separate_with_cli(input_file_path: str, output_dir: str, target_folder: Path, stems: list) -> dict:
+    """Fallback path: runs the demucs executable in a subprocess."""
+    two_stems = "accompaniment" in stems
+    if two_stems and not set(stems) <= {"vocals", "accompaniment"}:
+        raise ValueError("The demucs CLI backend can only produce 'accompaniment' together with 'vocals'.")
+
+    # Construct the Demucs command using the efficient 'htdemucs' model
+    command = [
+        "demucs",
+        "-n", MODEL_NAME,
+        "-o", output_dir,
+        input_file_path
+    ]
+    if two_stems:
+        command[1:1] = ["--two-stems", "vocals"]
+    if OUTPUT_FORMAT == "flac":
+        command[1:1] = ["--flac"]
+    command[1:1] = ["--clip-mode", CLIP_MODE]
+
+    # Execute the subprocess synchronously (model load + inference + file writes in one span)
+    with span("inference.demucs_cli", KIND_INFERENCE, audio_seconds=_probe_duration(input_file_path)):
+        subprocess.run(command, capture_output=True, text=True, check=True)
+
+    if two_stems:
+        no_vocals_path = Path(output_path(target_folder / "no_vocals"))
+        if no_vocals_path.exists():
+            os.replace(no_vocals_path, output_path(target_folder / "accompaniment"))
+
+    output_paths = {}
+    for stem in stems:
+        track_path = Path(output_path(target_folder / stem))
+        if not track_path.exists():
+            raise FileNotFoundError(f"Expected output file not found: {track_path}")
+        output_paths[stem] = str(track_path.absolute())
+    return output_paths
+
+
+# ==========================================
+# Streaming (chunked) separation
+# ==========================================
+
+def _probe_duration(input_file_path: str):
+    """Returns the duration of an audio file in seconds using ffprobe, or None if it cannot be determined."""
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        input_file_path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def _decode_windows(input_file_path: str, samplerate: int, channels: int, window: int, overlap: int):
+    """
+    Decodes the input with ffmpeg and yields overlapping float32 windows of shape (frames, channels).
+    Only one window is held in memory at a time; consecutive windows share `overlap` frames.
+    """
+    import numpy as np
+
+    command = [
+        "ffmpeg", "-v", "error", "-nostdin",
+        "-i", input_file_path,
+        "-f", "f32le", "-ac", str(channels), "-ar", str(samplerate),
+        "-"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_bytes = 4 * channels
+    carry = np.zeros((0, channels), dtype=np.float32)
+    frames_decoded = 0
+    reached_end = False
+
+    try:
+        while True:
+            raw = process.stdout.read((window - len(carry)) * frame_bytes)
+            raw = raw[:len(raw) - len(raw) % frame_bytes]
+            new_frames = np.frombuffer(raw, dtype=np.float32).reshape(-1, channels)
+            if len(new_frames) == 0:
+                reached_end = True
+                break
+            frames_decoded += len(new_frames)
+
+            chunk = np.concatenate([carry, new_frames])
+            yield chunk
+            if len(chunk) < window:
+                reached_end = True
+                break
+            carry = chunk[-overlap:]
+    finally:
+        process.stdout.close()
+        if not reached_end:
+            # The caller stopped early (or failed): ffmpeg is not needed any more
+            process.kill()
+        stderr = process.stderr.read().decode(errors="replace").strip()
+        process.stderr.close()
+        returncode = process.wait()
+
+    # ffmpeg may print warnings (e.g. about a damaged header) and still decode the whole file: only its
+    # exit status says whether decoding failed, and a failure after some windows would leave truncated stems
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {input_file_path} (exit status {returncode}): {stderr}")
+    if frames_decoded == 0:
+        raise RuntimeError(f"ffmpeg decoded no audio from {input_file_path}")
+
+
+def _separate_chunk(model, device: str, chunk, stems: list) -> dict:
+    """Separates a single window and returns {stem: float32 array (frames, channels)}."""
+    import torch
+    from demucs.apply import apply_model
+
+    wav = torch.from_numpy(chunk.T.copy())
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std() + 1e-8
+    wav = (wav - mean) / std
+
+    with span("inference.demucs_window", KIND_INFERENCE, audio_seconds=len(chunk) / model.samplerate), torch.no_grad():
+        sources = apply_model(model, wav[None], device=device, split=True, overlap=0.25, progress=False)[0]
+    sources = sources * std + mean
+    by_name = dict(zip(model.sources, sources))
+
+    separated = {}
+    for stem in stems:
+        if stem == "accompaniment":
+            audio = sum(source for name, source in by_name.items() if name != "vocals")
+        else:
+            audio = by_name[stem]
+        separated[stem] = audio.cpu().numpy().T.astype("float32")
+    return separated
+
+
+def separate_audio_streaming(input_file_path: str, output_dir: str = "workspace/separated", stems: list = None,
+                             window_seconds: float = WINDOW_SECONDS, overlap_seconds: float = OVERLAP_SECONDS):
+    """
+    Separates a long recording in overlapping windows, cross-fading the overlaps and appending
+    each finished window to the stem WAVs. Peak memory depends on the window size, not the file length.
+
+    Args:
+        input_file_path (str): The absolute or relative path to the input audio file.
+        output_dir (str): The root directory where the separated stems will be saved.
+        stems (list): Optional subset of stems to write, chosen from AVAILABLE_STEMS.
+        window_seconds (float): Length of each separation window.
+        overlap_seconds (float): Length of the cross-faded region shared by consecutive windows.
+
+    Yields:
+        dict: A progress event after every window ({"event": "progress", ...}), then a final
+              {"event": "done", "status": "success", "tracks": {...}} event.
+    """
+    import numpy as np
+
+    stems = list(dict.fromkeys(stems or SOURCE_STEMS))
+    model, device = _load_model()
+    samplerate, channels = model.samplerate, model.audio_channels
+    window = int(window_seconds * samplerate)
+    overlap = int(overlap_seconds * samplerate)
+    if not 0 < overlap < window // 2:
+        raise ValueError("overlap_seconds must be positive and shorter than half of window_seconds.")
+
+    duration = _probe_duration(input_file_path)
+    total_windows = None
+    if duration:
+        total_windows = max(1, math.ceil((duration * samplerate - overlap) / (window - overlap)))
+
+    target_folder = Path(output_dir) / MODEL_NAME / Path(input_file_path).stem
+    target_folder.mkdir(parents=True, exist_ok=True)
+    output_paths = {stem: str(Path(output_path(target_folder / stem)).absolute()) for stem in stems}
+
+    fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+    fade_out = 1.0 - fade_in
+    writers = {stem: open_writer(path, samplerate, channels) for stem, path in output_paths.items()}
+    tails = None
+    frames_written = 0
+
+    try:
+        for index, chunk in enumerate(_decode_windows(input_file_path, samplerate, channels, window, overlap)):
+            separated = _separate_chunk(model, device, chunk, stems)
+            new_tails = {}
+            for stem, audio in separated.items():
+                if tails is not None:
+                    # The first `overlap` frames repeat the previous window's tail: cross-fade them
+                    audio[:overlap] = audio[:overlap] * fade_in + tails[stem] * fade_out
+                audio = np.clip(audio, -1.0, 1.0, out=audio)
+                writers[stem].write(audio[:-overlap])
+                writers[stem].flush()
+                new_tails[stem] = audio[-overlap:]
+            frames_written += max(len(chunk) - overlap, 0)
+            tails = new_tails
+
+            yield {
+                "event": "progress",
+                "window": index + 1,
+                "total_windows": total_windows,
+                "seconds_processed": frames_written / samplerate,
+                "tracks": output_paths,
+            }
+
+        if tails is None:
+            raise RuntimeError(f"No audio could be decoded from {input_file_path}")
+        for stem, tail in tails.items():
+            writers[stem].write(tail)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    yield {"event": "done", "status": "success", "tracks": output_paths}
+
+
+def separate_audio(input_file_path: str, output_dir: str = "workspace/separated", stems: list = None,
+                   streaming: bool = None, progress_callback=None) -> dict:
     """
     Executes the Demucs model to separate an audio track into distinct stems (vocals, drums, bass, other).
-    
+
     Args:
         input_file_path (str): The absolute or relative path to the input audio file.
         output_dir (str): The root directory where the separated stems will be saved.
-        
+        stems (list): Optional subset of stems to write, chosen from AVAILABLE_STEMS.
+                      Defaults to the four Demucs sources.
+        streaming (bool): Separate window by window with bounded memory. Defaults to True
+                          for recordings longer than STREAMING_THRESHOLD_SECONDS.
+        progress_callback (callable): Optional function called with each streaming progress event, and with
+                                      an {"event": "artifact", "kind": "stem", ...} event as soon as each stem is written.
+
     Returns:
-        dict: A dictionary containing the absolute paths of the separated stems, 
+        dict: A dictionary containing the absolute paths of the separated stems,
               or an error message if the process fails.
     """
     logger.info(f"Starting audio separation for: {input_file_path}")
-    
+
+    stems = list(dict.fromkeys(stems or SOURCE_STEMS))
+    unknown = [stem for stem in stems if stem not in AVAILABLE_STEMS]
+    if unknown:
+        error_msg = f"Unknown stems requested: {unknown}. Choose from {AVAILABLE_STEMS}."
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    # Demucs default output structure: output_dir/htdemucs/file_name/
+    file_name = Path(input_file_path).stem
+    target_folder = Path(output_dir) / MODEL_NAME / file_name
+
+    # If this exact audio was already separated with the same model, copy the stored stems into output_dir
+    cache_key = None
+    if os.path.exists(input_file_path):
+        cache_key = make_cache_key(
+            "separate_audio", hash_file(input_file_path),
+            model=MODEL_NAME, stems=sorted(stems), audio_format=OUTPUT_FORMAT, clip_mode=CLIP_MODE
+        )
+        cached = cache_restore(cache_key, lambda path: target_folder / Path(path).name)
+        if cached is not None:
+            return cached
+
     # Ensure the output workspace directory exists
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    
-    # Extract the base filename without extension
-    file_name = Path(input_file_path).stem
-    
-    # Construct the Demucs command using the efficient 'htdemucs' model
-    command = [
-        "demucs",
-        "-n", "htdemucs",
-        "-o", output_dir,
-        input_file_path
-    ]
-    
+
+    if streaming is None:
+        duration = _probe_duration(input_file_path)
+        streaming = duration is not None and duration > STREAMING_THRESHOLD_SECONDS
+
     try:
-        # Execute the subprocess synchronously
         logger.info("Running Demucs model... This may take a while depending on the audio length.")
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        
-        # Demucs default output structure: output_dir/htdemucs/file_name/
-        target_folder = Path(output_dir) / "htdemucs" / file_name
-        
-        # Verify the generated stems
-        tracks = ["vocals.wav", "drums.wav", "bass.wav", "other.wav"]
-        output_paths = {}
-        
-        for track in tracks:
-            track_path = target_folder / track
-            if track_path.exists():
-                output_paths[track.split('.')[0]] = str(track_path.absolute())
-            else:
-                error_msg = f"Expected output file not found: {track_path}"
-                logger.error(error_msg)
-                return {"error": error_msg}
-                
+        output_paths = None
+        if streaming:
+            logger.info(f"Streaming separation in {WINDOW_SECONDS:.0f}s windows to keep memory bounded...")
+            for event in separate_audio_streaming(input_file_path, output_dir, stems):
+                if progress_callback:
+                    progress_callback(event)
+                output_paths = event["tracks"]
+        elif SEPARATOR_BACKEND == "inprocess":
+            on_stem = None
+            if progress_callback:
+                on_stem = lambda stem, path: progress_callback({"event": "artifact", "kind": "stem", "name": stem, "path": path})
+            try:
+                output_paths = _separate_in_process(input_file_path, target_folder, stems, on_stem)
+            except (ImportError, RuntimeError) as e:
+                logger.warning(f"In-process Demucs failed ({e}). Falling back to the demucs CLI...")
+        if output_paths is None:
+            output_paths = _separate_with_cli(input_file_path, output_dir, target_folder, stems)
+
         logger.info(f"Separation completed successfully! Stems saved at: {target_folder}")
-        return {"status": "success", "tracks": output_paths}
-        
+        result = {"status": "success", "tracks": output_paths}
+        if cache_key:
+            cache_store(cache_key, "separate_audio", result, list(output_paths.values()))
+        return result
+
     except subprocess.CalledProcessError as e:
         error_msg = f"Demucs execution failed. Subprocess error: {e.stderr}"
         logger.error(error_msg)
@@ -79,11 +411,11 @@ def separate_audio(input_file_path: str, output_dir: str = "workspace/separated"
 # ==========================================
 if __name__ == "__main__":
     # Specify a valid audio file path for local testing
-    test_audio = "test.mp3" 
-    
+    test_audio = "test.mp3"
+
     if os.path.exists(test_audio):
         logger.info("Initiating local test run...")
         results = separate_audio(test_audio)
         logger.info(f"Final JSON payload to return to LLM Agent: {results}")
     else:
-        logger.warning(f"Test file '{test_audio}' not found. Please place an audio file in the current directory.")
\ No newline at end of file
+        logger.warning(f"Test file '{test_audio}' not found. Please place an audio file in the current directory.")
@@ -0,0 +1,285 @@
+# tools/tracing.py
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextlib
+import contextvars
+from pathlib import Path
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure the standard logger for the Tracing layer
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("Tool-Tracing")
+
+# ==========================================
+# Tracing configuration
+# ==========================================
+
+# Finished spans are appended here as JSON lines; set to an empty string to disable the export
+TRACE_FILE = os.getenv("MUSIC_AGENT_TRACE_FILE", "workspace/traces/spans.jsonl")
+# Port of the Prometheus-style /metrics and /ready endpoints (disabled when unset)
+METRICS_PORT = os.getenv("MUSIC_AGENT_METRICS_PORT")
+# Spans kept in memory for per-run timelines
+MAX_SPANS_IN_MEMORY = 10000
+
+# Span kinds used across the code base
+KIND_RUN = "run"
+KIND_LLM = "llm"
+KIND_TOOL = "tool"
+KIND_MODEL_LOAD = "model_load"
+KIND_INFERENCE = "inference"
+KIND_FILE_WRITE = "file_write"
+
+_current_run = contextvars.ContextVar("music_agent_run_id", default=None)
+_current_span = contextvars.ContextVar("music_agent_span_id", default=None)
+
+_lock = threading.Lock()
+_recent_spans = deque(maxlen=MAX_SPANS_IN_MEMORY)
+# (kind, name) -> aggregated counters for the metrics endpoint
+_metrics = defaultdict(lambda: defaultdict(float))
+# (metric, sorted label items) -> current value, plus each gauge's HELP text
+_gauges = {}
+_gauge_help = {}
+# Callable returning {"ready": bool, ...}; served at /ready
+_readiness_probe = None
+_metrics_server = None
+
+
+class Span:
+    """A timed unit of work. Attributes can be added while it runs via `set(...)`."""
+
+    def __init__(self, name: str, kind: str, attributes: dict):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = _current_span.get()
+        self.run_id = _current_run.get()
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.duration = None
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "run_id": self.run_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def _record(span: Span):
+    record = span.to_dict()
+    with _lock:
+        _recent_spans.append(record)
+
+        counters = _metrics[(span.kind, span.name)]
+        counters["count"] += 1
+        counters["seconds"] += span.duration
+        if span.status != "ok":
+            counters["errors"] += 1
+        for key in ("prompt_tokens", "completion_tokens", "cached_prompt_tokens", "audio_seconds", "bytes"):
+            value = span.attributes.get(key)
+            if isinstance(value, (int, float)):
+                counters[key] += value
+
+        if TRACE_FILE:
+            try:
+                Path(TRACE_FILE).parent.mkdir(parents=True, exist_ok=True)
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not export span to {TRACE_FILE}: {e}")
+
+
+# ==========================================
+# Public API
+# ==========================================
+
+@contextlib.contextmanager
+def span(name: str, kind: str, **attributes):
+    """
+    Times a block of work and records it as a span of the current run.
+
+    If the span ends with an `audio_seconds` attribute, its real-time factor
+    (processing seconds per audio second) is added as `rtf`.
+
+    Usage:
+        with span("inference.demucs", KIND_INFERENCE, audio_seconds=42.0) as s:
+            ...
+            s.set(stems=4)
+    """
+    current = Span(name, kind, attributes)
+    token = _current_span.set(current.span_id)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.status = "error"
+        current.set(error=str(e)[:200])
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        audio_seconds = current.attributes.get("audio_seconds")
+        if audio_seconds:
+            current.set(rtf=current.duration / audio_seconds)
+        _current_span.reset(token)
+        _record(current)
+
+
+@contextlib.contextmanager
+def trace_run(run_id: str = None, **attributes):
+    """Groups every span created inside the block (including tool threads started with copy_context) under one run ID."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    token = _current_run.set(run_id)
+    try:
+        with span("agent.run", KIND_RUN, **attributes) as run_span:
+            yield run_span
+    finally:
+        _current_run.reset(token)
+
+
+def current_run_id():
+    return _current_run.get()
+
+
+def get_run_spans(run_id: str) -> list:
+    """Returns the finished spans of a run, ordered by start time."""
+    with _lock:
+        spans = [record for record in _recent_spans if record["run_id"] == run_id]
+    return sorted(spans, key=lambda record: record["start"])
+
+
+def record_llm_usage(llm_span: Span, response):
+    """
+    Copies token usage from an OpenAI-compatible chat completion onto an LLM span, including the
+    prompt tokens served from the provider's prefix cache (DeepSeek and OpenAI report these differently).
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cached_tokens is None:
+            cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        llm_span.set(
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            cached_prompt_tokens=cached_tokens,
+        )
+
+
+def audio_duration_seconds(file_path: str):
+    """Duration of an audio file, for `audio_seconds` attributes; None if it cannot be read cheaply."""
+    try:
+        import soundfile as sf
+        return sf.info(file_path).duration
+    except Exception:
+        return None
+
+
+# ==========================================
+# Prometheus-style metrics
+# ==========================================
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text() -> str:
+    """Renders the aggregated span metrics in the Prometheus text exposition format."""
+    series = [
+        ("music_agent_spans_total", "counter", "Number of finished spans.", "count"),
+        ("music_agent_span_errors_total", "counter", "Number of spans that raised an error.", "errors"),
+        ("music_agent_span_seconds_total", "counter", "Total wall time spent in spans.", "seconds"),
+        ("music_agent_llm_prompt_tokens_total", "counter", "Prompt tokens sent to the LLM.", "prompt_tokens"),
+        ("music_agent_llm_cached_prompt_tokens_total", "counter", "Prompt tokens served from the LLM provider's prefix cache.", "cached_prompt_tokens"),
+        ("music_agent_llm_completion_tokens_total", "counter", "Completion tokens received from the LLM.", "completion_tokens"),
+        ("music_agent_audio_seconds_total", "counter", "Seconds of audio processed or generated.", "audio_seconds"),
+        ("music_agent_written_bytes_total", "counter", "Bytes written to disk.", "bytes"),
+    ]
+    with _lock:
+        snapshot = {key: dict(counters) for key, counters in _metrics.items()}
+
+    with _lock:
+        gauges = dict(_gauges)
+        gauge_help = dict(_gauge_help)
+
+    lines = []
+    for metric, metric_type, help_text, field in series:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for (kind, name), counters in sorted(snapshot.items()):
+            if field in counters:
+                lines.append(f'{metric}{{kind="{_escape(kind)}",name="{_escape(name)}"}} {counters[field]:g}')
+    for metric, help_text in sorted(gauge_help.items()):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for (name, labels), value in sorted(gauges.items()):
+            if name == metric:
+                label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels)
+                lines.append(f"{metric}{{{label_text}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def set_gauge(metric: str, value: float, help_text: str, **labels):
+    """Sets a gauge exported on /metrics, e.g. set_gauge("music_agent_model_ready", 1, "...", model="demucs")."""
+    with _lock:
+        _gauges[(metric, tuple(sorted(labels.items())))] = value
+        _gauge_help[metric] = help_text
+
+
+def set_readiness_probe(probe):
+    """Registers the callable behind /ready; it returns a dict whose "ready" key decides between 200 and 503."""
+    global _readiness_probe
+    _readiness_probe = probe
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/metrics":
+            status, content_type, body = 200, "text/plain; version=0.0.4", prometheus_text().encode("utf-8")
+        elif path == "/ready":
+            readiness = _readiness_probe() if _readiness_probe else {"ready": True}
+            status = 200 if readiness["ready"] else 503
+            content_type, body = "application/json", json.dumps(readiness).encode("utf-8")
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = None):
+    """Serves /metrics and /ready on a background thread (once per process). Does nothing when no port is configured."""
+    global _metrics_server
+    port = port or (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None:
+        return None
+    with _lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"Metrics endpoint listening on :{port}/metrics (readiness on /ready)")
+    return _metrics_server
@@ -1,15 +1,21 @@
 import os
 import logging
 import warnings
+import threading
+import contextvars
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # 🌟 Silence irrelevant warnings to keep the console clean
 warnings.filterwarnings("ignore")
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
-from basic_pitch.inference import predict_and_save
+from basic_pitch.inference import Model, predict
 from basic_pitch import ICASSP_2022_MODEL_PATH
 
+from tools.cache import hash_file, make_cache_key, cache_restore, cache_store
+from tools.tracing import span, audio_duration_seconds, KIND_MODEL_LOAD, KIND_INFERENCE, KIND_FILE_WRITE
+
 # Configure the standard logger for the Transcriber Tool
 logging.basicConfig(
     level=logging.INFO,
@@ -18,10 +24,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Tool-Transcriber")
 
+# Number of stems transcribed concurrently by audio_to_midi_batch
+MAX_WORKERS = int(os.getenv("MUSIC_AGENT_TRANSCRIBE_WORKERS", "4"))
+
+# Global variables: the Basic-Pitch model is loaded once and shared by every transcription
+_model = None
+_model_lock = threading.Lock()
+
+
+def _load_model():
+    """Lazily loads the Basic-Pitch model on first use and keeps it resident in memory."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            logger.info("Loading Basic-Pitch model into memory... (first call only)")
+            with span("model_load.basic_pitch", KIND_MODEL_LOAD):
+                _model = Model(ICASSP_2022_MODEL_PATH)
+    return _model
+
+
+def warm_up() -> dict:
+    """Loads Basic-Pitch and runs it on one silent window so the first request skips the TensorFlow graph setup."""
+    import numpy as np
+    from basic_pitch.constants import AUDIO_N_SAMPLES
+
+    model = _load_model()
+    model.predict(np.zeros((1, AUDIO_N_SAMPLES, 1), dtype=np.float32))
+    return {"status": "success", "model": Path(str(ICASSP_2022_MODEL_PATH)).name}
+
 def audio_to_midi(input_file_path: str, output_dir: str = "workspace/midi_outputs") -> dict:
     """
     Converts audio into a MIDI file. 
-    Added auto-overwrite logic to prevent 'File exists' errors.
+    The MIDI is named after the input file and a short hash of its content, so stems with the same
+    file name from different songs (e.g. every song's vocals.wav in one batch) get separate MIDI files.
+    An existing MIDI for the same audio is overwritten atomically.
     """
     logger.info(f"Starting Audio-to-MIDI transcription for: {input_file_path}")
     
@@ -31,42 +67,45 @@ def audio_to_midi(input_file_path: str, output_dir: str = "workspace/midi_output
         logger.error(error_msg)
         return {"error": error_msg}
 
-    # 2. Ensure output directory exists
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-    
     # Construct the target MIDI path
+    content_hash = hash_file(input_file_path)
     file_name = Path(input_file_path).stem
-    expected_midi_path = Path(output_dir) / f"{file_name}_basic_pitch.mid"
+    expected_midi_path = Path(output_dir) / f"{file_name}_{content_hash[:8]}_basic_pitch.mid"
+
+    # If this exact stem was already transcribed with the same model, copy the stored MIDI into output_dir
+    cache_key = make_cache_key(
+        "audio_to_midi", content_hash, model=Path(str(ICASSP_2022_MODEL_PATH)).name
+    )
+    cached = cache_restore(cache_key, lambda path: expected_midi_path)
+    if cached is not None:
+        return cached
 
-    # 🌟 NEW: Overwrite logic to prevent "File already exists" error
-    if expected_midi_path.exists():
-        logger.info(f"Existing MIDI found at {expected_midi_path}. Deleting for a fresh start...")
-        try:
-            expected_midi_path.unlink() # Delete the existing file
-        except Exception as e:
-            logger.warning(f"Could not delete existing MIDI: {e}")
+    # 2. Ensure output directory exists
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     try:
         logger.info("Running Spotify's Basic-Pitch model...")
         
-        # 3. Call the core prediction API
-        predict_and_save(
-            audio_path_list=[input_file_path],
-            output_directory=output_dir,
-            save_midi=True,
-            sonify_midi=False,
-            save_model_outputs=False,
-            save_notes=False,
-            model_or_model_path=ICASSP_2022_MODEL_PATH 
-        )
+        # 3. Run inference with the shared model, then write the MIDI atomically
+        # (a temp file renamed into place overwrites any previous result for this stem)
+        model = _load_model()
+        with span("inference.basic_pitch", KIND_INFERENCE, audio_seconds=audio_duration_seconds(input_file_path)):
+            _, midi_data, _ = predict(input_file_path, model)
+        with span("file_write.midi", KIND_FILE_WRITE) as write_span:
+            tmp_midi_path = expected_midi_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            midi_data.write(str(tmp_midi_path))
+            os.replace(tmp_midi_path, expected_midi_path)
+            write_span.set(bytes=expected_midi_path.stat().st_size)
         
         # 4. Final verification
         if expected_midi_path.exists():
             logger.info(f"Transcription successful! MIDI saved at: {expected_midi_path}")
-            return {
+            result = {
                 "status": "success", 
                 "midi_path": str(expected_midi_path.absolute())
             }
+            cache_store(cache_key, "audio_to_midi", result, [result["midi_path"]])
+            return result
         else:
             error_msg = f"Expected MIDI file was not generated at: {expected_midi_path}"
             logger.error(error_msg)
@@ -77,6 +116,43 @@ def audio_to_midi(input_file_path: str, output_dir: str = "workspace/midi_output
         logger.error(error_msg)
         return {"error": error_msg}
 
+def audio_to_midi_batch(input_file_paths: list, output_dir: str = "workspace/midi_outputs", max_workers: int = None) -> dict:
+    """
+    Transcribes several audio files (e.g. all four Demucs stems) in one pass.
+    The Basic-Pitch model is loaded once and inference runs concurrently on a worker pool.
+
+    Args:
+        input_file_paths (list): Paths of the audio files to transcribe.
+        output_dir (str): The directory where the MIDI files will be saved.
+        max_workers (int): Size of the worker pool. Defaults to MAX_WORKERS.
+
+    Returns:
+        dict: {"status": ..., "results": [...]} with one result dict per input, in input order.
+              A failing file only produces an "error" entry for itself.
+    """
+    logger.info(f"Starting batch transcription for {len(input_file_paths)} file(s)")
+
+    try:
+        _load_model()
+    except Exception as e:
+        error_msg = f"Could not load the Basic-Pitch model: {str(e)}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    workers = max(1, min(max_workers or MAX_WORKERS, len(input_file_paths)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each item runs in a copy of the caller's context, so its spans stay under the caller's run and span
+        futures = [
+            pool.submit(contextvars.copy_context().run, audio_to_midi, path, output_dir) for path in input_file_paths
+        ]
+        outcomes = [future.result() for future in futures]
+
+    results = [{"input_file_path": path, **outcome} for path, outcome in zip(input_file_paths, outcomes)]
+    failed = sum(1 for result in results if "error" in result)
+    status = "success" if failed == 0 else ("partial" if failed < len(results) else "failed")
+    logger.info(f"Batch transcription finished: {len(results) - failed} succeeded, {failed} failed")
+    return {"status": status, "results": results}
+
 # ==========================================
 # Local testing block
 # ==========================================